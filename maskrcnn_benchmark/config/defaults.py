@@ -447,6 +447,12 @@ _C.SOLVER.WARMUP_ITERS = 500
 _C.SOLVER.WARMUP_METHOD = "linear"
 
 _C.SOLVER.CHECKPOINT_PERIOD = 2500
+# Write the checkpoints in a background thread, training goes on once they
+# are copied to cpu memory
+_C.SOLVER.CHECKPOINT_ASYNC = False
+# Each process writes a slice of the checkpoint, instead of the main process
+# writing all of it
+_C.SOLVER.CHECKPOINT_SHARDED = False
 _C.SOLVER.TEST_PERIOD = 0
 
 # Number of images per batch
@@ -487,6 +493,15 @@ _C.TEST.GATHER_ON_CPU = False
 # if set true, will not do evaluation after inference,
 # useful for tsv dataset without label
 _C.TEST.SKIP_PERFORMANCE_EVAL = False
+# if set true, each process writes its predictions (TSV_SAVE_SUBSET) to a
+# shard tsv file while inference runs, and the main process merges the shards
+# into the predictions tsv file. Predictions are not kept in memory, so only
+# the tsv-based scene graph evaluation can follow.
+_C.TEST.STREAM_PREDICTIONS_TO_TSV = False
+# with STREAM_PREDICTIONS_TO_TSV, keep the shard files of an interrupted run
+# and only run inference on the images missing from them. The number of
+# processes may differ from the interrupted run.
+_C.TEST.RESUME_INFERENCE = False
 
 # ---------------------------------------------------------------------------- #
 # Test-time augmentations for bounding box detection
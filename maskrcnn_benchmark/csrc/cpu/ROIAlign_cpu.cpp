@@ -1,5 +1,6 @@
 // Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 #include "cpu/vision.h"
+#include <ATen/Parallel.h>
 
 // implementation taken from Caffe2
 template <typename T>
@@ -110,6 +111,39 @@ void pre_calc_for_bilinear_interpolate(
   }
 }
 
+template <typename T>
+void roi_align_bin_params(
+    const T* offset_bottom_rois,
+    const T& spatial_scale,
+    const int pooled_height,
+    const int pooled_width,
+    const int sampling_ratio,
+    T& roi_start_h,
+    T& roi_start_w,
+    T& bin_size_h,
+    T& bin_size_w,
+    int& roi_bin_grid_h,
+    int& roi_bin_grid_w) {
+  // Do not using rounding; this implementation detail is critical
+  roi_start_w = offset_bottom_rois[0] * spatial_scale;
+  roi_start_h = offset_bottom_rois[1] * spatial_scale;
+  T roi_end_w = offset_bottom_rois[2] * spatial_scale;
+  T roi_end_h = offset_bottom_rois[3] * spatial_scale;
+
+  // Force malformed ROIs to be 1x1
+  T roi_width = std::max(roi_end_w - roi_start_w, (T)1.);
+  T roi_height = std::max(roi_end_h - roi_start_h, (T)1.);
+  bin_size_h = static_cast<T>(roi_height) / static_cast<T>(pooled_height);
+  bin_size_w = static_cast<T>(roi_width) / static_cast<T>(pooled_width);
+
+  // We use roi_bin_grid to sample the grid and mimic integral
+  roi_bin_grid_h = (sampling_ratio > 0)
+      ? sampling_ratio
+      : ceil(roi_height / pooled_height); // e.g., = 2
+  roi_bin_grid_w =
+      (sampling_ratio > 0) ? sampling_ratio : ceil(roi_width / pooled_width);
+}
+
 template <typename T>
 void ROIAlignForward_cpu_kernel(
     const int nthreads,
@@ -128,10 +162,10 @@ void ROIAlignForward_cpu_kernel(
   int roi_cols = 5;
 
   int n_rois = nthreads / channels / pooled_width / pooled_height;
-  // (n, c, ph, pw) is an element in the pooled output
-  // can be parallelized using omp
-  // #pragma omp parallel for num_threads(32)
-  for (int n = 0; n < n_rois; n++) {
+  // (n, c, ph, pw) is an element in the pooled output, the rois are
+  // pooled in parallel
+  at::parallel_for(0, n_rois, 1, [&](int64_t begin, int64_t end) {
+  for (int n = begin; n < end; n++) {
     int index_n = n * channels * pooled_width * pooled_height;
 
     // roi could have 4 or 5 columns
@@ -142,28 +176,11 @@ void ROIAlignForward_cpu_kernel(
       offset_bottom_rois++;
     }
 
-    // Do not using rounding; this implementation detail is critical
-    T roi_start_w = offset_bottom_rois[0] * spatial_scale;
-    T roi_start_h = offset_bottom_rois[1] * spatial_scale;
-    T roi_end_w = offset_bottom_rois[2] * spatial_scale;
-    T roi_end_h = offset_bottom_rois[3] * spatial_scale;
-    // T roi_start_w = round(offset_bottom_rois[0] * spatial_scale);
-    // T roi_start_h = round(offset_bottom_rois[1] * spatial_scale);
-    // T roi_end_w = round(offset_bottom_rois[2] * spatial_scale);
-    // T roi_end_h = round(offset_bottom_rois[3] * spatial_scale);
-
-    // Force malformed ROIs to be 1x1
-    T roi_width = std::max(roi_end_w - roi_start_w, (T)1.);
-    T roi_height = std::max(roi_end_h - roi_start_h, (T)1.);
-    T bin_size_h = static_cast<T>(roi_height) / static_cast<T>(pooled_height);
-    T bin_size_w = static_cast<T>(roi_width) / static_cast<T>(pooled_width);
-
-    // We use roi_bin_grid to sample the grid and mimic integral
-    int roi_bin_grid_h = (sampling_ratio > 0)
-        ? sampling_ratio
-        : ceil(roi_height / pooled_height); // e.g., = 2
-    int roi_bin_grid_w =
-        (sampling_ratio > 0) ? sampling_ratio : ceil(roi_width / pooled_width);
+    T roi_start_h, roi_start_w, bin_size_h, bin_size_w;
+    int roi_bin_grid_h, roi_bin_grid_w;
+    roi_align_bin_params(offset_bottom_rois, spatial_scale, pooled_height,
+                         pooled_width, sampling_ratio, roi_start_h, roi_start_w,
+                         bin_size_h, bin_size_w, roi_bin_grid_h, roi_bin_grid_w);
 
     // We do average (integral) pooling inside a bin
     const T count = roi_bin_grid_h * roi_bin_grid_w; // e.g. = 4
@@ -216,6 +233,93 @@ void ROIAlignForward_cpu_kernel(
       } // for ph
     } // for c
   } // for n
+  });
+}
+
+// Same as ROIAlignForward_cpu_kernel, with the feature map in channels last
+// (N, H, W, C) layout: each bilinear sample is then a weighted sum of four
+// contiguous channel vectors, which is vectorized over the channels.
+template <typename T>
+void ROIAlignForward_channels_last_cpu_kernel(
+    const int n_rois,
+    const T* bottom_data,
+    const T& spatial_scale,
+    const int channels,
+    const int height,
+    const int width,
+    const int pooled_height,
+    const int pooled_width,
+    const int sampling_ratio,
+    const T* bottom_rois,
+    T* top_data) {
+  int roi_cols = 5;
+
+  at::parallel_for(0, n_rois, 1, [&](int64_t begin, int64_t end) {
+    std::vector<T> output_vals(channels);
+    for (int n = begin; n < end; n++) {
+      int index_n = n * channels * pooled_width * pooled_height;
+
+      const T* offset_bottom_rois = bottom_rois + n * roi_cols;
+      int roi_batch_ind = offset_bottom_rois[0];
+      offset_bottom_rois++;
+
+      T roi_start_h, roi_start_w, bin_size_h, bin_size_w;
+      int roi_bin_grid_h, roi_bin_grid_w;
+      roi_align_bin_params(offset_bottom_rois, spatial_scale, pooled_height,
+                           pooled_width, sampling_ratio, roi_start_h, roi_start_w,
+                           bin_size_h, bin_size_w, roi_bin_grid_h, roi_bin_grid_w);
+      const T count = roi_bin_grid_h * roi_bin_grid_w;
+
+      std::vector<PreCalc<T>> pre_calc(
+          roi_bin_grid_h * roi_bin_grid_w * pooled_width * pooled_height);
+      pre_calc_for_bilinear_interpolate(
+          height,
+          width,
+          pooled_height,
+          pooled_width,
+          roi_bin_grid_h,
+          roi_bin_grid_w,
+          roi_start_h,
+          roi_start_w,
+          bin_size_h,
+          bin_size_w,
+          roi_bin_grid_h,
+          roi_bin_grid_w,
+          pre_calc);
+
+      const T* offset_bottom_data =
+          bottom_data + roi_batch_ind * height * width * channels;
+      T* output_val = output_vals.data();
+      int pre_calc_index = 0;
+      for (int ph = 0; ph < pooled_height; ph++) {
+        for (int pw = 0; pw < pooled_width; pw++) {
+          std::fill(output_vals.begin(), output_vals.end(), (T)0.);
+          for (int iy = 0; iy < roi_bin_grid_h; iy++) {
+            for (int ix = 0; ix < roi_bin_grid_w; ix++) {
+              PreCalc<T> pc = pre_calc[pre_calc_index];
+              const T* data1 = offset_bottom_data + pc.pos1 * channels;
+              const T* data2 = offset_bottom_data + pc.pos2 * channels;
+              const T* data3 = offset_bottom_data + pc.pos3 * channels;
+              const T* data4 = offset_bottom_data + pc.pos4 * channels;
+              // same operations, in the same order, as the per channel
+              // kernel for each channel
+#pragma omp simd
+              for (int c = 0; c < channels; c++) {
+                output_val[c] += pc.w1 * data1[c] + pc.w2 * data2[c] +
+                    pc.w3 * data3[c] + pc.w4 * data4[c];
+              }
+              pre_calc_index += 1;
+            }
+          }
+
+          T* top = top_data + index_n + ph * pooled_width + pw;
+          for (int c = 0; c < channels; c++) {
+            top[c * pooled_width * pooled_height] = output_val[c] / count;
+          }
+        } // for pw
+      } // for ph
+    } // for n
+  });
 }
 
 at::Tensor ROIAlign_forward_cpu(const at::Tensor& input,
@@ -239,10 +343,36 @@ at::Tensor ROIAlign_forward_cpu(const at::Tensor& input,
     return output;
   }
 
+  auto rois_contiguous = rois.contiguous();
+  // the channels last kernel pays a copy of the feature map, unless it is
+  // already in that layout, for vectorized sampling; it is worth it when there
+  // are more sampled bins than feature map positions
+  bool channels_last = input.is_contiguous(at::MemoryFormat::ChannelsLast) ||
+      num_rois * pooled_height * pooled_width >= input.size(0) * height * width;
+  if (channels_last) {
+    auto input_channels_last = input.permute({0, 2, 3, 1}).contiguous();
+    AT_DISPATCH_FLOATING_TYPES(input.scalar_type(), "ROIAlign_forward", [&] {
+      ROIAlignForward_channels_last_cpu_kernel<scalar_t>(
+           num_rois,
+           input_channels_last.data_ptr<scalar_t>(),
+           spatial_scale,
+           channels,
+           height,
+           width,
+           pooled_height,
+           pooled_width,
+           sampling_ratio,
+           rois_contiguous.data_ptr<scalar_t>(),
+           output.data_ptr<scalar_t>());
+    });
+    return output;
+  }
+
+  auto input_contiguous = input.contiguous();
   AT_DISPATCH_FLOATING_TYPES(input.scalar_type(), "ROIAlign_forward", [&] {
     ROIAlignForward_cpu_kernel<scalar_t>(
          output_size,
-         input.data_ptr<scalar_t>(),
+         input_contiguous.data_ptr<scalar_t>(),
          spatial_scale,
          channels,
          height,
@@ -250,7 +380,7 @@ at::Tensor ROIAlign_forward_cpu(const at::Tensor& input,
          pooled_height,
          pooled_width,
          sampling_ratio,
-         rois.data_ptr<scalar_t>(),
+         rois_contiguous.data_ptr<scalar_t>(),
          output.data_ptr<scalar_t>());
   });
   return output;
@@ -1,30 +1,68 @@
 // Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 #include "cpu/vision.h"
+#include <ATen/Parallel.h>
 
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <vector>
 
+// boxes swept in parallel once there are this many
+static const int64_t kNmsGrainSize = 2048;
+
+// the indices of scores by decreasing score, ties in index order and NaN
+// first, like a stable descending at::sort
+template <typename scalar_t>
+at::Tensor stable_order_desc(const at::Tensor& scores) {
+  auto scores_c = scores.contiguous();
+  auto s = scores_c.data_ptr<scalar_t>();
+  at::Tensor order_t = at::arange(scores.size(0), scores.options().dtype(at::kLong));
+  auto order = order_t.data_ptr<int64_t>();
+  std::stable_sort(order, order + scores.size(0), [&](int64_t a, int64_t b) {
+    if (std::isnan(s[a]))
+      return !std::isnan(s[b]);
+    return s[a] > s[b];
+  });
+  return order_t;
+}
+
+// legacy_plus_one: widths and heights are x2 - x1 + 1, boxes are suppressed
+// from an overlap of threshold and the kept boxes are returned in index order,
+// as in Detectron. Otherwise widths and heights are x2 - x1, boxes are
+// suppressed above threshold and the kept boxes are returned by decreasing
+// score, as in torchvision.
 template <typename scalar_t>
 at::Tensor nms_cpu_kernel(const at::Tensor& dets,
                           const at::Tensor& scores,
-                          const float threshold) {
+                          const float threshold,
+                          const bool legacy_plus_one) {
   AT_ASSERTM(!dets.device().is_cuda(), "dets must be a CPU tensor");
   AT_ASSERTM(!scores.device().is_cuda(), "scores must be a CPU tensor");
-  AT_ASSERTM(dets.type() == scores.type(), "dets should have the same type as scores");
+  AT_ASSERTM(dets.scalar_type() == scores.scalar_type(), "dets should have the same type as scores");
 
   if (dets.numel() == 0) {
     return at::empty({0}, dets.options().dtype(at::kLong).device(at::kCPU));
   }
 
-  auto x1_t = dets.select(1, 0).contiguous();
-  auto y1_t = dets.select(1, 1).contiguous();
-  auto x2_t = dets.select(1, 2).contiguous();
-  auto y2_t = dets.select(1, 3).contiguous();
+  const scalar_t offset = legacy_plus_one ? 1 : 0;
+  at::Tensor order_t;
+  if (legacy_plus_one) {
+    order_t = std::get<1>(scores.sort(0, /* descending=*/true));
+  } else {
+    order_t = stable_order_desc<scalar_t>(scores);
+  }
 
-  at::Tensor areas_t = (x2_t - x1_t + 1) * (y2_t - y1_t + 1);
+  // the boxes, in the order they are visited, as contiguous columns
+  auto sorted_t = dets.index_select(0, order_t);
+  auto x1_t = sorted_t.select(1, 0).contiguous();
+  auto y1_t = sorted_t.select(1, 1).contiguous();
+  auto x2_t = sorted_t.select(1, 2).contiguous();
+  auto y2_t = sorted_t.select(1, 3).contiguous();
 
-  auto order_t = std::get<1>(scores.sort(0, /* descending=*/true));
+  at::Tensor areas_t = (x2_t - x1_t + offset) * (y2_t - y1_t + offset);
 
   auto ndets = dets.size(0);
-  at::Tensor suppressed_t = at::zeros({ndets}, dets.options().dtype(at::kByte).device(at::kCPU));
+  at::Tensor suppressed_t = at::ones({ndets}, dets.options().dtype(at::kByte).device(at::kCPU));
 
   auto suppressed = suppressed_t.data_ptr<uint8_t>();
   auto order = order_t.data_ptr<int64_t>();
@@ -34,42 +72,124 @@ at::Tensor nms_cpu_kernel(const at::Tensor& dets,
   auto y2 = y2_t.data_ptr<scalar_t>();
   auto areas = areas_t.data_ptr<scalar_t>();
 
-  for (int64_t _i = 0; _i < ndets; _i++) {
-    auto i = order[_i];
-    if (suppressed[i] == 1)
+  // the boxes are visited by decreasing score, and each kept box sweeps the
+  // boxes after it. To sweep only the boxes which may overlap it, the boxes
+  // still to be visited are also kept sorted by x1: with a positive
+  // threshold, a box starting more than offset pixels after the end of the
+  // kept box has a zero overlap (widths are x2 - x1 + offset), and so do all
+  // the boxes after it in x1 order.
+  // (NaN coordinates cannot be sorted, all boxes are swept then)
+  bool sorted_sweep = threshold > 0 && !at::isnan(sorted_t).any().item<bool>();
+  std::vector<int64_t> by_x1(ndets);
+  for (int64_t i = 0; i < ndets; i++) {
+    by_x1[i] = i;
+  }
+  if (sorted_sweep) {
+    std::sort(by_x1.begin(), by_x1.end(),
+              [&](int64_t a, int64_t b) { return x1[a] < x1[b]; });
+  }
+  std::vector<scalar_t> by_x1_x1(ndets);
+  // and a box starting more than the largest width before the start of the
+  // kept box ends before it, the bound is loose by a few pixels for rounding
+  double max_width = 0;
+  for (int64_t k = 0; k < ndets; k++) {
+    by_x1_x1[k] = x1[by_x1[k]];
+    max_width = std::max(max_width, (double)x2[k] - (double)x1[k]);
+  }
+  std::vector<uint8_t> visited(ndets, 0);
+  int64_t num_by_x1 = ndets;
+  int64_t num_visited = 0;
+  std::vector<int64_t> keep;
+
+  for (int64_t i = 0; i < ndets; i++) {
+    if (visited[i])
       continue;
+    visited[i] = 1;
+    suppressed[order[i]] = 0;
+    keep.push_back(order[i]);
+    num_visited++;
     auto ix1 = x1[i];
     auto iy1 = y1[i];
     auto ix2 = x2[i];
     auto iy2 = y2[i];
     auto iarea = areas[i];
 
-    for (int64_t _j = _i + 1; _j < ndets; _j++) {
-      auto j = order[_j];
-      if (suppressed[j] == 1)
-        continue;
-      auto xx1 = std::max(ix1, x1[j]);
-      auto yy1 = std::max(iy1, y1[j]);
-      auto xx2 = std::min(ix2, x2[j]);
-      auto yy2 = std::min(iy2, y2[j]);
-
-      auto w = std::max(static_cast<scalar_t>(0), xx2 - xx1 + 1);
-      auto h = std::max(static_cast<scalar_t>(0), yy2 - yy1 + 1);
-      auto inter = w * h;
-      auto ovr = inter / (iarea + areas[j] - inter);
-      if (ovr >= threshold)
-        suppressed[j] = 1;
-   }
+    int64_t begin = 0;
+    int64_t end = num_by_x1;
+    if (sorted_sweep) {
+      double min_x1 = (double)ix1 - max_width - 3;
+      begin = std::partition_point(
+          by_x1_x1.begin(), by_x1_x1.begin() + num_by_x1,
+          [&](scalar_t x) { return (double)x < min_x1; }) - by_x1_x1.begin();
+      end = std::partition_point(
+          by_x1_x1.begin() + begin, by_x1_x1.begin() + num_by_x1,
+          [&](scalar_t x) { return !(x - ix2 > offset); }) - by_x1_x1.begin();
+    }
+
+    // the boxes of the sweep are only suppressed by box i, so they can be
+    // swept in any order
+    std::atomic<int64_t> num_suppressed(0);
+    auto sweep = [&](int64_t begin, int64_t end) {
+      int64_t n = 0;
+      for (int64_t k = begin; k < end; k++) {
+        auto j = by_x1[k];
+        if (visited[j])
+          continue;
+        auto xx1 = std::max(ix1, x1[j]);
+        auto yy1 = std::max(iy1, y1[j]);
+        auto xx2 = std::min(ix2, x2[j]);
+        auto yy2 = std::min(iy2, y2[j]);
+
+        auto w = std::max(static_cast<scalar_t>(0), xx2 - xx1 + offset);
+        auto h = std::max(static_cast<scalar_t>(0), yy2 - yy1 + offset);
+        auto inter = w * h;
+        auto ovr = inter / (iarea + areas[j] - inter);
+        if (legacy_plus_one ? ovr >= threshold : ovr > threshold) {
+          visited[j] = 1;
+          n++;
+        }
+      }
+      num_suppressed += n;
+    };
+    if (end - begin > kNmsGrainSize) {
+      at::parallel_for(begin, end, kNmsGrainSize, sweep);
+    } else {
+      sweep(begin, end);
+    }
+    num_visited += num_suppressed;
+    if (num_visited == ndets)
+      break;
+
+    // drop the visited boxes from the x1 order once they are the majority
+    if (2 * (num_visited - (ndets - num_by_x1)) > num_by_x1) {
+      int64_t num_left = 0;
+      for (int64_t k = 0; k < num_by_x1; k++) {
+        if (!visited[by_x1[k]]) {
+          by_x1[num_left] = by_x1[k];
+          by_x1_x1[num_left] = by_x1_x1[k];
+          num_left++;
+        }
+      }
+      num_by_x1 = num_left;
+    }
+  }
+  if (legacy_plus_one) {
+    // in index order, as in Detectron
+    return at::nonzero(suppressed_t == 0).squeeze(1);
   }
-  return at::nonzero(suppressed_t == 0).squeeze(1);
+  // by decreasing score, as in torchvision
+  at::Tensor keep_t = at::empty({(int64_t)keep.size()}, dets.options().dtype(at::kLong).device(at::kCPU));
+  std::copy(keep.begin(), keep.end(), keep_t.data_ptr<int64_t>());
+  return keep_t;
 }
 
 at::Tensor nms_cpu(const at::Tensor& dets,
                const at::Tensor& scores,
-               const float threshold) {
+               const float threshold,
+               const bool legacy_plus_one) {
   at::Tensor result;
   AT_DISPATCH_FLOATING_TYPES(dets.scalar_type(), "nms", [&] {
-    result = nms_cpu_kernel<scalar_t>(dets, scores, threshold);
+    result = nms_cpu_kernel<scalar_t>(dets, scores, threshold, legacy_plus_one);
   });
   return result;
 }
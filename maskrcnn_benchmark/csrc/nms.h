@@ -7,12 +7,15 @@
 #endif
 
 
+// legacy_plus_one: see nms_cpu, the cuda kernel only implements it
 at::Tensor nms(const at::Tensor& dets,
                const at::Tensor& scores,
-               const float threshold) {
+               const float threshold,
+               const bool legacy_plus_one) {
 
   if (dets.device().is_cuda()) {
 #ifdef WITH_CUDA
+    AT_ASSERTM(legacy_plus_one, "the cuda nms only implements legacy_plus_one");
     // TODO raise error if not compiled with CUDA
     if (dets.numel() == 0)
       return at::empty({0}, dets.options().dtype(at::kLong).device(at::kCPU));
@@ -23,6 +26,6 @@ at::Tensor nms(const at::Tensor& dets,
 #endif
   }
 
-  at::Tensor result = nms_cpu(dets, scores, threshold);
+  at::Tensor result = nms_cpu(dets, scores, threshold, legacy_plus_one);
   return result;
 }
@@ -7,7 +7,9 @@
 #include "deform_pool.h"
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
-  m.def("nms", &nms, "non-maximum suppression");
+  m.def("nms", &nms, "non-maximum suppression",
+        py::arg("dets"), py::arg("scores"), py::arg("threshold"),
+        py::arg("legacy_plus_one") = true);
   m.def("roi_align_forward", &ROIAlign_forward, "ROIAlign_forward");
   m.def("roi_align_backward", &ROIAlign_backward, "ROIAlign_backward");
   m.def("roi_pool_forward", &ROIPool_forward, "ROIPool_forward");
@@ -1,2 +1,2 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
-from .build import make_data_loader
+from .build import make_data_loader, make_subset_data_loader
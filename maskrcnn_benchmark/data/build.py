@@ -194,3 +194,28 @@ def make_data_loader(cfg, is_train=True, is_distributed=False, start_iter=0, is_
         assert len(data_loaders) == 1
         return data_loaders[0]
     return data_loaders
+
+
+def make_subset_data_loader(data_loader, indices, is_distributed=False):
+    """Rebuilds a test data loader of make_data_loader to only go over the
+    dataset indices, e.g. the images left to process when resuming
+    inference. They are split among the processes if is_distributed."""
+    if is_distributed:
+        sampler = samplers.DistributedSubsetSampler(indices)
+    else:
+        sampler = samplers.DistributedSubsetSampler(indices, num_replicas=1, rank=0)
+    batch_sampler = data_loader.batch_sampler
+    if isinstance(batch_sampler, samplers.GroupedBatchSampler) and len(sampler) > 0:
+        batch_sampler = samplers.GroupedBatchSampler(
+            sampler, batch_sampler.group_ids, batch_sampler.batch_size, drop_uneven=False
+        )
+    else:
+        batch_sampler = torch.utils.data.sampler.BatchSampler(
+            sampler, batch_sampler.batch_size, drop_last=False
+        )
+    return torch.utils.data.DataLoader(
+        data_loader.dataset,
+        num_workers=data_loader.num_workers,
+        batch_sampler=batch_sampler,
+        collate_fn=data_loader.collate_fn,
+    )
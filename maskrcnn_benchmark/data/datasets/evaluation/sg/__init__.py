@@ -5,7 +5,8 @@ import logging
 from .sg_tsv_eval import do_sg_evaluation
 
 
-def sg_evaluation(dataset, predictions, output_folder, box_only, **_):
+def sg_evaluation(dataset, predictions, output_folder, box_only, sg_eval_num_workers=0,
+                  sg_eval_num_threads=0, **_):
     logger = logging.getLogger("scene_graph_generation.inference")
     logger.warning("performing scene graph evaluation.")
     return do_sg_evaluation(
@@ -13,4 +14,6 @@ def sg_evaluation(dataset, predictions, output_folder, box_only, **_):
         predictions=predictions,
         output_folder=output_folder,
         logger=logger,
+        num_workers=sg_eval_num_workers,
+        num_threads=sg_eval_num_threads,
     )
@@ -33,3 +33,33 @@ def bbox_overlaps(anchors, gt_boxes):
     overlaps = iw * ih / ua
 
     return overlaps
+
+
+def bbox_overlaps_batch(anchors, gt_boxes):
+    """
+    anchors: (B, N, 4) tensor of float
+    gt_boxes: (B, K, 4) tensor of float
+    overlaps: (B, N, K) tensor of overlap between the boxes of each batch
+    element, computed like bbox_overlaps
+    """
+    gt_boxes_area = ((gt_boxes[:, :, 2] - gt_boxes[:, :, 0] + 1) *
+                     (gt_boxes[:, :, 3] - gt_boxes[:, :, 1] + 1)).unsqueeze(1)
+
+    anchors_area = ((anchors[:, :, 2] - anchors[:, :, 0] + 1) *
+                    (anchors[:, :, 3] - anchors[:, :, 1] + 1)).unsqueeze(2)
+
+    boxes = anchors.unsqueeze(2)
+    query_boxes = gt_boxes.unsqueeze(1)
+
+    iw = (torch.min(boxes[..., 2], query_boxes[..., 2]) -
+          torch.max(boxes[..., 0], query_boxes[..., 0]) + 1)
+    iw[iw < 0] = 0
+
+    ih = (torch.min(boxes[..., 3], query_boxes[..., 3]) -
+          torch.max(boxes[..., 1], query_boxes[..., 1]) + 1)
+    ih[ih < 0] = 0
+
+    ua = anchors_area + gt_boxes_area - (iw * ih)
+    overlaps = iw * ih / ua
+
+    return overlaps
@@ -2,8 +2,9 @@
 # Adapted from https://github.com/danfeiX/scene-graph-TF-release (Danfei Xu) and https://github.com/rowanz/neural-motifs (Rowan Zellers).
 import torch
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
-from .box import bbox_overlaps
+from .box import bbox_overlaps, bbox_overlaps_batch
 
 MODES = ('sgdet', 'sgcls', 'predcls')
 
@@ -33,6 +34,12 @@ class BasicSceneGraphEvaluator:
         # self.print_stats()
         return res
 
+    def evaluate_scene_graph_entries(self, gt_entries, pred_entries, iou_thresh=0.5,
+                                     batch_size=64, num_threads=0):
+        evaluate_batch_from_dicts(gt_entries, pred_entries, self.mode, self.result_dict,
+                                  multiple_preds=self.multiple_preds, iou_thresh=iou_thresh,
+                                  batch_size=batch_size, num_threads=num_threads)
+
     def save(self, fn):
         np.save(fn, self.result_dict)
 
@@ -66,19 +73,7 @@ def evaluate_from_dict(gt_entry, pred_entry, mode, result_dict, multiple_preds=F
             result_dict[mode + '_recall'][k].append(0)
         return None, None, None
 
-    if mode == 'predcls':
-        pred_boxes = gt_boxes
-        pred_classes = gt_classes
-        obj_scores = np.ones(gt_classes.shape[0])
-    elif mode == 'sgcls':
-        pred_boxes = gt_boxes
-        pred_classes = pred_entry['pred_classes']
-        obj_scores = pred_entry['obj_scores']
-    elif mode == 'sgdet' or mode == 'phrdet':
-        pred_boxes = pred_entry['pred_boxes'].astype(float)
-        pred_classes = pred_entry['pred_classes']
-        obj_scores = pred_entry['obj_scores']
-    elif mode == 'preddet':
+    if mode == 'preddet':
         # Only extract the indices that appear in GT
         prc = intersect_2d(pred_rel_inds, gt_rels[:, :2])
         if prc.size == 0:
@@ -99,18 +94,9 @@ def evaluate_from_dict(gt_entry, pred_entry, mode, result_dict, multiple_preds=F
             rec_i = float(matches[:k].any(0).sum()) / float(gt_rels.shape[0])
             result_dict[mode + '_recall'][k].append(rec_i)
         return None, None, None
-    else:
-        raise ValueError('invalid mode')
 
-    if multiple_preds:
-        obj_scores_per_rel = obj_scores[pred_rel_inds].prod(1)
-        overall_scores = obj_scores_per_rel[:, None] * rel_scores[:, 1:]
-        score_inds = argsort_desc(overall_scores)[:100]
-        pred_rels = np.column_stack((pred_rel_inds[score_inds[:, 0]], score_inds[:, 1] + 1))
-        predicate_scores = rel_scores[score_inds[:, 0], score_inds[:, 1] + 1]
-    else:
-        pred_rels = np.column_stack((pred_rel_inds, 1 + rel_scores[:, 1:].argmax(1)))
-        predicate_scores = rel_scores[:, 1:].max(1)
+    pred_rels, pred_boxes, pred_classes, predicate_scores, obj_scores = _get_pred_rels(
+        gt_entry, pred_entry, mode, multiple_preds=multiple_preds)
 
     pred_to_gt, pred_5ples, rel_scores = evaluate_recall(
         gt_rels, gt_boxes, gt_classes,
@@ -149,6 +135,120 @@ def evaluate_from_dict(gt_entry, pred_entry, mode, result_dict, multiple_preds=F
     #     viz_dict[mode + '_pred2gt_rel'] = pred_to_gt
 
 
+def _get_pred_rels(gt_entry, pred_entry, mode, multiple_preds=False):
+    """
+    The predicted relations (id0, id1, rel) to evaluate in mode, with the boxes, classes
+    and scores they refer to. Not for preddet, which only looks at the GT pairs.
+    """
+    gt_boxes = gt_entry['gt_boxes'].astype(float)
+    gt_classes = gt_entry['gt_classes']
+
+    pred_rel_inds = pred_entry['pred_rel_inds']
+    rel_scores = pred_entry['rel_scores']
+
+    if mode == 'predcls':
+        pred_boxes = gt_boxes
+        pred_classes = gt_classes
+        obj_scores = np.ones(gt_classes.shape[0])
+    elif mode == 'sgcls':
+        pred_boxes = gt_boxes
+        pred_classes = pred_entry['pred_classes']
+        obj_scores = pred_entry['obj_scores']
+    elif mode == 'sgdet' or mode == 'phrdet':
+        pred_boxes = pred_entry['pred_boxes'].astype(float)
+        pred_classes = pred_entry['pred_classes']
+        obj_scores = pred_entry['obj_scores']
+    else:
+        raise ValueError('invalid mode')
+
+    if multiple_preds:
+        obj_scores_per_rel = obj_scores[pred_rel_inds].prod(1)
+        overall_scores = obj_scores_per_rel[:, None] * rel_scores[:, 1:]
+        score_inds = argsort_desc(overall_scores)[:100]
+        pred_rels = np.column_stack((pred_rel_inds[score_inds[:, 0]], score_inds[:, 1] + 1))
+        predicate_scores = rel_scores[score_inds[:, 0], score_inds[:, 1] + 1]
+    else:
+        pred_rels = np.column_stack((pred_rel_inds, 1 + rel_scores[:, 1:].argmax(1)))
+        predicate_scores = rel_scores[:, 1:].max(1)
+    return pred_rels, pred_boxes, pred_classes, predicate_scores, obj_scores
+
+
+def evaluate_batch_from_dicts(gt_entries, pred_entries, mode, result_dict, multiple_preds=False,
+                              iou_thresh=0.5, batch_size=64, num_threads=0):
+    """
+    Appends to result_dict the same recalls as evaluate_from_dict on each pair of
+    entries, in the same order. The triplets of batch_size images are padded and
+    matched at once, in a pool of num_threads threads if num_threads > 1.
+    """
+    ks = list(result_dict[mode + '_recall'])
+
+    def evaluate_batch(start):
+        recalls = [None] * len(gt_entries[start:start + batch_size])
+        to_match = []
+        for i, (gt_entry, pred_entry) in enumerate(zip(gt_entries[start:start + batch_size],
+                                                       pred_entries[start:start + batch_size])):
+            if mode == 'preddet' or len(pred_entry['pred_rel_inds']) == 0:
+                # no boxes to match
+                image_result = {mode + '_recall': {k: [] for k in ks}}
+                evaluate_from_dict(gt_entry, pred_entry, mode, image_result,
+                                   multiple_preds=multiple_preds, iou_thresh=iou_thresh)
+                recalls[i] = [image_result[mode + '_recall'][k][0] for k in ks]
+                continue
+            pred_rels, pred_boxes, pred_classes, predicate_scores, obj_scores = _get_pred_rels(
+                gt_entry, pred_entry, mode, multiple_preds=multiple_preds)
+            gt_triplets, gt_triplet_boxes, pred_triplets, pred_triplet_boxes, _, sorted_inds = \
+                _get_sorted_triplets(gt_entry['gt_relations'], gt_entry['gt_boxes'].astype(float),
+                                     gt_entry['gt_classes'], pred_rels, pred_boxes, pred_classes,
+                                     predicate_scores, obj_scores)
+            # R@K only looks at the top K predictions
+            sorted_inds = sorted_inds[:max(ks)]
+            to_match.append((i, gt_triplets, gt_triplet_boxes,
+                             pred_triplets[sorted_inds], pred_triplet_boxes[sorted_inds]))
+        if len(to_match) > 0:
+            batch_recalls = _compute_recall_batch(to_match, ks, iou_thresh, phrdet=mode == 'phrdet')
+            for entry, recall in zip(to_match, batch_recalls):
+                recalls[entry[0]] = recall
+        return recalls
+
+    starts = range(0, len(gt_entries), batch_size)
+    if num_threads > 1:
+        # most of the work is done by numpy and torch, which release the GIL
+        with ThreadPoolExecutor(num_threads) as pool:
+            batch_recalls = list(pool.map(evaluate_batch, starts))
+    else:
+        batch_recalls = [evaluate_batch(start) for start in starts]
+
+    for recalls in batch_recalls:
+        for recall in recalls:
+            for k, rec_i in zip(ks, recall):
+                result_dict[mode + '_recall'][k].append(rec_i)
+
+
+def _compute_recall_batch(batch, ks, iou_thresh, phrdet=False):
+    """
+    Pads the (index, gt_triplets, gt_boxes, pred_triplets, pred_boxes) of each image
+    of batch and returns the list of R@K, for K in ks, of each image
+    """
+    num_gt = np.array([len(entry[1]) for entry in batch])
+    num_pred = np.array([len(entry[3]) for entry in batch])
+    triplet_dtype = np.result_type(*[entry[1] for entry in batch], *[entry[3] for entry in batch])
+    gt_triplets = np.zeros((len(batch), num_gt.max(), 3), dtype=triplet_dtype)
+    gt_boxes = np.zeros((len(batch), num_gt.max(), 8))
+    pred_triplets = np.zeros((len(batch), num_pred.max(), 3), dtype=triplet_dtype)
+    pred_boxes = np.zeros((len(batch), num_pred.max(), 8))
+    for i, (_, gt_t, gt_b, pred_t, pred_b) in enumerate(batch):
+        gt_triplets[i, :len(gt_t)] = gt_t
+        gt_boxes[i, :len(gt_b)] = gt_b
+        pred_triplets[i, :len(pred_t)] = pred_t
+        pred_boxes[i, :len(pred_b)] = pred_b
+
+    matches = _compute_pred_matches_batch(gt_triplets, pred_triplets, gt_boxes, pred_boxes,
+                                          num_gt, num_pred, iou_thresh, phrdet=phrdet)
+    # a GT is recalled at K if one of the top K predictions matches it
+    recalls = np.column_stack([matches[:, :, :k].any(2).sum(1) / num_gt for k in ks])
+    return recalls.tolist()
+
+
 ###########################
 def evaluate_recall(gt_rels, gt_boxes, gt_classes,
                     pred_rels, pred_boxes, pred_classes, rel_scores=None, cls_scores=None,
@@ -170,6 +270,35 @@ def evaluate_recall(gt_rels, gt_boxes, gt_classes,
     if pred_rels.size == 0:
         return [[]], np.zeros((0, 5)), np.zeros(0)
 
+    gt_triplets, gt_triplet_boxes, pred_triplets, pred_triplet_boxes, relation_scores, \
+        sorted_inds = _get_sorted_triplets(gt_rels, gt_boxes, gt_classes, pred_rels, pred_boxes,
+                                           pred_classes, rel_scores, cls_scores)
+
+    # Compute recall. It's most efficient to match once and then do recall after
+    pred_to_gt = _compute_pred_matches(
+        gt_triplets,
+        pred_triplets[sorted_inds],
+        gt_triplet_boxes,
+        pred_triplet_boxes[sorted_inds],
+        iou_thresh,
+        phrdet=phrdet,
+    )
+
+    # Contains some extra stuff for visualization. Not needed.
+    pred_5ples = np.column_stack((
+        pred_rels[:, :2],
+        pred_triplets[:, [0, 2, 1]],
+    ))
+
+    return pred_to_gt, pred_5ples, relation_scores
+
+
+def _get_sorted_triplets(gt_rels, gt_boxes, gt_classes,
+                         pred_rels, pred_boxes, pred_classes, rel_scores, cls_scores):
+    """
+    The GT and predicted triplets with their boxes, and the order of the predicted ones
+    by decreasing overall score. See evaluate_recall for the arguments.
+    """
     num_gt_boxes = gt_boxes.shape[0]
     num_gt_relations = gt_rels.shape[0]
     assert num_gt_relations != 0
@@ -197,23 +326,8 @@ def evaluate_recall(gt_rels, gt_boxes, gt_classes,
     #     print("Somehow the relations weren't sorted properly: \n{}".format(scores_overall))
     #     raise ValueError("Somehow the relations werent sorted properly")
 
-    # Compute recall. It's most efficient to match once and then do recall after
-    pred_to_gt = _compute_pred_matches(
-        gt_triplets,
-        pred_triplets[sorted_inds],
-        gt_triplet_boxes,
-        pred_triplet_boxes[sorted_inds],
-        iou_thresh,
-        phrdet=phrdet,
-    )
-
-    # Contains some extra stuff for visualization. Not needed.
-    pred_5ples = np.column_stack((
-        pred_rels[:, :2],
-        pred_triplets[:, [0, 2, 1]],
-    ))
-
-    return pred_to_gt, pred_5ples, relation_scores
+    return gt_triplets, gt_triplet_boxes, pred_triplets, pred_triplet_boxes, \
+        relation_scores, sorted_inds
 
 
 def _triplet(predicates, relations, classes, boxes,
@@ -267,35 +381,63 @@ def _compute_pred_matches(gt_triplets, pred_triplets,
     keeps = intersect_2d(gt_triplets, pred_triplets)
     gt_has_match = keeps.any(1)
     pred_to_gt = [[] for x in range(pred_boxes.shape[0])]
-    for gt_ind, gt_box, keep_inds in zip(np.where(gt_has_match)[0],
-                                         gt_boxes[gt_has_match],
-                                         keeps[gt_has_match],
-                                         ):
-        boxes = pred_boxes[keep_inds]
-        if phrdet:
-            # Evaluate where the union box > 0.5
-            gt_box_union = gt_box.reshape((2, 4))
-            gt_box_union = np.concatenate((gt_box_union.min(0)[:2], gt_box_union.max(0)[2:]), 0)
-
-            box_union = boxes.reshape((-1, 2, 4))
-            box_union = np.concatenate((box_union.min(1)[:, :2], box_union.max(1)[:, 2:]), 1)
-
-            inds = bbox_overlaps(torch.from_numpy(gt_box_union[None]),
-                                 torch.from_numpy(box_union)).numpy() >= iou_thresh
-
-        else:
-            sub_iou = bbox_overlaps(torch.from_numpy(gt_box[None, :4]).contiguous(),
-                                    torch.from_numpy(boxes[:, :4]).contiguous()).numpy()[0]
-            obj_iou = bbox_overlaps(torch.from_numpy(gt_box[None, 4:]).contiguous(),
-                                    torch.from_numpy(boxes[:, 4:]).contiguous()).numpy()[0]
-
-            inds = (sub_iou >= iou_thresh) & (obj_iou >= iou_thresh)
-
-        for i in np.where(keep_inds)[0][inds]:
-            pred_to_gt[i].append(int(gt_ind))
+    if not gt_has_match.any():
+        return pred_to_gt
+    # the overlaps of all the (GT with a match, pred) pairs at once
+    gt_boxes = gt_boxes[gt_has_match]
+    if phrdet:
+        # Evaluate where the union box > 0.5
+        inds = bbox_overlaps(torch.from_numpy(_union_boxes(gt_boxes)),
+                             torch.from_numpy(_union_boxes(pred_boxes))).numpy() >= iou_thresh
+    else:
+        sub_iou = bbox_overlaps(torch.from_numpy(gt_boxes[:, :4]).contiguous(),
+                                torch.from_numpy(pred_boxes[:, :4]).contiguous()).numpy()
+        obj_iou = bbox_overlaps(torch.from_numpy(gt_boxes[:, 4:]).contiguous(),
+                                torch.from_numpy(pred_boxes[:, 4:]).contiguous()).numpy()
+        inds = (sub_iou >= iou_thresh) & (obj_iou >= iou_thresh)
+
+    gt_inds = np.where(gt_has_match)[0]
+    for gt_ind, pred_ind in zip(*np.where(keeps[gt_has_match] & inds)):
+        pred_to_gt[pred_ind].append(int(gt_inds[gt_ind]))
     return pred_to_gt
 
 
+def _compute_pred_matches_batch(gt_triplets, pred_triplets, gt_boxes, pred_boxes,
+                                num_gt, num_pred, iou_thresh, phrdet=False):
+    """
+    Same as _compute_pred_matches for a batch of images, whose triplets are padded
+    :param gt_triplets: [B, #gt, 3] array of GT triplets
+    :param pred_triplets: [B, #pred, 3] array of pred triplets
+    :param gt_boxes: [B, #gt, 8] array of GT triplet boxes
+    :param pred_boxes: [B, #pred, 8] array of pred triplet boxes
+    :param num_gt: [B] array of the number of GT triplets of each image
+    :param num_pred: [B] array of the number of pred triplets of each image
+    :param iou_thresh:
+    :return: [B, #gt, #pred] bool array, True where the pred matches the GT
+    """
+    matches = (gt_triplets[:, :, None, :] == pred_triplets[:, None, :, :]).all(3)
+    # ignore the padding
+    matches &= np.arange(gt_triplets.shape[1])[None, :, None] < num_gt[:, None, None]
+    matches &= np.arange(pred_triplets.shape[1])[None, None, :] < num_pred[:, None, None]
+    if phrdet:
+        iou = bbox_overlaps_batch(torch.from_numpy(_union_boxes(gt_boxes)),
+                                  torch.from_numpy(_union_boxes(pred_boxes))).numpy()
+        matches &= iou >= iou_thresh
+    else:
+        sub_iou = bbox_overlaps_batch(torch.from_numpy(gt_boxes[..., :4]).contiguous(),
+                                      torch.from_numpy(pred_boxes[..., :4]).contiguous()).numpy()
+        obj_iou = bbox_overlaps_batch(torch.from_numpy(gt_boxes[..., 4:]).contiguous(),
+                                      torch.from_numpy(pred_boxes[..., 4:]).contiguous()).numpy()
+        matches &= (sub_iou >= iou_thresh) & (obj_iou >= iou_thresh)
+    return matches
+
+
+def _union_boxes(triplet_boxes):
+    # [..., 8] subject and object boxes to [..., 4] boxes enclosing both
+    boxes = triplet_boxes.reshape(triplet_boxes.shape[:-1] + (2, 4))
+    return np.concatenate((boxes.min(-2)[..., :2], boxes.max(-2)[..., 2:]), -1)
+
+
 def intersect_2d(x1, x2):
     """
     Given two arrays [m1, n], [m2,n], returns a [m1, m2] array where each entry is True if those
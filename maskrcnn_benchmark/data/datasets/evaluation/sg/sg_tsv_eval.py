@@ -1,38 +1,115 @@
 # Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license. 
 import os
 import json
+import multiprocessing
 from collections import defaultdict
 import base64
 
 import numpy as np
 import torch
+from maskrcnn_benchmark.structures.boxlist_ops import unique_relation_labels
+from maskrcnn_benchmark.structures.tsv_file import TSVFile
 from maskrcnn_benchmark.structures.tsv_file_ops import tsv_reader
 from .evaluator import BasicSceneGraphEvaluator
 from .box import bbox_overlaps
 
 
-def do_sg_evaluation(dataset, predictions, output_folder, logger):
+def do_sg_evaluation(dataset, predictions, output_folder, logger, num_workers=0,
+                     num_threads=0):
     """
-    scene graph generation evaluation
+    scene graph generation evaluation. predictions is the dict of
+    SceneParserOutputs of the images; when it is None, the predictions are
+    read from predictions.tsv in output_folder. With num_workers > 1, the
+    images are split into contiguous shards which a pool of processes
+    evaluates, and the per-image recalls of the shards are concatenated in
+    order, so the metrics do not depend on the number of workers.
+    num_threads is passed to evaluate_images.
     """
 
     prediction_file = os.path.join(output_folder, 'predictions.tsv')
 
-    gt_dicts = prepare_vrd_groundtruths(dataset)
-
-    predict_dicts = prepare_vrd_predictions(prediction_file, dataset.labelmap)
-
-    evaluator = BasicSceneGraphEvaluator.all_modes(multiple_preds=False)
-
     top_Ns = [20, 50, 100]
     mode = "sgdet"
-    result_dict = {}
     danfei_metric = {}
     rowan_metric = {}
 
-    result_dict[mode + '_recall'] = {20: [], 50: [], 100: []}
-    for image_key, gt_boxlist in gt_dicts.items():
-        sg_prediction = predict_dicts[image_key]
+    if num_workers > 1:
+        shards = np.array_split(np.arange(len(dataset)), num_workers)
+        # forked workers inherit the dataset and predictions instead of
+        # unpickling them
+        context = multiprocessing.get_context('fork')
+        with context.Pool(num_workers, initializer=_set_eval_inputs,
+                          initargs=(dataset, predictions)) as pool:
+            shard_results = pool.map(_evaluate_shard, [
+                (prediction_file, shard.tolist(), mode, top_Ns, num_threads)
+                for shard in shards])
+    else:
+        shard_results = [evaluate_images(dataset, predictions, prediction_file,
+                                         range(len(dataset)), mode, top_Ns,
+                                         num_threads=num_threads)]
+
+    evaluator = BasicSceneGraphEvaluator(mode, multiple_preds=False)
+    result_dict = {mode + '_recall': {k: [] for k in top_Ns}}
+    for shard_evaluator_dict, shard_result_dict in shard_results:
+        for k in top_Ns:
+            evaluator.result_dict[mode + '_recall'][k].extend(shard_evaluator_dict[mode + '_recall'][k])
+            result_dict[mode + '_recall'][k].extend(shard_result_dict[mode + '_recall'][k])
+
+    evaluator.print_stats(logger)
+    rowan_nums = {mode+str(key): np.mean(np.array(val))
+                    for key, val in evaluator.result_dict[mode + '_recall'].items()}
+    rowan_metric.update(rowan_nums)
+
+    logger.warning('=====================' + mode + '(IMP)' + '=========================')
+    logger.warning("{}-recall@20: {}".format(mode, np.mean(np.array(result_dict[mode + '_recall'][20]))))
+    logger.warning("{}-recall@50: {}".format(mode, np.mean(np.array(result_dict[mode + '_recall'][50]))))
+    logger.warning("{}-recall@100: {}".format(mode, np.mean(np.array(result_dict[mode + '_recall'][100]))))
+    danfei_nums = {mode+str(key): np.mean(np.array(val)) for key, val in result_dict[mode + '_recall'].items()}
+    danfei_metric.update(danfei_nums)
+
+    return {"danfei_metric": danfei_metric, "rowan_metric": rowan_metric}
+
+
+_eval_dataset = None
+_eval_predictions = None
+
+
+def _set_eval_inputs(dataset, predictions):
+    global _eval_dataset, _eval_predictions
+    _eval_dataset = dataset
+    _eval_predictions = predictions
+
+
+def _evaluate_shard(args):
+    prediction_file, indices, mode, top_Ns, num_threads = args
+    return evaluate_images(_eval_dataset, _eval_predictions, prediction_file,
+                           indices, mode, top_Ns, num_threads=num_threads)
+
+
+def evaluate_images(dataset, predictions, prediction_file, indices, mode, top_Ns,
+                    chunk_size=1024, num_threads=0):
+    """
+    Evaluates the images indices of dataset. Returns the result_dict of the
+    motif-style BasicSceneGraphEvaluator and the one of the IMP-style evaluate,
+    with one recall per image in the order of indices. The ground truth and
+    predictions are loaded one image at a time and the motif-style evaluator
+    runs every chunk_size images, so memory does not grow with the split. It
+    matches the batches of images of a chunk in num_threads threads.
+    """
+    indices = list(indices)
+    image_keys = [dataset.get_img_key(idx) for idx in indices]
+    groundtruths = iter_vrd_groundtruths(dataset, indices)
+    if predictions is not None:
+        sg_predictions = iter_vrd_predictions_from_outputs(predictions, dataset, indices)
+    else:
+        # the rows of predictions.tsv are normally in the order of the dataset
+        sg_predictions = iter_vrd_predictions(prediction_file, dataset.labelmap, image_keys,
+                                              start_row=indices[0] if indices else 0)
+
+    evaluator = BasicSceneGraphEvaluator(mode, multiple_preds=False)
+    result_dict = {mode + '_recall': {k: [] for k in top_Ns}}
+    gt_entries, pred_entries = [], []
+    for gt_boxlist, sg_prediction in zip(groundtruths, sg_predictions):
         if len(sg_prediction)==0:
             sg_prediction = {'bboxes':torch.as_tensor([]) , 'bbox_scores':torch.tensor([]), 'bbox_labels':torch.tensor([]), 'relation_pairs':torch.tensor([]), 'relation_scores':torch.tensor([]), 'relation_scores_all':torch.tensor([]), 'relation_labels':torch.tensor([])}
 
@@ -71,29 +148,20 @@ def do_sg_evaluation(dataset, predictions, output_folder, logger):
                 'rel_scores': fp_pred[sorted_inds],
             }
 
-        evaluator[mode].evaluate_scene_graph_entry(
-            gt_entry,
-            pred_entry,
-        )
+        gt_entries.append(gt_entry)
+        pred_entries.append(pred_entry)
+        if len(gt_entries) == chunk_size:
+            evaluator.evaluate_scene_graph_entries(gt_entries, pred_entries,
+                                                   num_threads=num_threads)
+            gt_entries, pred_entries = [], []
 
-        evaluate(gt_boxlist.get_field("labels"), gt_boxlist.bbox, gt_boxlist.get_field("pred_labels"),
+        evaluate(gt_boxlist.get_field("labels"), gt_boxlist.bbox, gt_boxlist.get_field("relation_labels"),
                     sg_prediction['bboxes'], sg_prediction['bbox_scores'], sg_prediction['bbox_labels'],
                     sg_prediction['relation_pairs'], sg_prediction['relation_scores_all'],
                     top_Ns, result_dict, mode)
 
-    evaluator[mode].print_stats(logger)
-    rowan_nums = {mode+str(key): np.mean(np.array(val))
-                    for key, val in evaluator[mode].result_dict[mode + '_recall'].items()}
-    rowan_metric.update(rowan_nums)
-
-    logger.warning('=====================' + mode + '(IMP)' + '=========================')
-    logger.warning("{}-recall@20: {}".format(mode, np.mean(np.array(result_dict[mode + '_recall'][20]))))
-    logger.warning("{}-recall@50: {}".format(mode, np.mean(np.array(result_dict[mode + '_recall'][50]))))
-    logger.warning("{}-recall@100: {}".format(mode, np.mean(np.array(result_dict[mode + '_recall'][100]))))
-    danfei_nums = {mode+str(key): np.mean(np.array(val)) for key, val in result_dict[mode + '_recall'].items()}
-    danfei_metric.update(danfei_nums)
-
-    return {"danfei_metric": danfei_metric, "rowan_metric": rowan_metric}
+    evaluator.evaluate_scene_graph_entries(gt_entries, pred_entries, num_threads=num_threads)
+    return evaluator.result_dict, result_dict
 
 
 def evaluate(gt_classes, gt_boxes, gt_rels,
@@ -101,9 +169,11 @@ def evaluate(gt_classes, gt_boxes, gt_rels,
              rel_inds, rel_scores,
              top_Ns, result_dict,
              mode, iou_thresh=0.5):
+    # gt_rels are the (subj_id, obj_id, predicate) relation_labels triplets,
+    # which are evaluated like the dense pred_labels matrix they fill.
     gt_classes = gt_classes.cpu()
     gt_boxes = gt_boxes.cpu()
-    gt_rels = gt_rels.cpu()
+    gt_rels = unique_relation_labels(gt_rels.cpu())
 
     obj_rois = obj_rois.cpu()
     obj_scores = obj_scores.cpu()
@@ -111,27 +181,20 @@ def evaluate(gt_classes, gt_boxes, gt_rels,
     rel_inds = rel_inds.cpu()
     rel_scores = rel_scores.cpu()
 
-    if gt_rels.ne(0).sum() == 0:
+    if len(gt_rels) == 0:
         return (None, None)
-    
+
     if len(rel_inds) == 0:
         for k in result_dict[mode + '_recall']:
             result_dict[mode + '_recall'][k].append(0)
         return (None, None)
 
-    rel_sum = ((gt_rels.sum(1) > 0).int() + (gt_rels.sum(0) > 0).int())
-    ix_w_rel = rel_sum.nonzero(as_tuple=False).numpy().squeeze()
-
-    # label = (((gt_rel_label.sum(1) == 0).int() + (gt_rel_label.sum(0) == 0).int()) == 2)
-    # change_ix = label.nonzero(as_tuple=False)
-
     gt_boxes = gt_boxes.numpy()
     num_gt_boxes = gt_boxes.shape[0]
-    gt_relations = gt_rels.nonzero(as_tuple=False).numpy()
+    gt_relations = gt_rels[:, :2].numpy()
     gt_classes = gt_classes.view(-1, 1).numpy()
 
-    gt_rels_view = gt_rels.contiguous().view(-1)
-    gt_pred_labels = gt_rels_view[gt_rels_view.nonzero(as_tuple=False).squeeze()].contiguous().view(-1, 1).numpy()
+    gt_pred_labels = gt_rels[:, 2:].numpy()
 
     num_gt_relations = gt_relations.shape[0]
     if num_gt_relations == 0:
@@ -226,59 +289,65 @@ def evaluate(gt_classes, gt_boxes, gt_rels,
 def _triplet(predicates, relations, classes, boxes,
              predicate_scores, class_scores, is_pred=False):
     # format predictions into triplets
-
-    # compute the overlaps between boxes
-    if is_pred:
-        overlaps = bbox_overlaps(torch.from_numpy(boxes).contiguous(), torch.from_numpy(boxes).contiguous())
-
     assert (predicates.shape[0] == relations.shape[0])
     num_relations = relations.shape[0]
-    triplets = np.zeros([num_relations, 3]).astype(np.int32)
-    triplet_boxes = np.zeros([num_relations, 8]).astype(np.int32)
-    triplet_scores = np.zeros([num_relations]).astype(np.float32)
-    for i in range(num_relations):
-        triplets[i, 1] = predicates[i]
-        sub_i, obj_i = relations[i, :2]
-        triplets[i, 0] = classes[sub_i]
-        triplets[i, 2] = classes[obj_i]
-        triplet_boxes[i, :4] = boxes[sub_i, :]
-        triplet_boxes[i, 4:] = boxes[obj_i, :]
-        # compute triplet score
-        score = class_scores[sub_i]
-        score *= class_scores[obj_i]
-
-        if is_pred:
-            if overlaps[sub_i, obj_i] == 0:
-                score *= 0
-            else:
-                score *= predicate_scores[i]
-        else:
-            score *= predicate_scores[i]
-
-        triplet_scores[i] = score
+    if num_relations == 0:
+        return np.zeros([0, 3], dtype=np.int32), np.zeros([0, 8], dtype=np.int32), \
+            np.zeros([0], dtype=np.float32)
+    relations = np.asarray(relations).reshape(num_relations, -1)
+    sub_inds, obj_inds = relations[:, 0], relations[:, 1]
+    classes = np.asarray(classes).reshape(-1)
+
+    triplets = np.column_stack((
+        classes[sub_inds],
+        np.asarray(predicates).reshape(-1),
+        classes[obj_inds],
+    )).astype(np.int32)
+    triplet_boxes = np.column_stack((boxes[sub_inds], boxes[obj_inds])).astype(np.int32)
+    # compute triplet score
+    scores = class_scores[sub_inds] * class_scores[obj_inds]
+    if is_pred:
+        # compute the overlaps between boxes
+        overlaps = bbox_overlaps(torch.from_numpy(boxes).contiguous(),
+                                 torch.from_numpy(boxes).contiguous()).numpy()
+        scores = np.where(overlaps[sub_inds, obj_inds] == 0,
+                          scores * 0, scores * predicate_scores)
+    else:
+        scores = scores * predicate_scores
+    triplet_scores = scores.astype(np.float32)
     return triplets, triplet_boxes, triplet_scores
 
 
+def _triplet_matches(gt_triplets, pred_triplets, columns):
+    # (num_gt, num_pred) mask of the pairs which agree on the given triplet
+    # columns. Each distinct row is encoded as one integer key, so only the
+    # keys are compared pairwise.
+    gt_triplets = np.asarray(gt_triplets)[:, columns]
+    pred_triplets = np.asarray(pred_triplets).reshape(-1, 3)[:, columns]
+    _, keys = np.unique(np.concatenate((gt_triplets, pred_triplets)),
+                        axis=0, return_inverse=True)
+    keys = keys.reshape(-1)
+    return keys[:len(gt_triplets), None] == keys[None, len(gt_triplets):]
+
+
+def _recall(gt_triplets, pred_triplets, gt_boxes, pred_boxes, iou_thresh,
+            columns, box_slices):
+    # number of gt triplets matched by a prediction which agrees on columns
+    # and overlaps on every box of box_slices.
+    if len(gt_triplets) == 0:
+        return 0.0
+    matches = _triplet_matches(gt_triplets, pred_triplets, columns)
+    pred_boxes = np.asarray(pred_boxes).reshape(-1, 8)
+    for box_slice in box_slices:
+        matches &= iou_matrix(gt_boxes[:, box_slice], pred_boxes[:, box_slice]) >= iou_thresh
+    return float(matches.any(axis=1).sum())
+
+
 def _relation_recall(gt_triplets, pred_triplets,
                      gt_boxes, pred_boxes, iou_thresh):
     # compute the R@K metric for a set of predicted triplets
-    num_gt = gt_triplets.shape[0]
-    num_correct_pred_gt = 0
-    for gt, gt_box in zip(gt_triplets, gt_boxes):
-        keep = np.zeros(pred_triplets.shape[0]).astype(bool)
-        for i, pred in enumerate(pred_triplets):
-            if gt[0] == pred[0] and gt[1] == pred[1] and gt[2] == pred[2]:
-                keep[i] = True
-        if not np.any(keep):
-            continue
-        boxes = pred_boxes[keep, :]
-        sub_iou = iou(gt_box[:4], boxes[:, :4])
-        obj_iou = iou(gt_box[4:], boxes[:, 4:])
-        inds = np.intersect1d(np.where(sub_iou >= iou_thresh)[0],
-                              np.where(obj_iou >= iou_thresh)[0])
-        if inds.size > 0:
-            num_correct_pred_gt += 1
-    return float(num_correct_pred_gt)
+    return _recall(gt_triplets, pred_triplets, gt_boxes, pred_boxes, iou_thresh,
+                   [0, 1, 2], [slice(0, 4), slice(4, 8)])
 
 
 def _relation_recall_triplet(gt_triplets, pred_triplets,
@@ -311,43 +380,15 @@ def _relation_recall_triplet(gt_triplets, pred_triplets,
 def _object_recall(gt_triplets, pred_triplets,
                    gt_boxes, pred_boxes, iou_thresh):
     # compute the R@K metric for a set of predicted triplets
-    num_gt = gt_triplets.shape[0]
-    num_correct_pred_gt = 0
-    for gt, gt_box in zip(gt_triplets, gt_boxes):
-        keep = np.zeros(pred_triplets.shape[0]).astype(bool)
-        for i, pred in enumerate(pred_triplets):
-            if gt[0] == pred[0]:
-                keep[i] = True
-        if not np.any(keep):
-            continue
-        boxes = pred_boxes[keep, :]
-        box_iou = iou(gt_box[:4], boxes[:, :4])
-        inds = np.where(box_iou >= iou_thresh)[0]
-        if inds.size > 0:
-            num_correct_pred_gt += 1
-    return float(num_correct_pred_gt)
+    return _recall(gt_triplets, pred_triplets, gt_boxes, pred_boxes, iou_thresh,
+                   [0], [slice(0, 4)])
 
 
 def _predicate_recall(gt_triplets, pred_triplets,
                       gt_boxes, pred_boxes, iou_thresh):
     # compute the R@K metric for a set of predicted triplets
-    num_gt = gt_triplets.shape[0]
-    num_correct_pred_gt = 0
-    for gt, gt_box in zip(gt_triplets, gt_boxes):
-        keep = np.zeros(pred_triplets.shape[0]).astype(bool)
-        for i, pred in enumerate(pred_triplets):
-            if gt[1] == pred[1]:
-                keep[i] = True
-        if not np.any(keep):
-            continue
-        boxes = pred_boxes[keep, :]
-        sub_iou = iou(gt_box[:4], boxes[:, :4])
-        obj_iou = iou(gt_box[4:], boxes[:, 4:])
-        inds = np.intersect1d(np.where(sub_iou >= iou_thresh)[0],
-                              np.where(obj_iou >= iou_thresh)[0])
-        if inds.size > 0:
-            num_correct_pred_gt += 1
-    return float(num_correct_pred_gt)
+    return _recall(gt_triplets, pred_triplets, gt_boxes, pred_boxes, iou_thresh,
+                   [1], [slice(0, 4), slice(4, 8)])
 
 
 def iou(gt_box, pred_boxes):
@@ -366,29 +407,99 @@ def iou(gt_box, pred_boxes):
     overlaps = inters / uni
     return overlaps
 
+
+def iou_matrix(gt_boxes, pred_boxes):
+    # iou between every pair of gt and predicted boxes, same as iou row by row
+    gt_boxes = gt_boxes[:, None, :]
+    pred_boxes = pred_boxes[None, :, :]
+    ixmin = np.maximum(gt_boxes[..., 0], pred_boxes[..., 0])
+    iymin = np.maximum(gt_boxes[..., 1], pred_boxes[..., 1])
+    ixmax = np.minimum(gt_boxes[..., 2], pred_boxes[..., 2])
+    iymax = np.minimum(gt_boxes[..., 3], pred_boxes[..., 3])
+    iw = np.maximum(ixmax - ixmin + 1., 0.)
+    ih = np.maximum(iymax - iymin + 1., 0.)
+    inters = iw * ih
+    # union
+    uni = ((gt_boxes[..., 2] - gt_boxes[..., 0] + 1.) * (gt_boxes[..., 3] - gt_boxes[..., 1] + 1.) +
+           (pred_boxes[..., 2] - pred_boxes[..., 0] + 1.) *
+           (pred_boxes[..., 3] - pred_boxes[..., 1] + 1.) - inters)
+    overlaps = inters / uni
+    return overlaps
+
+def _parse_vrd_prediction(prediction_json, labelmap):
+    predictions = json.loads(prediction_json)
+    bboxes = []
+    bbox_scores = []
+    bbox_labels = []
+    for obj in predictions['objects']:
+        bboxes.append(obj['rect'])
+        bbox_scores.append(obj['conf'])
+        bbox_labels.append(labelmap['class_to_ind'][obj['class']])
+    idx_pairs = []
+    relation_scores = []
+    relation_scores_all = []
+    relation_labels = []
+    for triplet in predictions['relations']:
+        idx_pairs.append([triplet['subj_id'], triplet['obj_id']])
+        relation_scores.append(triplet['conf'])
+        relation_scores_all.append(np.frombuffer(base64.b64decode(triplet['scores_all']), np.float32))
+        relation_labels.append(labelmap['relation_to_ind'][triplet['class']])
+
+    return {'bboxes':torch.as_tensor(bboxes).reshape(-1, 4) , 'bbox_scores':torch.tensor(bbox_scores), 'bbox_labels':torch.tensor(bbox_labels), 'relation_pairs':torch.tensor(idx_pairs), 'relation_scores':torch.tensor(relation_scores), 'relation_scores_all':torch.tensor(np.array(relation_scores_all, dtype=np.float32)), 'relation_labels':torch.tensor(relation_labels)}
+
+def iter_vrd_predictions(pred_tsv_file, labelmap, image_keys, start_row=0):
+    """
+    Yields the predictions of image_keys in order, {} for an image without
+    a row in pred_tsv_file. The rows are looked up via the lineidx: they
+    normally come in the order of image_keys, from start_row on, and are read
+    in lockstep, the keys of all rows are only indexed when a key is not at
+    the next row.
+    """
+    tsv = TSVFile(pred_tsv_file, generate_lineidx=True)
+    num_rows = tsv.num_rows()
+    next_row = start_row
+    key_to_row = None
+    for img_key in image_keys:
+        if next_row < num_rows and tsv.seek_first_column(next_row) == img_key:
+            row = next_row
+        else:
+            if key_to_row is None:
+                key_to_row = {tsv.seek_first_column(i): i for i in range(num_rows)}
+            row = key_to_row.get(img_key)
+        if row is None:
+            yield {}
+            continue
+        yield _parse_vrd_prediction(tsv.seek(row)[1], labelmap)
+        next_row = row + 1
+
+def iter_vrd_predictions_from_outputs(predictions, dataset, indices):
+    # same as iter_vrd_predictions on the tsv which convert_predictions_to_tsv
+    # writes from predictions, without the json and base64 encoding.
+    for idx in indices:
+        if idx not in predictions:
+            yield {}
+            continue
+        img_info = dataset.get_img_info(idx)
+        prediction = predictions[idx].predictions.resize((img_info['width'], img_info['height']))
+        prediction_pairs = predictions[idx].prediction_pairs
+        yield {
+            'bboxes': prediction.bbox.float().reshape(-1, 4),
+            'bbox_scores': prediction.get_field('scores').float(),
+            'bbox_labels': prediction.get_field('labels').long(),
+            'relation_pairs': prediction_pairs.get_field('idx_pairs').long(),
+            'relation_scores': prediction_pairs.get_field('scores').float(),
+            'relation_scores_all': prediction_pairs.get_field('scores_all').float(),
+            'relation_labels': prediction_pairs.get_field('labels').long() + 1,
+        }
+
+def iter_vrd_groundtruths(dataset, indices):
+    for idx in indices:
+        yield dataset.get_groundtruth(idx)
+
 def prepare_vrd_predictions(pred_tsv_file, labelmap):
     predictions_dict = defaultdict(dict)
     for row in tsv_reader(pred_tsv_file):
-        img_key = row[0]
-        predictions = json.loads(row[1])
-        bboxes = []
-        bbox_scores = []
-        bbox_labels = []
-        for obj in predictions['objects']:
-            bboxes.append(obj['rect'])
-            bbox_scores.append(obj['conf'])
-            bbox_labels.append(labelmap['class_to_ind'][obj['class']])
-        idx_pairs = []
-        relation_scores = []
-        relation_scores_all = []
-        relation_labels = []
-        for triplet in predictions['relations']:
-            idx_pairs.append([triplet['subj_id'], triplet['obj_id']])
-            relation_scores.append(triplet['conf'])
-            relation_scores_all.append(np.frombuffer(base64.b64decode(triplet['scores_all']), np.float32))
-            relation_labels.append(labelmap['relation_to_ind'][triplet['class']])
-
-        predictions_dict[img_key] = {'bboxes':torch.as_tensor(bboxes).reshape(-1, 4) , 'bbox_scores':torch.tensor(bbox_scores), 'bbox_labels':torch.tensor(bbox_labels), 'relation_pairs':torch.tensor(idx_pairs), 'relation_scores':torch.tensor(relation_scores), 'relation_scores_all':torch.tensor(relation_scores_all), 'relation_labels':torch.tensor(relation_labels)}
+        predictions_dict[row[0]] = _parse_vrd_prediction(row[1], labelmap)
     return predictions_dict
 
 def prepare_vrd_groundtruths(dataset):
@@ -2,12 +2,12 @@
 import json
 import torch
 import math
-import numpy as np
 
 from maskrcnn_benchmark.structures.tsv_file import TSVFile
 from .tsv_dataset import TSVYamlDataset
 from .utils.load_files import find_file_path_in_yaml
 from .utils.label_loader import LabelLoader
+from .utils.label_store import LabelStore
 from maskrcnn_benchmark.structures.boxlist_ops import cat_boxlist
 
 
@@ -31,6 +31,7 @@ class RelationTSVDataset(TSVYamlDataset):
         self.detector_pre_calculated = kwargs['args'].MODEL.ROI_RELATION_HEAD.DETECTOR_PRE_CALCULATED if kwargs['args'] is not None else False
 
         self.contrastive_loss_on = kwargs['args'].MODEL.ROI_RELATION_HEAD.CONTRASTIVE_LOSS.USE_FLAG if kwargs['args'] is not None else False
+        self.contrastive_loss_sparse_overlaps = kwargs['args'].MODEL.ROI_RELATION_HEAD.CONTRASTIVE_LOSS.SPARSE_GT_OVERLAPS if kwargs['args'] is not None else False
         
         # construct maps
         jsondict_file = find_file_path_in_yaml(self.cfg.get("labelmap", self.cfg.get("jsondict", None)), self.root) # previous version use jsondict
@@ -63,6 +64,13 @@ class RelationTSVDataset(TSVYamlDataset):
                 labelmap=self.labelmap,
                 extra_fields=extra_fields,
             )
+
+        # optional columnar copy of the label file, see utils/label_store.py
+        self.label_store = None
+        label_store_file = find_file_path_in_yaml(self.cfg.get('label_store', None), self.root)
+        if self.is_load_label and label_store_file is not None:
+            self.label_store = LabelStore(label_store_file)
+            self.label_store.check_labelmap(self.labelmap)
         
         # load pre-calculated object detection bounding boxes and features
         self.predictedbbox_conf_threshold = 0.0
@@ -81,6 +89,22 @@ class RelationTSVDataset(TSVYamlDataset):
                 target = self.label_loader.relation_loader(annotations["relations"], target)
             return target
 
+    def get_target_from_label_store(self, idx, img_size):
+        if self.is_load_label:
+            entry = self.label_store[self.get_line_no(idx)]
+            target = self.label_loader.load_from_store(entry, img_size, remove_empty=False)
+            if self.relation_on:
+                target = self.label_loader.relation_loader_from_store(
+                    entry['relations'], target, self.label_store)
+            return target
+
+    def get_target(self, idx, img_size):
+        # labels from the label store skip json decoding of the label file.
+        if self.label_store is not None:
+            return self.get_target_from_label_store(idx, img_size)
+        annotations = self.get_annotations(idx)
+        return self.get_target_from_annotations(annotations, img_size)
+
     def apply_transforms(self, img, target=None, pre_calculate_boxlist=None):
         if self.transforms is not None:
             if pre_calculate_boxlist is not None:
@@ -142,8 +166,7 @@ class RelationTSVDataset(TSVYamlDataset):
     def __getitem__(self, idx):
         img = self.get_image(idx)
         img_size = img.size # w, h
-        annotations = self.get_annotations(idx)
-        target = self.get_target_from_annotations(annotations, img_size)
+        target = self.get_target(idx, img_size)
         detection_boxlist = self.load_detection_result(idx, img_size, conf_threshold=self.predictedbbox_conf_threshold, detections_per_img=self.detections_per_img) if self.detector_pre_calculated else None
         img, target, detection_boxlist = self.apply_transforms(img, target, detection_boxlist)
         new_img_size = img.shape[1:]
@@ -159,62 +182,39 @@ class RelationTSVDataset(TSVYamlDataset):
 
     def contrastive_loss_target_transform(self, target):
         # add relationship annotations
-        relation_triplets = target.get_field("relation_labels")
-        sbj_gt_boxes = np.zeros((len(relation_triplets), 4), dtype=np.float32)
-        obj_gt_boxes = np.zeros((len(relation_triplets), 4), dtype=np.float32)
-        sbj_gt_classes_minus_1 = np.zeros(len(relation_triplets), dtype=np.int32)
-        obj_gt_classes_minus_1 = np.zeros(len(relation_triplets), dtype=np.int32)
-        prd_gt_classes_minus_1 = np.zeros(len(relation_triplets), dtype=np.int32)
-        for ix, rel in enumerate(relation_triplets):
-            # sbj
-            sbj_gt_box = target.bbox[rel[0]]
-            sbj_gt_boxes[ix] = sbj_gt_box
-            # sbj_gt_classes_minus_1[ix] = rel['subject']['category']  # excludes background
-            sbj_gt_classes_minus_1[ix] = target.get_field('labels')[rel[0]] - 1  # excludes background
-            # obj
-            obj_gt_box = target.bbox[rel[1]]
-            obj_gt_boxes[ix] = obj_gt_box
-            # obj_gt_classes_minus_1[ix] = rel['object']['category']  # excludes background
-            obj_gt_classes_minus_1[ix] = target.get_field('labels')[rel[1]] - 1  # excludes background
-            # prd
-            # prd_gt_classes_minus_1[ix] = rel['predicate']  # excludes background
-            prd_gt_classes_minus_1[ix] = rel[2] - 1  # excludes background
-
-        target.add_field('sbj_gt_boxes', torch.from_numpy(sbj_gt_boxes))
-        target.add_field('obj_gt_boxes', torch.from_numpy(obj_gt_boxes))
-        target.add_field('sbj_gt_classes_minus_1', torch.from_numpy(sbj_gt_classes_minus_1))
-        target.add_field('obj_gt_classes_minus_1', torch.from_numpy(obj_gt_classes_minus_1))
-        target.add_field('prd_gt_classes_minus_1', torch.from_numpy(prd_gt_classes_minus_1))
+        relation_triplets = target.get_field("relation_labels").long().view(-1, 3)
+        num_relations = len(relation_triplets)
+        labels = target.get_field('labels')
+        sbj_inds = relation_triplets[:, 0]
+        obj_inds = relation_triplets[:, 1]
+
+        # sbj / obj / prd, class ids exclude background
+        sbj_gt_classes_minus_1 = (labels[sbj_inds] - 1).int()
+        obj_gt_classes_minus_1 = (labels[obj_inds] - 1).int()
+        prd_gt_classes_minus_1 = (relation_triplets[:, 2] - 1).int()
+        target.add_field('sbj_gt_boxes', target.bbox[sbj_inds].float())
+        target.add_field('obj_gt_boxes', target.bbox[obj_inds].float())
+        target.add_field('sbj_gt_classes_minus_1', sbj_gt_classes_minus_1)
+        target.add_field('obj_gt_classes_minus_1', obj_gt_classes_minus_1)
+        target.add_field('prd_gt_classes_minus_1', prd_gt_classes_minus_1)
 
         # misc
         num_obj_classes = len(self.class_to_ind) - 1  # excludes background
         num_prd_classes = len(self.relation_to_ind) - 1  # excludes background
 
-        sbj_gt_overlaps = np.zeros(
-            (len(relation_triplets), num_obj_classes), dtype=np.float32)
-        for ix in range(len(relation_triplets)):
-            sbj_cls = sbj_gt_classes_minus_1[ix]
-            sbj_gt_overlaps[ix, sbj_cls] = 1.0
-        # sbj_gt_overlaps = scipy.sparse.csr_matrix(sbj_gt_overlaps)
-        target.add_field('sbj_gt_overlaps', torch.from_numpy(sbj_gt_overlaps))
-
-        obj_gt_overlaps = np.zeros(
-            (len(relation_triplets), num_obj_classes), dtype=np.float32)
-        for ix in range(len(relation_triplets)):
-            obj_cls = obj_gt_classes_minus_1[ix]
-            obj_gt_overlaps[ix, obj_cls] = 1.0
-        # obj_gt_overlaps = scipy.sparse.csr_matrix(obj_gt_overlaps)
-        target.add_field('obj_gt_overlaps', torch.from_numpy(obj_gt_overlaps))
-
-        prd_gt_overlaps = np.zeros(
-            (len(relation_triplets), num_prd_classes), dtype=np.float32)
-        pair_to_gt_ind_map = np.zeros(
-            (len(relation_triplets)), dtype=np.int32)
-        for ix in range(len(relation_triplets)):
-            prd_cls = prd_gt_classes_minus_1[ix]
-            prd_gt_overlaps[ix, prd_cls] = 1.0
-            pair_to_gt_ind_map[ix] = ix
-        # prd_gt_overlaps = scipy.sparse.csr_matrix(prd_gt_overlaps)
-        target.add_field('prd_gt_overlaps', torch.from_numpy(prd_gt_overlaps))
-        target.add_field('pair_to_gt_ind_map', torch.from_numpy(pair_to_gt_ind_map))
-    
\ No newline at end of file
+        target.add_field('sbj_gt_overlaps', self._one_hot_overlaps(sbj_gt_classes_minus_1, num_obj_classes))
+        target.add_field('obj_gt_overlaps', self._one_hot_overlaps(obj_gt_classes_minus_1, num_obj_classes))
+        target.add_field('prd_gt_overlaps', self._one_hot_overlaps(prd_gt_classes_minus_1, num_prd_classes))
+        target.add_field('pair_to_gt_ind_map', torch.arange(num_relations, dtype=torch.int32))
+
+    def _one_hot_overlaps(self, classes, num_classes):
+        # one row per relation with 1.0 at its class. The sparse form only
+        # keeps the num_relations non-zero entries.
+        rows = torch.arange(len(classes))
+        if self.contrastive_loss_sparse_overlaps:
+            return torch.sparse_coo_tensor(
+                torch.stack((rows, classes.long())), torch.ones(len(classes)),
+                (len(classes), num_classes))
+        overlaps = torch.zeros((len(classes), num_classes), dtype=torch.float32)
+        overlaps[rows, classes.long()] = 1.0
+        return overlaps
@@ -7,16 +7,18 @@ import os.path as op
 import numpy as np
 
 from maskrcnn_benchmark.structures.tsv_file import TSVFile
+from maskrcnn_benchmark.structures.image_bin_file import ImageBinFile, is_image_bin_file
 from .utils.load_files import load_linelist_file, load_from_yaml_file
 from .utils.load_files import find_file_path_in_yaml
-from .utils.image_ops import img_from_base64
+from .utils.image_ops import img_from_base64, img_from_bytes
 
 class TSVDataset(object):
     def __init__(self, img_file, label_file=None, hw_file=None,
                  linelist_file=None):
         """Constructor.
         Args:
-            img_file: Image file with image key and base64 encoded image str.
+            img_file: Image file with image key and base64 encoded image str,
+                or an image bin file (.bin) with image key and raw image bytes.
             label_file: An optional label file with image key and label information. 
                 A label_file is required for training and optional for testing.
             hw_file: An optional file with image key and image height/width info.
@@ -28,7 +30,12 @@ class TSVDataset(object):
         self.hw_file = hw_file
         self.linelist_file = linelist_file
 
-        self.img_tsv = TSVFile(img_file)
+        if is_image_bin_file(img_file):
+            self.img_tsv = ImageBinFile(img_file)
+            self.img_decoder = img_from_bytes
+        else:
+            self.img_tsv = TSVFile(img_file)
+            self.img_decoder = img_from_base64
         self.label_tsv = None if label_file is None else TSVFile(label_file)
         self.hw_tsv = None if hw_file is None else TSVFile(hw_file)
         self.line_list = load_linelist_file(linelist_file)
@@ -54,9 +61,8 @@ class TSVDataset(object):
 
     def get_image(self, idx): 
         line_no = self.get_line_no(idx)
-        row = self.img_tsv.seek(line_no)
         # use -1 to support old format with multiple columns.
-        img = img_from_base64(row[-1])
+        img = self.img_decoder(self.img_tsv.seek_column(line_no, -1))
         return img
 
     def get_annotations(self, idx):
@@ -103,7 +109,7 @@ class TSVDataset(object):
         elif self.label_tsv:
             return self.label_tsv.seek(line_no)[0]
         else:
-            return self.img_tsv.seek(line_no)[0]
+            return self.img_tsv.get_key(line_no)
 
 
 class TSVYamlDataset(TSVDataset):
@@ -1,15 +1,23 @@
 # Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license. 
-import base64
+import binascii
 from PIL import Image
 import io
 
 
 def img_from_base64(imagestring):
+    # binascii accepts str, bytes and memoryviews (e.g. TSVFile.seek_column)
+    # without an intermediate copy.
     try:
-        img = Image.open(io.BytesIO(base64.b64decode(imagestring)))
+        img = Image.open(io.BytesIO(binascii.a2b_base64(imagestring)))
         return img.convert('RGB')
     except ValueError:
         return None
 
 
-
+def img_from_bytes(imagebytes):
+    # raw encoded image bytes, e.g. a memoryview from ImageBinFile.
+    try:
+        img = Image.open(io.BytesIO(imagebytes))
+        return img.convert('RGB')
+    except ValueError:
+        return None
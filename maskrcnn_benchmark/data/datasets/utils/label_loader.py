@@ -1,15 +1,20 @@
 # Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license. 
 import torch
 import numpy as np
-import base64
+import binascii
 import collections
 
 from maskrcnn_benchmark.structures.bounding_box import BoxList
 
 
 class LabelLoader(object):
-    def __init__(self, labelmap, extra_fields=(), filter_duplicate_relations=False, ignore_attr=None, ignore_rel=None):
+    def __init__(self, labelmap, extra_fields=(), filter_duplicate_relations=False, ignore_attr=None, ignore_rel=None,
+                 dense_relations=False):
+        # relations are loaded as relation_labels (subj_id, obj_id, predicate)
+        # triplets. dense_relations also adds the M*M pred_labels matrix, which
+        # boxlist_pred_labels otherwise materializes where it is needed.
         self.labelmap = labelmap
+        self.dense_relations = dense_relations
         self.extra_fields = extra_fields
         self.supported_fields = ["class", "conf", "attributes", 'scores_all', 'boxes_all', 'feature']
         self.filter_duplicate_relations = filter_duplicate_relations
@@ -48,47 +53,65 @@ class LabelLoader(object):
         target = target.clip_to_image(remove_empty=remove_empty)
         return target
 
+    def load_from_store(self, entry, img_size, remove_empty=False, load_fields=None):
+        """Same as __call__, but for a row of a LabelStore: the fields are
+        already decoded, so they are only copied out of the store. Fields of
+        images without objects keep their dtype and trailing dimensions."""
+        target = BoxList(torch.from_numpy(np.array(entry['boxes'])), img_size, mode="xyxy")
+
+        if load_fields is None:
+            load_fields = self.extra_fields
+
+        store_fields = {"class": ("labels", "labels"),
+                        "conf": ("scores", "scores"),
+                        "attributes": ("attributes", "attributes")}
+        for field in load_fields:
+            assert field in store_fields, "Unsupported field {} for label store".format(field)
+            column, name = store_fields[field]
+            target.add_field(name, torch.from_numpy(np.array(entry[column])))
+
+        target = target.clip_to_image(remove_empty=remove_empty)
+        return target
+
     def add_classes(self, annotations):
-        class_names = [obj["class"] for obj in annotations]
-        classes = [None] * len(class_names)       
-        for i in range(len(class_names)):
-            classes[i] = self.labelmap['class_to_ind'][class_names[i]]
-        return torch.tensor(classes)
+        class_to_ind = self.labelmap['class_to_ind']
+        return torch.tensor([class_to_ind[obj["class"]] for obj in annotations],
+                            dtype=torch.int64)
 
     def add_confidences(self, annotations):
-        confidences = []
-        for obj in annotations:
-            if "conf" in obj:
-                confidences.append(obj["conf"])
-            else:
-                confidences.append(1.0)
-        return torch.tensor(confidences)
+        return torch.tensor([obj.get("conf", 1.0) for obj in annotations],
+                            dtype=torch.float32)
 
     def add_attributes(self, annotations):
         # the maximal number of attributes per object is 16
-        attributes = [ [0] * 16 for _ in range(len(annotations))]
+        attribute_to_ind = self.labelmap['attribute_to_ind']
+        attributes = np.zeros((len(annotations), 16), dtype=np.int64)
         for i, obj in enumerate(annotations):
-            for j, attr in enumerate(obj["attributes"]):
-                attributes[i][j] = self.labelmap['attribute_to_ind'][attr]
-        return torch.tensor(attributes)
+            if obj["attributes"]:
+                attributes[i, :len(obj["attributes"])] = [
+                    attribute_to_ind[attr] for attr in obj["attributes"]]
+        return torch.from_numpy(attributes)
+
+    def _decode_base64_arrays(self, annotations, key, shape=(-1,)):
+        # decode the base64 float32 arrays of all objects into one
+        # preallocated array, which torch then wraps without a copy.
+        if len(annotations) == 0:
+            return torch.tensor([])
+        first = np.frombuffer(binascii.a2b_base64(annotations[0][key]), np.float32).reshape(shape)
+        result = np.empty((len(annotations),) + first.shape, dtype=np.float32)
+        result[0] = first
+        for i in range(1, len(annotations)):
+            result[i] = np.frombuffer(binascii.a2b_base64(annotations[i][key]), np.float32).reshape(shape)
+        return torch.from_numpy(result)
 
     def add_features(self, annotations):
-        features = []
-        for obj in annotations:
-            features.append(np.frombuffer(base64.b64decode(obj['feature']), np.float32))
-        return torch.tensor(features)
+        return self._decode_base64_arrays(annotations, 'feature')
     
     def add_scores_all(self, annotations):
-        scores_all = []
-        for obj in annotations:
-            scores_all.append(np.frombuffer(base64.b64decode(obj['scores_all']), np.float32))
-        return torch.tensor(scores_all)
+        return self._decode_base64_arrays(annotations, 'scores_all')
     
     def add_boxes_all(self, annotations):
-        boxes_all = []
-        for obj in annotations:
-            boxes_all.append(np.frombuffer(base64.b64decode(obj['boxes_all']), np.float32).reshape(-1, 4))
-        return torch.tensor(boxes_all)
+        return self._decode_base64_arrays(annotations, 'boxes_all', shape=(-1, 4))
     
     def relation_loader(self, relation_annos, target):
         if self.filter_duplicate_relations:
@@ -98,19 +121,51 @@ class LabelLoader(object):
                 all_rel_sets[(triplet['subj_id'], triplet['obj_id'])].append(triplet)
             relation_annos = [np.random.choice(v) for v in all_rel_sets.values()]
 
-        # get M*M pred_labels
         relation_triplets = []
-        relations = torch.zeros([len(target), len(target)], dtype=torch.int64)
         for i in range(len(relation_annos)):
             if len(self.ignore_rel)!=0 and relation_annos[i]['class'] in self.ignore_rel:
                 continue
             subj_id = relation_annos[i]['subj_id']
             obj_id = relation_annos[i]['obj_id']
             predicate = self.labelmap['relation_to_ind'][relation_annos[i]['class']]
-            relations[subj_id, obj_id] = predicate
             relation_triplets.append([subj_id, obj_id, predicate])
 
-        relation_triplets = torch.tensor(relation_triplets)
+        target.add_field("relation_labels", torch.tensor(relation_triplets))
+        if self.dense_relations:
+            # get M*M pred_labels
+            relations = torch.zeros([len(target), len(target)], dtype=torch.int64)
+            for subj_id, obj_id, predicate in relation_triplets:
+                relations[subj_id, obj_id] = predicate
+            target.add_field("pred_labels", relations)
+        return target
+
+    def relation_loader_from_store(self, relation_triplets, target, label_store):
+        """Same as relation_loader, for the relations of a LabelStore row.
+        Unlike relation_loader, an image without relations gets a 0x3 int64
+        relation_labels tensor instead of an untyped empty one."""
+        relation_triplets = np.array(relation_triplets)
+        if self.filter_duplicate_relations:
+            # Filter out dupes!
+            all_rel_sets = collections.defaultdict(list)
+            for triplet in relation_triplets:
+                all_rel_sets[(triplet[0], triplet[1])].append(triplet)
+            relation_triplets = np.array(
+                [v[np.random.randint(len(v))] for v in all_rel_sets.values()],
+                dtype=np.int64).reshape(-1, 3)
+
+        if len(self.ignore_rel) != 0:
+            ignore_ids = label_store.get_relation_ids(self.ignore_rel)
+            relation_triplets = relation_triplets[
+                ~np.isin(relation_triplets[:, 2], ignore_ids)]
+        if (relation_triplets[:, 2] < 0).any():
+            raise KeyError(label_store.get_unknown_relation_name(
+                relation_triplets[:, 2].min()))
+
+        relation_triplets = torch.from_numpy(relation_triplets)
         target.add_field("relation_labels", relation_triplets)
-        target.add_field("pred_labels", relations)
+        if self.dense_relations:
+            # get M*M pred_labels
+            relations = torch.zeros([len(target), len(target)], dtype=torch.int64)
+            relations[relation_triplets[:, 0], relation_triplets[:, 1]] = relation_triplets[:, 2]
+            target.add_field("pred_labels", relations)
         return target
\ No newline at end of file
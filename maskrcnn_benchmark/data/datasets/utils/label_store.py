@@ -0,0 +1,154 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import json
+import os
+import os.path as op
+from array import array
+
+import numpy as np
+
+from maskrcnn_benchmark.structures.tsv_file_ops import tsv_reader
+
+# A label store is a columnar, pre-decoded copy of a relation label tsv file.
+# It consists of a json meta file (the entry to put in the dataset yaml as
+# "label_store") and one .npy file per column next to it:
+#   boxes (N, 4) float32, labels (N,) int64, scores (N,) float32,
+#   attributes (N, 16) int64, relations (R, 3) int64 [subj, obj, predicate],
+#   obj_offsets / rel_offsets (num_rows + 1,) int64.
+# The objects of row i are boxes[obj_offsets[i]:obj_offsets[i + 1]] and so on,
+# with subj/obj relative to the first object of the row. Predicates missing in
+# the labelmap get negative ids which are kept by name in the meta file, so
+# that they can still be ignored by name at loading time.
+LABEL_STORE_COLUMNS = ('boxes', 'labels', 'scores', 'attributes', 'relations',
+                       'obj_offsets', 'rel_offsets')
+MAX_ATTRIBUTES_PER_OBJECT = 16
+
+
+def get_label_store_column_file(store_file, column):
+    return '{}.{}.npy'.format(op.splitext(store_file)[0], column)
+
+
+def compile_label_store(label_file, labelmap_file, save_file=None):
+    """Compiles label_file (image key and json string with "objects" and
+    "relations") into a label store, using the ids of labelmap_file."""
+    with open(labelmap_file, 'r') as fp:
+        jsondict = json.load(fp)
+    class_to_ind = jsondict['label_to_idx']
+    attribute_to_ind = jsondict.get('attribute_to_idx', {})
+    relation_to_ind = jsondict.get('predicate_to_idx', {})
+    unknown_relation_to_ind = {}
+
+    boxes = array('f')
+    labels = array('q')
+    scores = array('f')
+    attributes = array('q')
+    relations = array('q')
+    obj_offsets = array('q', [0])
+    rel_offsets = array('q', [0])
+    for row in tsv_reader(label_file):
+        annotations = json.loads(row[1])
+        for obj in annotations['objects']:
+            boxes.extend(obj['rect'])
+            labels.append(class_to_ind[obj['class']])
+            scores.append(obj.get('conf', 1.0))
+            obj_attributes = [0] * MAX_ATTRIBUTES_PER_OBJECT
+            for j, attr in enumerate(obj.get('attributes', [])):
+                obj_attributes[j] = attribute_to_ind[attr]
+            attributes.extend(obj_attributes)
+        for rel in annotations.get('relations', []):
+            predicate = relation_to_ind.get(rel['class'])
+            if predicate is None:
+                predicate = unknown_relation_to_ind.setdefault(
+                    rel['class'], -len(unknown_relation_to_ind) - 1)
+            relations.extend([rel['subj_id'], rel['obj_id'], predicate])
+        obj_offsets.append(len(labels))
+        rel_offsets.append(len(relations) // 3)
+
+    if save_file is None:
+        save_file = op.splitext(label_file)[0] + '.store.json'
+    columns = {
+        'boxes': np.frombuffer(boxes, dtype=np.float32).reshape(-1, 4),
+        'labels': np.frombuffer(labels, dtype=np.int64),
+        'scores': np.frombuffer(scores, dtype=np.float32),
+        'attributes': np.frombuffer(attributes, dtype=np.int64).reshape(
+            -1, MAX_ATTRIBUTES_PER_OBJECT),
+        'relations': np.frombuffer(relations, dtype=np.int64).reshape(-1, 3),
+        'obj_offsets': np.frombuffer(obj_offsets, dtype=np.int64),
+        'rel_offsets': np.frombuffer(rel_offsets, dtype=np.int64),
+    }
+    for column, data in columns.items():
+        column_file = get_label_store_column_file(save_file, column)
+        with open(column_file + '.tmp', 'wb') as fp:
+            np.save(fp, data)
+        os.rename(column_file + '.tmp', column_file)
+    meta = {
+        'num_rows': len(obj_offsets) - 1,
+        'label_to_idx': class_to_ind,
+        'attribute_to_idx': attribute_to_ind,
+        'predicate_to_idx': relation_to_ind,
+        'unknown_predicate_to_idx': unknown_relation_to_ind,
+    }
+    with open(save_file, 'w') as fp:
+        json.dump(meta, fp)
+    return save_file
+
+
+class LabelStore(object):
+    """Read access to a label store. Columns are memory-mapped lazily, so the
+    store is cheap to create before DataLoader workers are forked."""
+    def __init__(self, store_file):
+        self.store_file = store_file
+        with open(store_file, 'r') as fp:
+            self.meta = json.load(fp)
+        self._columns = None
+
+    def __len__(self):
+        return self.meta['num_rows']
+
+    def check_labelmap(self, labelmap):
+        # the store holds ids, so it must have been compiled with the same
+        # labelmap as the one of the dataset.
+        for key, store_key in [('class_to_ind', 'label_to_idx'),
+                               ('attribute_to_ind', 'attribute_to_idx'),
+                               ('relation_to_ind', 'predicate_to_idx')]:
+            if key not in labelmap:
+                continue
+            for name, ind in labelmap[key].items():
+                if ind != 0 and self.meta[store_key].get(name) != ind:
+                    raise ValueError("Label store {} was compiled with a different "
+                                     "labelmap: {} {}".format(self.store_file, key, name))
+
+    def get_relation_ids(self, names):
+        # ids of the given predicate names, including the unknown ones.
+        ids = []
+        for name in names:
+            for key in ['predicate_to_idx', 'unknown_predicate_to_idx']:
+                if name in self.meta[key]:
+                    ids.append(self.meta[key][name])
+        return ids
+
+    def get_unknown_relation_name(self, ind):
+        for name, i in self.meta['unknown_predicate_to_idx'].items():
+            if i == ind:
+                return name
+
+    def __getitem__(self, idx):
+        """Returns the columns of row idx as (read-only) numpy views."""
+        self._ensure_columns_loaded()
+        c = self._columns
+        obj_start, obj_end = c['obj_offsets'][idx], c['obj_offsets'][idx + 1]
+        rel_start, rel_end = c['rel_offsets'][idx], c['rel_offsets'][idx + 1]
+        return {
+            'boxes': c['boxes'][obj_start:obj_end],
+            'labels': c['labels'][obj_start:obj_end],
+            'scores': c['scores'][obj_start:obj_end],
+            'attributes': c['attributes'][obj_start:obj_end],
+            'relations': c['relations'][rel_start:rel_end],
+        }
+
+    def _ensure_columns_loaded(self):
+        if self._columns is None:
+            self._columns = {
+                column: np.load(get_label_store_column_file(self.store_file, column),
+                                mmap_mode='r')
+                for column in LABEL_STORE_COLUMNS
+            }
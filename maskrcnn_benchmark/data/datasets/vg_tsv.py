@@ -111,9 +111,9 @@ class VGTSVDataset(RelationTSVDataset):
         # similar to __getitem__ but without transform
         img = self.get_image(idx)
         img_size = img.size # w, h
-        annotations = self.get_annotations(idx)
-        target = self.get_target_from_annotations(annotations, img_size)
         if call:
+            annotations = self.get_annotations(idx)
+            target = self.get_target_from_annotations(annotations, img_size)
             return img, target, annotations
         else:
-            return target
\ No newline at end of file
+            return self.get_target(idx, img_size)
\ No newline at end of file
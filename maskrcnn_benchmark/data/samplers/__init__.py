@@ -2,5 +2,7 @@
 from .distributed import DistributedSampler
 from .grouped_batch_sampler import GroupedBatchSampler
 from .iteration_based_batch_sampler import IterationBasedBatchSampler
+from .subset_sampler import DistributedSubsetSampler
 
-__all__ = ["DistributedSampler", "GroupedBatchSampler", "IterationBasedBatchSampler"]
+__all__ = ["DistributedSampler", "GroupedBatchSampler", "IterationBasedBatchSampler",
+           "DistributedSubsetSampler"]
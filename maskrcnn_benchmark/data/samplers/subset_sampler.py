@@ -0,0 +1,36 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import torch.distributed as dist
+from torch.utils.data.sampler import Sampler
+
+
+class DistributedSubsetSampler(Sampler):
+    """Sampler over a given list of dataset indices, in order, restricted to
+    the contiguous part of the current process, like DistributedSampler.
+    The list is not padded, so the processes may get one index less than
+    others; it is meant for inference, e.g. over the images left to process
+    when resuming.
+    Arguments:
+        indices (list[int]): dataset indices to sample.
+        num_replicas (optional): Number of processes participating.
+        rank (optional): Rank of the current process within num_replicas.
+    """
+
+    def __init__(self, indices, num_replicas=None, rank=None):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size() if dist.is_available() and \
+                dist.is_initialized() else 1
+        if rank is None:
+            rank = dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+        self.num_replicas = num_replicas
+        self.rank = rank
+        # the first len(indices) % num_replicas processes get one more index.
+        num_samples, extra = divmod(len(indices), num_replicas)
+        start = num_samples * rank + min(rank, extra)
+        end = start + num_samples + (1 if rank < extra else 0)
+        self.indices = list(indices[start:end])
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
@@ -6,23 +6,33 @@ import time
 import os
 import json
 import base64
+import glob
+import queue
+import threading
+from array import array
 
 import torch
 from tqdm import tqdm
 
 from maskrcnn_benchmark.data.datasets.evaluation import evaluate
+from maskrcnn_benchmark.data.build import make_subset_data_loader
+from maskrcnn_benchmark.structures.tsv_file import TSVFile, find_line_starts
+from maskrcnn_benchmark.structures.tsv_file import write_lineidx, remove_stale_lineidx_8b
 from maskrcnn_benchmark.structures.tsv_file_ops import tsv_writer
 from maskrcnn_benchmark.data.datasets.utils.load_files import load_labelmap_file
 from scene_graph_benchmark.scene_parser import SceneParserOutputs
 
-from ..utils.comm import is_main_process, get_world_size
+from ..utils.comm import is_main_process, get_world_size, get_rank
 from ..utils.comm import all_gather, gather_on_master
 from ..utils.comm import synchronize
 from ..utils.timer import Timer, get_time_str
 from .bbox_aug import im_detect_bbox_aug
 
 
-def compute_on_dataset(model, data_loader, device, bbox_aug, timer=None):
+def compute_on_dataset(model, data_loader, device, bbox_aug, timer=None,
+                       prediction_writer=None):
+    # with a prediction_writer, the outputs are handed over to it instead of
+    # being collected, and the returned dict is empty.
     model.eval()
     results_dict = {}
     cpu_device = torch.device("cpu")
@@ -47,6 +57,10 @@ def compute_on_dataset(model, data_loader, device, bbox_aug, timer=None):
                     torch.cuda.synchronize()
                 timer.toc()
             output = [o.to(cpu_device) for o in output]
+        if prediction_writer is not None:
+            for img_id, result in zip(image_ids, output):
+                prediction_writer.put(img_id, result)
+            continue
         results_dict.update(
             {img_id: result for img_id, result in zip(image_ids, output)}
         )
@@ -77,12 +91,10 @@ def _accumulate_predictions_from_multiple_gpus(predictions_per_gpu, gather_on_cp
     return predictions
 
 
-def convert_predictions_to_tsv(predictions, dataset, output_folder,
-                               data_subset, labelmap_file=None,
-                               relation_on=False,
-                               output_tsv_name='predictions.tsv'):
-    # convert the prediction results to tsv format and save
-    # for easier visualization and post-processing.
+def get_tsv_labelmaps(dataset, data_subset, labelmap_file=None):
+    # id to name mappings of the classes, attributes and predicates required
+    # to write data_subset.
+    labelmap, attr_labelmap, relation_labelmap = None, None, None
     if 'class' in data_subset:
         if os.path.isfile(labelmap_file):
             labelmap = load_labelmap_file(labelmap_file)
@@ -109,108 +121,293 @@ def convert_predictions_to_tsv(predictions, dataset, output_folder,
             relation_labelmap = dataset.ind_to_relation
         else:
             raise ValueError("relation labelmap is required, but was not provided")
-    
+    return labelmap, attr_labelmap, relation_labelmap
+
+
+def prediction_to_tsv_row(idx, prediction, dataset, data_subset, labelmaps,
+                          relation_on=False):
+    """Converts the prediction of image idx to (image key, json string).
+    labelmaps is the output of get_tsv_labelmaps."""
+    labelmap, attr_labelmap, relation_labelmap = labelmaps
+    image_key = dataset.get_img_key(idx)
+    image_width = dataset.get_img_info(idx)['width']
+    image_height = dataset.get_img_info(idx)['height']
+
+    if isinstance(prediction, SceneParserOutputs):
+        prediction_pred = prediction.prediction_pairs
+        prediction = prediction.predictions
+
+        relations = prediction_pred.get_field("idx_pairs").numpy()
+        relation_scores = prediction_pred.get_field("scores").numpy()
+        predicates = prediction_pred.get_field("labels").numpy()
+        if 'relation_scores_all' in data_subset:
+            relation_scores_all = prediction_pred.get_field("scores_all").numpy()
+        if 'relation_feature' in data_subset:
+            relation_features = prediction_pred.get_field("pred_features").numpy()
+
+    prediction = prediction.resize((image_width, image_height))
+    boxes = prediction.bbox.tolist()
+
+    if 'conf' in data_subset:
+        scores = prediction.get_field('scores').tolist()
+    if 'class' in data_subset:
+        labels = prediction.get_field('labels').tolist()
+    if 'feature' in data_subset:
+        features = prediction.get_field('box_features').numpy()
+    if 'scores_all' in data_subset:
+        scores_all = prediction.get_field('scores_all').numpy()
+    if 'boxes_all' in data_subset:
+        boxes_all = prediction.get_field('boxes_all').numpy()
+    if "attr_labels" in data_subset:
+        attr_labels = prediction.get_field("attr_labels").tolist()
+    if "attr_scores" in data_subset:
+        attr_scores = prediction.get_field("attr_scores").tolist()
+    if "attr_scores_all" in data_subset:
+        attr_scores_all = prediction.get_field("attr_scores_all").numpy()
+    if 'relations' in data_subset:
+        relations = relations.tolist()
+        predicates = [relation_labelmap[rel+1] for rel in predicates.tolist()]
+    if 'relation_scores' in data_subset:
+        relation_scores = relation_scores.tolist()
+    if 'relation_scores_all' in data_subset:
+        relation_scores_all = [base64.b64encode(relation_scores_all[i]).decode('utf-8') for i in range(len(relations))]
+
+    objects = []
+    for i in range(len(boxes)):
+        cur_d = {}
+        for name in data_subset:
+            if name == 'rect':
+                cur_d['rect'] = boxes[i]
+                cur_d['bbox_id'] = i
+            if name == 'class':
+                cur_d['class'] = labelmap[labels[i]]
+            if name == 'conf':
+                cur_d['conf'] = scores[i]
+            if name == 'feature':
+                cur_d['feature'] = base64.b64encode(features[i]) \
+                    .decode('utf-8')
+            if name == 'scores_all':
+                cur_d['scores_all'] = base64.b64encode(scores_all[i]) \
+                    .decode('utf-8')
+            if name == 'boxes_all':
+                cur_d['boxes_all'] = base64.b64encode(boxes_all[i]) \
+                    .decode('utf-8')
+            if name == 'attr_labels':
+                cur_d['attributes'] = []
+                for attr in attr_labels[i]:
+                    cur_d['attributes'].append(attr_labelmap[attr])
+            if name == 'attr_scores':
+                cur_d['attr_scores'] = []
+                for attr_score in attr_scores[i]:
+                    cur_d['attr_scores'].append(attr_score)
+            if name == 'attr_scores_all':
+                cur_d['attr_scores_all'] = base64.b64encode(attr_scores_all[i]) \
+                    .decode('utf-8')
+        objects.append(cur_d)
+
+    triplets = None
+    if relation_on:
+        triplets = []
+        for i in range(len(relations)):
+            cur_d = {}
+            for name in data_subset:
+                if name == 'relations':
+                    cur_d['subj_id'] = relations[i][0]
+                    cur_d['obj_id'] = relations[i][1]
+                    cur_d['class'] = predicates[i]
+                if name == 'relation_scores':
+                    cur_d['conf'] = relation_scores[i]
+                if name == 'relation_scores_all':
+                    cur_d['scores_all'] = relation_scores_all[i]
+                if name == 'relation_feature':
+                    cur_d['relation_feature'] = base64.b64encode(relation_features[i]).decode('utf-8')
+            triplets.append(cur_d)
+
+    return image_key, json.dumps({'objects': objects, 'relations':triplets})
+
+
+def convert_predictions_to_tsv(predictions, dataset, output_folder,
+                               data_subset, labelmap_file=None,
+                               relation_on=False,
+                               output_tsv_name='predictions.tsv'):
+    # convert the prediction results to tsv format and save
+    # for easier visualization and post-processing.
+    labelmaps = get_tsv_labelmaps(dataset, data_subset, labelmap_file)
+
     def gen_rows():
         for idx, prediction in sorted(predictions.items()):
-            image_key = dataset.get_img_key(idx)
-            image_width = dataset.get_img_info(idx)['width']
-            image_height = dataset.get_img_info(idx)['height']
-
-            if isinstance(prediction, SceneParserOutputs):
-                prediction_pred = prediction.prediction_pairs
-                prediction = prediction.predictions
-
-                relations = prediction_pred.get_field("idx_pairs").numpy()
-                relation_scores = prediction_pred.get_field("scores").numpy()
-                predicates = prediction_pred.get_field("labels").numpy()
-                if 'relation_scores_all' in data_subset:
-                    relation_scores_all = prediction_pred.get_field("scores_all").numpy()
-                if 'relation_feature' in data_subset:
-                    relation_features = prediction_pred.get_field("pred_features").numpy()
-
-            prediction = prediction.resize((image_width, image_height))
-            boxes = prediction.bbox.tolist()
-
-            if 'conf' in data_subset:
-                scores = prediction.get_field('scores').tolist()
-            if 'class' in data_subset:
-                labels = prediction.get_field('labels').tolist()
-            if 'feature' in data_subset:
-                features = prediction.get_field('box_features').numpy()
-            if 'scores_all' in data_subset:
-                scores_all = prediction.get_field('scores_all').numpy()
-            if 'boxes_all' in data_subset:
-                boxes_all = prediction.get_field('boxes_all').numpy()
-            if "attr_labels" in data_subset:
-                attr_labels = prediction.get_field("attr_labels").tolist()
-            if "attr_scores" in data_subset:
-                attr_scores = prediction.get_field("attr_scores").tolist()
-            if "attr_scores_all" in data_subset:
-                attr_scores_all = prediction.get_field("attr_scores_all").numpy()
-            if 'relations' in data_subset:
-                relations = relations.tolist()
-                predicates = [relation_labelmap[rel+1] for rel in predicates.tolist()]
-            if 'relation_scores' in data_subset:
-                relation_scores = relation_scores.tolist()
-            if 'relation_scores_all' in data_subset:
-                relation_scores_all = [base64.b64encode(relation_scores_all[i]).decode('utf-8') for i in range(len(relations))]
-
-            objects = []
-            for i in range(len(boxes)):
-                cur_d = {}
-                for name in data_subset:
-                    if name == 'rect':
-                        cur_d['rect'] = boxes[i]
-                        cur_d['bbox_id'] = i
-                    if name == 'class':
-                        cur_d['class'] = labelmap[labels[i]]
-                    if name == 'conf':
-                        cur_d['conf'] = scores[i]
-                    if name == 'feature':
-                        cur_d['feature'] = base64.b64encode(features[i]) \
-                            .decode('utf-8')
-                    if name == 'scores_all':
-                        cur_d['scores_all'] = base64.b64encode(scores_all[i]) \
-                            .decode('utf-8')
-                    if name == 'boxes_all':
-                        cur_d['boxes_all'] = base64.b64encode(boxes_all[i]) \
-                            .decode('utf-8')
-                    if name == 'attr_labels':
-                        cur_d['attributes'] = []
-                        for attr in attr_labels[i]:
-                            cur_d['attributes'].append(attr_labelmap[attr])
-                    if name == 'attr_scores':
-                        cur_d['attr_scores'] = []
-                        for attr_score in attr_scores[i]:
-                            cur_d['attr_scores'].append(attr_score)
-                    if name == 'attr_scores_all':
-                        cur_d['attr_scores_all'] = base64.b64encode(attr_scores_all[i]) \
-                            .decode('utf-8')
-                objects.append(cur_d)
-            
-            triplets = None
-            if relation_on:
-                triplets = []
-                for i in range(len(relations)):
-                    cur_d = {}
-                    for name in data_subset:
-                        if name == 'relations':
-                            cur_d['subj_id'] = relations[i][0]
-                            cur_d['obj_id'] = relations[i][1]
-                            cur_d['class'] = predicates[i]
-                        if name == 'relation_scores':
-                            cur_d['conf'] = relation_scores[i]
-                        if name == 'relation_scores_all':
-                            cur_d['scores_all'] = relation_scores_all[i]
-                        if name == 'relation_feature':
-                            cur_d['relation_feature'] = base64.b64encode(relation_features[i]).decode('utf-8')
-                    triplets.append(cur_d)
-            
-            yield image_key, json.dumps({'objects': objects, 'relations':triplets})
-    
+            yield prediction_to_tsv_row(idx, prediction, dataset, data_subset,
+                                        labelmaps, relation_on=relation_on)
+
     tsv_writer(gen_rows(), os.path.join(output_folder, output_tsv_name))
 
 
+def get_prediction_shard_file(output_folder, output_tsv_name, rank):
+    base, ext = os.path.splitext(output_tsv_name)
+    return os.path.join(output_folder, '{}.rank{}{}'.format(base, rank, ext))
+
+
+def find_prediction_shard_files(output_folder, output_tsv_name):
+    # the shards of all ranks, including those of a previous run with more
+    # processes.
+    base, ext = os.path.splitext(output_tsv_name)
+    pattern = os.path.join(glob.escape(output_folder), '{}.rank*{}'.format(base, ext))
+    return sorted(glob.glob(pattern))
+
+
+def repair_prediction_shard(shard_file):
+    """Truncates the shard of an interrupted run to its complete rows and
+    rewrites its lineidx. A row is complete once its newline is written."""
+    offsets = find_line_starts(shard_file)
+    fsize = os.path.getsize(shard_file)
+    with open(shard_file, 'rb') as fp:
+        fp.seek(max(fsize - 1, 0))
+        complete = fp.read(1) == b'\n'
+    if not complete and len(offsets) > 0:
+        fsize = int(offsets[-1])
+        offsets = offsets[:-1]
+        os.truncate(shard_file, fsize)
+    write_lineidx(offsets, os.path.splitext(shard_file)[0] + '.lineidx')
+
+
+def load_prediction_shard_indices(shard_file):
+    # dataset indices of the rows of a shard, i.e. of the images it completed.
+    shard = TSVFile(shard_file)
+    return [int(bytes(shard.seek_column(row, 0))) for row in range(len(shard))]
+
+
+class PredictionShardWriter(object):
+    """Serializes predictions into a shard tsv file on a background thread,
+    as soon as compute_on_dataset hands them over, so that they do not pile
+    up in memory. Rows are [dataset index, image key, json] and the lineidx
+    is written along with them; see merge_prediction_shards. With append,
+    rows are added to an existing (repaired) shard, to resume inference."""
+    def __init__(self, shard_file, dataset, data_subset, labelmap_file=None,
+                 relation_on=False, max_pending=256, append=False):
+        self.shard_file = shard_file
+        self.lineidx = os.path.splitext(shard_file)[0] + '.lineidx'
+        self.dataset = dataset
+        self.data_subset = data_subset
+        self.relation_on = relation_on
+        self.append = append
+        self.labelmaps = get_tsv_labelmaps(dataset, data_subset, labelmap_file)
+        self.num_rows = 0
+        self._error = None
+        # bounded, so that a slow disk throttles inference instead of
+        # buffering all predictions again.
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, idx, prediction):
+        if self._error is not None:
+            raise RuntimeError("writing {} failed".format(self.shard_file)) from self._error
+        self._queue.put((idx, prediction))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("writing {} failed".format(self.shard_file)) from self._error
+
+    def _run(self):
+        fpos = 0
+        mode = 'w'
+        if self.append and os.path.isfile(self.shard_file):
+            fpos = os.path.getsize(self.shard_file)
+            mode = 'a'
+        with open(self.shard_file, mode + 'b') as fp, open(self.lineidx, mode) as fpidx:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if self._error is not None:
+                    # keep draining the queue so that put never blocks.
+                    continue
+                idx, prediction = item
+                try:
+                    image_key, value = prediction_to_tsv_row(
+                        idx, prediction, self.dataset, self.data_subset,
+                        self.labelmaps, relation_on=self.relation_on)
+                    line = '{}\t{}\t{}\n'.format(idx, image_key, value).encode('utf-8')
+                    fp.write(line)
+                    fpidx.write('{}\n'.format(fpos))
+                    fpos += len(line)
+                    self.num_rows += 1
+                    if self._queue.empty():
+                        # the rows written so far survive a crash.
+                        fp.flush()
+                        fpidx.flush()
+                except Exception as e:
+                    self._error = e
+
+
+def merge_prediction_shards(shard_files, tsv_file):
+    """Merges the shards of PredictionShardWriter into tsv_file, ordered by
+    dataset index. Images seen by several ranks (the distributed sampler
+    pads the last batches) are written once. Returns the number of rows."""
+    shards = [TSVFile(f) for f in shard_files]
+    locations = {}
+    for i, shard_file in enumerate(shard_files):
+        for row, idx in enumerate(load_prediction_shard_indices(shard_file)):
+            locations.setdefault(idx, (i, row))
+
+    offsets = array('q')
+    fpos = 0
+    tsv_file_tmp = tsv_file + '.tmp'
+    with open(tsv_file_tmp, 'wb') as fp:
+        for idx in sorted(locations):
+            i, row = locations[idx]
+            # copy the raw bytes of [image key, json], nothing is decoded.
+            columns = shards[i].seek_bytes(row)
+            offsets.append(fpos)
+            fpos += fp.write(columns[1]) + fp.write(b'\t') + fp.write(columns[2]) \
+                + fp.write(b'\n')
+    os.rename(tsv_file_tmp, tsv_file)
+    lineidx = os.path.splitext(tsv_file)[0] + '.lineidx'
+    write_lineidx(offsets, lineidx)
+    remove_stale_lineidx_8b(lineidx)
+    return len(offsets)
+
+
+def delete_prediction_shards(shard_files):
+    for f in shard_files:
+        for path in [f, os.path.splitext(f)[0] + '.lineidx']:
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def prepare_shards(output_folder, output_tsv_name):
+    # shards left over by another run must not end up in the merged tsv.
+    if is_main_process():
+        delete_prediction_shards(find_prediction_shard_files(output_folder, output_tsv_name))
+    synchronize()
+
+
+def prepare_resume(data_loader, output_folder, output_tsv_name):
+    """Repairs the shards of an interrupted streaming inference and returns
+    a data loader over the images which are in none of them."""
+    logger = logging.getLogger("maskrcnn_benchmark.inference")
+    world_size, rank = get_world_size(), get_rank()
+    # each process repairs its own shard, the main process also those of
+    # ranks which do not exist anymore.
+    for shard_file in find_prediction_shard_files(output_folder, output_tsv_name):
+        shard_rank = int(os.path.splitext(shard_file)[0].rsplit('.rank', 1)[1])
+        if shard_rank == rank or (shard_rank >= world_size and rank == 0):
+            repair_prediction_shard(shard_file)
+    synchronize()
+    completed = set()
+    for shard_file in find_prediction_shard_files(output_folder, output_tsv_name):
+        completed.update(load_prediction_shard_indices(shard_file))
+    # nobody may append to a shard before all processes read it.
+    synchronize()
+    dataset = data_loader.dataset
+    remaining = [idx for idx in range(len(dataset)) if idx not in completed]
+    logger.info("Resume inference: {} of {} images are done, {} remaining".format(
+        len(dataset) - len(remaining), len(dataset), len(remaining)))
+    return make_subset_data_loader(data_loader, remaining, is_distributed=world_size > 1)
+
+
 def inference(
         model,
         cfg,
@@ -239,6 +436,8 @@ def inference(
     total_timer.tic()
 
     output_pth_name = 'predictions_forcebox.pth' if eval_attributes else 'predictions.pth'
+    output_tsv_name = 'predictions_forcebox.tsv' if eval_attributes else 'predictions.tsv'
+    prediction_writer = None
     if output_folder and os.path.isfile(os.path.join(output_folder, output_pth_name)):
         logger.info("Predictions.pth file exist in {}, skip computation".format(
             os.path.join(output_folder, output_pth_name)))
@@ -247,6 +446,20 @@ def inference(
         if cfg.TEST.SAVE_RESULTS_TO_TSV or not cfg.TEST.SKIP_PERFORMANCE_EVAL:
             predictions = torch.load(os.path.join(output_folder, output_pth_name))
     else:
+        if output_folder and cfg.TEST.STREAM_PREDICTIONS_TO_TSV:
+            shard_file = get_prediction_shard_file(output_folder, output_tsv_name, get_rank())
+            if cfg.TEST.RESUME_INFERENCE:
+                data_loader = prepare_resume(data_loader, output_folder, output_tsv_name)
+            else:
+                prepare_shards(output_folder, output_tsv_name)
+            prediction_writer = PredictionShardWriter(
+                shard_file,
+                dataset,
+                data_subset=cfg.TEST.TSV_SAVE_SUBSET,
+                labelmap_file=labelmap_file,
+                relation_on=cfg.MODEL.RELATION_ON,
+                append=cfg.TEST.RESUME_INFERENCE,
+            )
         if eval_attributes:
             # change to force_boxes=True mode
             force_boxes_model = model.force_boxes
@@ -254,12 +467,15 @@ def inference(
             model.force_boxes = True
             model.roi_heads.box.post_processor.force_boxes = True
             predictions = compute_on_dataset(model, data_loader, device, bbox_aug,
-                                             inference_timer)
+                                             inference_timer, prediction_writer)
             # return to the original state
             model.force_boxes = force_boxes_model
             model.roi_heads.box.post_processor.force_boxes = force_boxes_box
         else:
-            predictions = compute_on_dataset(model, data_loader, device, bbox_aug, inference_timer)
+            predictions = compute_on_dataset(model, data_loader, device, bbox_aug, inference_timer,
+                                             prediction_writer)
+        if prediction_writer is not None:
+            prediction_writer.close()
     # wait for all processes to complete before measuring the time
     synchronize()
     total_time = total_timer.toc()
@@ -278,24 +494,44 @@ def inference(
         )
     )
 
-    predictions = _accumulate_predictions_from_multiple_gpus(predictions, cfg.TEST.GATHER_ON_CPU)
+    if prediction_writer is not None:
+        # the predictions are already on disk, merge the shards of all ranks
+        # instead of gathering them.
+        if not is_main_process():
+            return
+        shard_files = find_prediction_shard_files(output_folder, output_tsv_name)
+        num_rows = merge_prediction_shards(
+            shard_files, os.path.join(output_folder, output_tsv_name))
+        delete_prediction_shards(shard_files)
+        logger.info("Merged {} predictions into {}".format(
+            num_rows, os.path.join(output_folder, output_tsv_name)))
+        if num_rows != len(dataset):
+            logger.warning(
+                "Number of images that were written by multiple processes is not "
+                "the dataset size. Some images might be missing from the evaluation"
+            )
+        if save_predictions:
+            logger.warning("Predictions are streamed to tsv, {} is not saved".format(
+                output_pth_name))
+        predictions = None
+    else:
+        predictions = _accumulate_predictions_from_multiple_gpus(predictions, cfg.TEST.GATHER_ON_CPU)
 
-    if not is_main_process():
-        return
+        if not is_main_process():
+            return
 
-    if output_folder and save_predictions:
-        torch.save(predictions, os.path.join(output_folder, output_pth_name))
-    
-    if output_folder and cfg.TEST.SAVE_RESULTS_TO_TSV:
-        logger.info("Convert prediction results to tsv format and save.")
-        output_tsv_name = 'predictions_forcebox.tsv' if eval_attributes else 'predictions.tsv'
-        convert_predictions_to_tsv(
-            predictions, dataset, output_folder,
-            data_subset=cfg.TEST.TSV_SAVE_SUBSET,
-            labelmap_file=labelmap_file,
-            output_tsv_name=output_tsv_name,
-            relation_on=cfg.MODEL.RELATION_ON,
-        )
+        if output_folder and save_predictions:
+            torch.save(predictions, os.path.join(output_folder, output_pth_name))
+
+        if output_folder and cfg.TEST.SAVE_RESULTS_TO_TSV:
+            logger.info("Convert prediction results to tsv format and save.")
+            convert_predictions_to_tsv(
+                predictions, dataset, output_folder,
+                data_subset=cfg.TEST.TSV_SAVE_SUBSET,
+                labelmap_file=labelmap_file,
+                output_tsv_name=output_tsv_name,
+                relation_on=cfg.MODEL.RELATION_ON,
+            )
     
     if skip_performance_eval:
         logger.info("Skip performance evaluation and return.")
@@ -311,8 +547,15 @@ def inference(
     )
     if hasattr(cfg.MODEL, 'RELATION_ON'):
         extra_args['sg_eval'] = cfg.MODEL.RELATION_ON
+        extra_args['sg_eval_num_workers'] = cfg.TEST.SG_EVAL_NUM_WORKERS
+        extra_args['sg_eval_num_threads'] = cfg.TEST.SG_EVAL_NUM_THREADS
     else:
         extra_args['sg_eval'] = False
+    if predictions is None and not extra_args['sg_eval']:
+        # only the scene graph evaluation reads the predictions from tsv.
+        logger.warning("Skip performance evaluation: it requires the in-memory "
+                       "predictions, which TEST.STREAM_PREDICTIONS_TO_TSV does not keep.")
+        return
 
     return evaluate(dataset=dataset,
                     predictions=predictions,
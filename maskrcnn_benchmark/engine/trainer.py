@@ -196,6 +196,9 @@ def do_train(
         elif iteration % checkpoint_period == 0:
             checkpointer.save("model_{:07d}".format(iteration), **arguments)
 
+    # the last checkpoint may still be written in the background
+    checkpointer.wait()
+
     total_training_time = time.time() - start_training_time
     total_time_str = str(datetime.timedelta(seconds=total_training_time))
     logger.info(
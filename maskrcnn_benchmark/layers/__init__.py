@@ -8,6 +8,7 @@ from .misc import ConvTranspose2d
 from .misc import BatchNorm2d
 from .misc import interpolate
 from .nms import nms
+from .nms import batched_nms
 from .roi_align import ROIAlign
 from .roi_align import roi_align
 from .roi_pool import ROIPool
@@ -22,6 +23,7 @@ from .dcn.deform_pool_module import DeformRoIPooling, DeformRoIPoolingPack, Modu
 
 __all__ = [
     "nms",
+    "batched_nms",
     "roi_align",
     "ROIAlign",
     "roi_pool",
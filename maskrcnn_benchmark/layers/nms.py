@@ -1,12 +1,71 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
+import torch
+
 from maskrcnn_benchmark import _C
 
 try:
     import torchvision
-    from torchvision.ops import nms
+    from torchvision.ops import nms as _torchvision_nms
 except:
-    nms = _C.nms
+    _torchvision_nms = None
+
+
+def nms(boxes, scores, nms_thresh):
+    """
+    Performs non-maximum suppression with the overlaps of torchvision.ops.nms
+    (widths are x2 - x1, boxes are suppressed above nms_thresh) when it is
+    installed. The cpu boxes go to the multi-threaded _C kernel, which keeps
+    the same boxes in the same order.
+    """
+    if _torchvision_nms is None:
+        return _C.nms(boxes, scores, nms_thresh)
+    if boxes.device.type == "cpu":
+        return _C.nms(boxes, scores, nms_thresh, False)
+    return _torchvision_nms(boxes, scores, nms_thresh)
+
+
+def batched_nms(boxes, scores, idxs, nms_thresh):
+    """
+    Performs non-maximum suppression independently for the boxes of each
+    value of idxs (e.g. each class).
+
+    Small sets of boxes are suppressed with a single call to nms, after
+    moving the boxes of different values far enough apart not to overlap.
+    nms compares every pair of boxes, so larger sets on the cpu get one nms
+    call per value instead, and so do the sets whose moved coordinates would
+    not be precise enough in the dtype of the boxes.
+
+    Arguments:
+        boxes (Tensor[N, 4]): boxes in (x1, y1, x2, y2) format
+        scores (Tensor[N])
+        idxs (Tensor[N]): int64 index of the group of each box
+        nms_thresh (float)
+
+    Returns:
+        keep (Tensor): indices of the kept boxes, grouped by value of idxs for
+            the per value calls, each group in the order nms returns it
+    """
+    if boxes.numel() == 0:
+        return torch.empty((0,), dtype=torch.int64, device=boxes.device)
+    if boxes.size(0) > (1000 if boxes.device.type == "cpu" else 5000):
+        return _nms_per_group(boxes, scores, idxs, nms_thresh)
+    if boxes.device.type == "cpu":
+        # the offset boxes are exact in double precision, so the overlaps are
+        # the ones of a nms call per group up to the float rounding. The gpu
+        # kernels keep the input dtype (the _C one only takes float).
+        boxes, scores = boxes.double(), scores.double()
+    # apart by more than 1, for the nms kernels which add 1 to widths / heights
+    offsets = idxs.double() * (boxes.max().double() - boxes.min().double() + 2)
+    # past 2 / eps, the offset coordinates are no longer apart by more than 1
+    max_coordinate = float(offsets.max()) + float(boxes.abs().max())
+    if max_coordinate >= 2 / torch.finfo(boxes.dtype).eps:
+        return _nms_per_group(boxes, scores, idxs, nms_thresh)
+    return nms(boxes + offsets.to(boxes)[:, None], scores, nms_thresh)
 
 
-# nms.__doc__ = """
-# This function performs Non-maximum suppresion"""
+def _nms_per_group(boxes, scores, idxs, nms_thresh):
+    keep = []
+    for idx in torch.unique(idxs):
+        inds = (idxs == idx).nonzero(as_tuple=False).squeeze(1)
+        keep.append(inds[nms(boxes[inds], scores[inds], nms_thresh)])
+    return torch.cat(keep, 0)
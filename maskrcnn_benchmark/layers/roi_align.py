@@ -44,9 +44,19 @@ class _ROIAlign(Function):
 
 try:
     import torchvision
-    from torchvision.ops import roi_align
+    from torchvision.ops import roi_align as _torchvision_roi_align
 except:
-    roi_align = _ROIAlign.apply
+    _torchvision_roi_align = None
+
+
+def roi_align(input, rois, output_size, spatial_scale, sampling_ratio):
+    # the _C cpu kernel has no backward, so cpu inputs only go to it when no
+    # gradient is needed; it matches torchvision's aligned=False
+    if _torchvision_roi_align is None or (
+            input.device.type == "cpu" and not (torch.is_grad_enabled() and (
+                input.requires_grad or rois.requires_grad))):
+        return _ROIAlign.apply(input, rois, _pair(output_size), spatial_scale, sampling_ratio)
+    return _torchvision_roi_align(input, rois, output_size, spatial_scale, sampling_ratio)
 
 class ROIAlign(nn.Module):
     def __init__(self, output_size, spatial_scale, sampling_ratio):
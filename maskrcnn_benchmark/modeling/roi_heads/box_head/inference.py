@@ -5,10 +5,9 @@ import torch.nn.functional as F
 from torch import nn
 
 from maskrcnn_benchmark.structures.bounding_box import BoxList
-from maskrcnn_benchmark.structures.boxlist_ops import boxlist_nms
-from maskrcnn_benchmark.structures.boxlist_ops import cat_boxlist
 from maskrcnn_benchmark.modeling.box_coder import BoxCoder
 from maskrcnn_benchmark.layers import nms as box_nms
+from maskrcnn_benchmark.layers import batched_nms
 
 
 class PostProcessor(nn.Module):
@@ -119,26 +118,16 @@ class PostProcessor(nn.Module):
                     boxlist = self.prepare_empty_boxlist(boxlist)
             else:
                 if not self.bbox_aug_enabled:  # If bbox aug is enabled, we will do it later
-                    # to enforce minimum number of detections per image
-                    # we will do a binary search on the confidence threshold
-                    new_boxlist = self.filter_method(boxlist, num_classes, feature)
-
-                    if self.cfg.MODEL.ROI_HEADS.NMS_FILTER == 2:
-                        boxlist = new_boxlist
+                    if self.filter_method == self.filter_results:
+                        # to enforce minimum number of detections per image
+                        # filter_results lowers the confidence threshold
+                        boxlist = self.filter_results(
+                            boxlist, num_classes, feature,
+                            min_detections=self.min_detections_per_img)
                     else:
-                        initial_conf_thresh = self.score_thresh
-                        decrease_num = 0
-                        while new_boxlist.bbox.shape[0] < \
-                                self.min_detections_per_img and decrease_num < 10:
-                            self.score_thresh /= 2.0
-                            print(("\nNumber of proposals {} is too small, "
-                                    "retrying filter_results with score thresh"
-                                    " = {}").format(new_boxlist.bbox.shape[0],
-                                                    self.score_thresh))
-                            new_boxlist = self.filter_method(boxlist, num_classes, feature)
-                            decrease_num += 1
-                        boxlist = new_boxlist
-                        self.score_thresh = initial_conf_thresh
+                        # filter_results_peter keeps the top
+                        # min_detections_per_img boxes whatever the threshold
+                        boxlist = self.filter_method(boxlist, num_classes, feature)
             results.append(boxlist)
         return results
 
@@ -185,51 +174,78 @@ class PostProcessor(nn.Module):
                 )
         return boxlist_empty
 
-    def filter_results(self, boxlist, num_classes, feature=None):
+    def filter_results(self, boxlist, num_classes, feature=None, min_detections=0):
         """Returns bounding-box detection results by thresholding on scores and
         applying non-maximum suppression (NMS).
+
+        While less than min_detections boxes are kept, the score threshold is
+        halved, up to 10 times.
         """
         # unwrap the boxlist to avoid additional overhead.
-        # if we had multi-class NMS, we could perform this directly on the boxlist
         boxes = boxlist.bbox.reshape(-1, num_classes * 4)
         scores = boxlist.get_field("scores").reshape(-1, num_classes)
 
+        # the boxes above a threshold bound the number of boxes kept at it,
+        # so the halved thresholds with too few of them are skipped at once
+        # instead of running NMS at each
+        score_threshs = [self.score_thresh]
+        for _ in range(10):
+            score_threshs.append(score_threshs[-1] / 2.0)
+        num_candidates = [min_detections] * len(score_threshs)
+        if min_detections > 0:
+            num_candidates = (scores[:, 1:].reshape(1, -1) > torch.tensor(
+                score_threshs, device=scores.device).view(-1, 1)).sum(1).tolist()
+
+        decrease_num = 0
+        while num_candidates[decrease_num] < min_detections and decrease_num < 10:
+            decrease_num += 1
+        if decrease_num > 0:
+            print(("\nNumber of proposals {} is too small, "
+                    "retrying filter_results with score thresh"
+                    " = {}").format(num_candidates[decrease_num - 1],
+                                    score_threshs[decrease_num]))
+        result = self._limit_detections(self._class_nms(
+            boxlist, boxes, scores, num_classes, feature, score_threshs[decrease_num]))
+        while len(result) < min_detections and decrease_num < 10:
+            decrease_num += 1
+            print(("\nNumber of proposals {} is too small, "
+                    "retrying filter_results with score thresh"
+                    " = {}").format(len(result), score_threshs[decrease_num]))
+            result = self._limit_detections(self._class_nms(
+                boxlist, boxes, scores, num_classes, feature, score_threshs[decrease_num]))
+        return result
+
+    def _class_nms(self, boxlist, boxes, scores, num_classes, feature, score_thresh):
+        # NMS of the boxes of each class above score_thresh, in a single
+        # batched_nms call, the result is ordered by class like one NMS per
+        # class would be
         device = scores.device
-        result = []
-        # Apply threshold on detection probabilities and apply NMS
         # Skip j = 0, because it's the background class
-        inds_all = scores > self.score_thresh
-        boxlist_empty = self.prepare_empty_boxlist(boxlist)
-        for j in range(1, num_classes):
-            inds = inds_all[:, j].nonzero(as_tuple=False).squeeze(1)
-
-            if len(inds)>0:
-                scores_j = scores[inds, j]
-                boxes_j = boxes[inds, j * 4 : (j + 1) * 4]
-                boxlist_for_class = BoxList(boxes_j, boxlist.size, mode="xyxy")
-                boxlist_for_class.add_field("scores", scores_j)
-                
-                if self.output_feature:
-                    feature_j = feature[inds]
-                    boxlist_for_class.add_field("box_features", feature_j)
-                    
-                    scores_all = scores[inds]
-                    boxlist_for_class.add_field("scores_all", scores_all)
-                    boxlist_for_class.add_field("boxes_all",
-                                                boxes[inds].view(-1, num_classes, 4))
-
-                boxlist_for_class = boxlist_nms(
-                    boxlist_for_class, self.nms
-                )
-                num_labels = len(boxlist_for_class)
-                boxlist_for_class.add_field(
-                    "labels", torch.full((num_labels,), j, dtype=torch.int64, device=device)
-                )
-                result.append(boxlist_for_class)
-            else:
-                result.append(boxlist_empty)
+        labels, inds = (scores[:, 1:] > score_thresh).t().nonzero(as_tuple=True)
+        if len(inds) == 0:
+            return self.prepare_empty_boxlist(boxlist)
+        labels = labels + 1
+        scores_all = scores[inds, labels]
+        boxes_all = boxes.view(-1, num_classes, 4)[inds, labels]
+
+        if self.nms > 0:
+            keep = batched_nms(boxes_all, scores_all, labels, self.nms)
+            order = labels[keep] * len(keep) + torch.arange(len(keep), device=device)
+            keep = keep[torch.argsort(order)]
+        else:
+            keep = torch.arange(len(inds), device=device)
+        inds = inds[keep]
 
-        result = cat_boxlist(result)
+        result = BoxList(boxes_all[keep], boxlist.size, mode="xyxy")
+        result.add_field("scores", scores_all[keep])
+        if self.output_feature:
+            result.add_field("box_features", feature[inds])
+            result.add_field("scores_all", scores[inds])
+            result.add_field("boxes_all", boxes[inds].view(-1, num_classes, 4))
+        result.add_field("labels", labels[keep])
+        return result
+
+    def _limit_detections(self, result):
         number_of_detections = len(result)
 
         # Limit to max_per_image detections **over all classes**
@@ -252,22 +268,16 @@ class PostProcessor(nn.Module):
         boxes = boxlist.bbox.reshape(-1, num_classes * 4)
         scores = boxlist.get_field("scores").reshape(-1, num_classes)
 
-        nms_mask = scores.clone()
-        nms_mask.zero_()
-
-        # Apply threshold on detection probabilities and apply NMS
+        # Apply NMS to the boxes of each class
         # Skip j = 0, because it's the background class
-        for j in range(1, num_classes):
-            scores_j = scores[:, j]
-            boxes_j = boxes[:, j * 4: (j + 1) * 4]
-            boxlist_for_class = BoxList(boxes_j, boxlist.size, mode="xyxy")
-            boxlist_for_class.add_field("scores", scores_j)
-            boxlist_for_class.add_field("idxs",
-                                        torch.arange(0, scores.shape[0]).long())
-            boxlist_for_class = boxlist_nms(
-                boxlist_for_class, 0.3
-            )
-            nms_mask[:, j][boxlist_for_class.get_field("idxs")] = 1
+        labels = torch.arange(1, num_classes, device=scores.device)
+        keep = batched_nms(boxes.view(-1, num_classes, 4)[:, 1:].reshape(-1, 4),
+                           scores[:, 1:].reshape(-1),
+                           labels.repeat(scores.shape[0]), 0.3)
+        nms_mask = scores.new_zeros(scores.shape[0] * (num_classes - 1))
+        nms_mask[keep] = 1
+        nms_mask = torch.cat((scores.new_zeros(scores.shape[0], 1),
+                              nms_mask.view(-1, num_classes - 1)), 1)
 
         dists_all = nms_mask * scores
 
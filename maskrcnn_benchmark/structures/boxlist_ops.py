@@ -3,6 +3,7 @@
 import torch
 
 from .bounding_box import BoxList
+from .packed_bounding_box import PackedBoxList, cat_packed_boxlist
 
 from maskrcnn_benchmark.layers import nms as _box_nms
 
@@ -111,6 +112,8 @@ def cat_boxlist(bboxes):
     """
     assert isinstance(bboxes, (list, tuple))
     assert all(isinstance(bbox, BoxList) for bbox in bboxes)
+    if all(isinstance(bbox, PackedBoxList) for bbox in bboxes):
+        return cat_packed_boxlist(bboxes)
 
     size = bboxes[0].size
     assert all(bbox.size == size for bbox in bboxes)
@@ -142,6 +145,9 @@ def cat_boxlist_with_fields(bboxes, fields):
     """
     assert isinstance(bboxes, (list, tuple))
     assert all(isinstance(bbox, BoxList) for bbox in bboxes)
+    if all(isinstance(bbox, PackedBoxList) for bbox in bboxes):
+        # the copies share the storage, so this is still a single copy
+        return cat_packed_boxlist([bbox.copy_with_fields(list(fields)) for bbox in bboxes])
 
     size = bboxes[0].size
     assert all(bbox.size == size for bbox in bboxes)
@@ -158,4 +164,53 @@ def cat_boxlist_with_fields(bboxes, fields):
         data = _cat([bbox.get_field(field) for bbox in bboxes], dim=0)
         cat_boxes.add_field(field, data)
 
-    return cat_boxes
\ No newline at end of file
+    return cat_boxes
+
+def unique_relation_labels(relation_labels):
+    """
+    Returns the (subj_id, obj_id, predicate) triplets which the dense
+    pred_labels matrix of relation_labels holds: per pair only the last
+    triplet is kept, background (0) predicates are dropped, and the pairs
+    are sorted like the nonzero entries of the matrix.
+
+    Arguments:
+        relation_labels (Tensor[R, 3])
+    """
+    relation_labels = relation_labels.long().view(-1, 3)
+    if len(relation_labels) == 0:
+        return relation_labels
+    num_boxes = int(relation_labels[:, :2].max()) + 1
+    keys = relation_labels[:, 0] * num_boxes + relation_labels[:, 1]
+    keys, order = torch.sort(keys, stable=True)
+    is_last = torch.ones_like(keys, dtype=torch.bool)
+    is_last[:-1] = keys[1:] != keys[:-1]
+    relation_labels = relation_labels[order[is_last]]
+    return relation_labels[relation_labels[:, 2] != 0]
+
+
+def relation_labels_to_dense(relation_labels, num_boxes):
+    """
+    Materializes the num_boxes x num_boxes pred_labels matrix, with the
+    predicate of pair (subj_id, obj_id) at [subj_id, obj_id], from the
+    relation_labels triplets.
+
+    Arguments:
+        relation_labels (Tensor[R, 3])
+        num_boxes (int)
+    """
+    relation_labels = unique_relation_labels(relation_labels)
+    pred_labels = torch.zeros((num_boxes, num_boxes), dtype=torch.int64,
+                              device=relation_labels.device)
+    pred_labels[relation_labels[:, 0], relation_labels[:, 1]] = relation_labels[:, 2]
+    return pred_labels
+
+
+def boxlist_pred_labels(boxlist):
+    """
+    Returns the dense pred_labels matrix of a relation target, which is only
+    materialized from its relation_labels field if the target does not
+    carry one.
+    """
+    if boxlist.has_field("pred_labels"):
+        return boxlist.get_field("pred_labels")
+    return relation_labels_to_dense(boxlist.get_field("relation_labels"), len(boxlist))
@@ -0,0 +1,149 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import logging
+import mmap
+import os
+import os.path as op
+import struct
+from array import array
+
+from maskrcnn_benchmark.structures.tsv_file import load_lineidx_8b, write_lineidx_8b
+
+# An image bin file stores raw (not base64 encoded) image bytes. It starts with
+# IMAGE_BIN_MAGIC, followed by one record per image:
+#   <uint32 key length><uint64 image length><key utf-8 bytes><image bytes>
+# all integers being little-endian. The offset of each record is kept in a
+# .binidx file with the same layout as the binary lineidx (int64 per row).
+IMAGE_BIN_MAGIC = b'SGBIMG01'
+IMAGE_BIN_EXT = '.bin'
+RECORD_HEADER = struct.Struct('<IQ')
+
+
+def is_image_bin_file(fname):
+    return fname is not None and op.splitext(fname)[1] == IMAGE_BIN_EXT
+
+
+def get_binidx_file(bin_file):
+    return op.splitext(bin_file)[0] + '.binidx'
+
+
+def create_binidx(bin_file, idxout=None):
+    # recover the offsets by jumping from one record header to the next.
+    if idxout is None:
+        idxout = get_binidx_file(bin_file)
+    offsets = array('q')
+    with open(bin_file, 'rb') as fp:
+        fsize = os.fstat(fp.fileno()).st_size
+        assert fp.read(len(IMAGE_BIN_MAGIC)) == IMAGE_BIN_MAGIC, \
+            "{} is not an image bin file".format(bin_file)
+        fpos = len(IMAGE_BIN_MAGIC)
+        while fpos != fsize:
+            offsets.append(fpos)
+            key_len, data_len = RECORD_HEADER.unpack(fp.read(RECORD_HEADER.size))
+            fpos += RECORD_HEADER.size + key_len + data_len
+            fp.seek(fpos)
+    write_lineidx_8b(offsets, idxout)
+
+
+class ImageBinWriter(object):
+    """Writes (key, image bytes) records and the offset index of an image
+    bin file. Files are written to temporary names and renamed on close.
+    Used as a context manager, nothing is published if the block raises."""
+    def __init__(self, bin_file):
+        self.bin_file = bin_file
+        self.binidx = get_binidx_file(bin_file)
+        self._fp = open(bin_file + '.tmp', 'wb')
+        self._fp.write(IMAGE_BIN_MAGIC)
+        self._fpos = len(IMAGE_BIN_MAGIC)
+        self._offsets = array('q')
+
+    def write(self, key, data):
+        key = key.encode('utf-8') if isinstance(key, str) else bytes(key)
+        data = memoryview(data)
+        self._offsets.append(self._fpos)
+        self._fp.write(RECORD_HEADER.pack(len(key), data.nbytes))
+        self._fp.write(key)
+        self._fp.write(data)
+        self._fpos += RECORD_HEADER.size + len(key) + data.nbytes
+
+    def close(self):
+        self._fp.close()
+        os.rename(self.bin_file + '.tmp', self.bin_file)
+        write_lineidx_8b(self._offsets, self.binidx)
+
+    def discard(self):
+        self._fp.close()
+        os.remove(self.bin_file + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ImageBinFile(object):
+    """Random access to an image bin file. It mirrors the parts of TSVFile
+    used to read images: a row is [key, image bytes] and the image bytes are
+    returned as a memoryview into the mmap'ed file."""
+    def __init__(self, bin_file, generate_binidx=False):
+        self.bin_file = bin_file
+        self.binidx = get_binidx_file(bin_file)
+        self._mm = None
+        self._offsets = None
+        if not op.isfile(self.binidx) and generate_binidx:
+            create_binidx(self.bin_file, self.binidx)
+
+    def __str__(self):
+        return "ImageBinFile(bin_file='{}')".format(self.bin_file)
+
+    def __repr__(self):
+        return str(self)
+
+    def num_rows(self):
+        self._ensure_binidx_loaded()
+        return len(self._offsets)
+
+    def __len__(self):
+        return self.num_rows()
+
+    def __getitem__(self, index):
+        return self.seek(index)
+
+    def seek(self, idx):
+        key, data = self._read_record(idx)
+        return [bytes(key).decode('utf-8'), data]
+
+    def seek_column(self, idx, col):
+        return self._read_record(idx)[col]
+
+    def get_key(self, idx):
+        return bytes(self._read_record(idx)[0]).decode('utf-8')
+
+    def _read_record(self, idx):
+        self._ensure_binidx_loaded()
+        try:
+            pos = int(self._offsets[idx])
+        except:
+            logging.info('{}-{}'.format(self.bin_file, idx))
+            raise
+        self._ensure_mmap_opened()
+        key_len, data_len = RECORD_HEADER.unpack_from(self._mm, pos)
+        key_start = pos + RECORD_HEADER.size
+        data_start = key_start + key_len
+        view = memoryview(self._mm)
+        return view[key_start:data_start], view[data_start:data_start + data_len]
+
+    def _ensure_binidx_loaded(self):
+        if self._offsets is None:
+            logging.info('loading binidx: {}'.format(self.binidx))
+            self._offsets = load_lineidx_8b(self.binidx)
+
+    def _ensure_mmap_opened(self):
+        if self._mm is None:
+            with open(self.bin_file, 'rb') as fp:
+                self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            assert self._mm[:len(IMAGE_BIN_MAGIC)] == IMAGE_BIN_MAGIC, \
+                "{} is not an image bin file".format(self.bin_file)
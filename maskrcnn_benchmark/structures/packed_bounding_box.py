@@ -0,0 +1,374 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+from collections.abc import MutableMapping
+
+import torch
+
+from .bounding_box import BoxList
+from .bounding_box_pair import BoxPairList
+
+# key of the boxes in the field dict, they are packed like any other field
+_BBOX = None
+# size of the storage words, each packed field starts at a word
+_WORD = 8
+
+
+class _Packed(object):
+    """
+    Stands for a packed field whose view into the storage was not created yet.
+    """
+
+
+class _ExtraFields(MutableMapping):
+    """
+    The extra_fields dict of a packed list: fields are read, added and
+    removed through the list, like with add_field.
+    """
+
+    def __init__(self, packed):
+        self._packed = packed
+
+    def __getitem__(self, field):
+        if not self._packed.has_field(field):
+            raise KeyError(field)
+        return self._packed._get(field)
+
+    def __setitem__(self, field, data):
+        self._packed._set(field, data)
+
+    def __delitem__(self, field):
+        if not self._packed.has_field(field):
+            raise KeyError(field)
+        self._packed._remove(field)
+
+    def __iter__(self):
+        return iter(self._packed.fields())
+
+    def __len__(self):
+        return len(self._packed.fields())
+
+
+class _PackedFields(object):
+    """
+    Keeps the boxes and the fixed-width tensor fields (one row per box, on
+    the device of the boxes) as columns of a single N x W storage of 8-byte
+    words. Indexing, slicing, moving or concatenating the list is then a
+    single tensor operation instead of one per field, and slices share the
+    storage of the list they are taken from.
+
+    Fields are only packed by the first operation which needs the storage,
+    and only materialized, as views into the storage, when they are read.
+    The views may be non-contiguous. Other fields (masks, keypoints, tensors
+    which require grad or do not hold one row per box) are kept as they are,
+    like BoxList does.
+    """
+
+    _box_cls = None
+
+    def __init__(self, bbox, image_size, mode="xyxy"):
+        # validates the boxes like the unpacked class does
+        bbox = self._box_cls(bbox, image_size, mode).bbox
+        self.size = image_size  # (image_width, image_height)
+        self.mode = mode
+        self._storage = None
+        # packed field -> (start byte, stop byte, dtype, shape of a row)
+        self._layout = {}
+        # field -> data, or for packed fields their view or _Packed, in the
+        # order the fields were added
+        self._fields = {_BBOX: bbox}
+        self._length = bbox.size(0)
+
+    @classmethod
+    def _new(cls, size, mode, storage, layout, fields, length):
+        packed = cls.__new__(cls)
+        packed.size = size
+        packed.mode = mode
+        packed._storage = storage
+        packed._layout = layout
+        packed._fields = fields
+        packed._length = length
+        return packed
+
+    def __getstate__(self):
+        # unpickled views would not share the unpickled storage
+        fields = {field: _Packed if field in self._layout else data
+                  for field, data in self._fields.items()}
+        return (self.size, self.mode, self._storage, self._layout, fields, self._length)
+
+    def __setstate__(self, state):
+        (self.size, self.mode, self._storage, self._layout, self._fields,
+         self._length) = state
+
+    @classmethod
+    def from_boxlist(cls, boxlist):
+        packed = cls(boxlist.bbox, boxlist.size, boxlist.mode)
+        for field in boxlist.fields():
+            packed.add_field(field, boxlist.get_field(field))
+        return packed
+
+    def to_boxlist(self):
+        boxlist = self._box_cls(self.bbox, self.size, self.mode)
+        for field in self.fields():
+            boxlist.add_field(field, self.get_field(field))
+        return boxlist
+
+    @property
+    def bbox(self):
+        return self._get(_BBOX)
+
+    @bbox.setter
+    def bbox(self, bbox):
+        self._set(_BBOX, bbox)
+        self._length = bbox.size(0)
+
+    @property
+    def extra_fields(self):
+        return _ExtraFields(self)
+
+    @extra_fields.setter
+    def extra_fields(self, extra_fields):
+        extra_fields = dict(extra_fields)
+        for field in self.fields():
+            self._remove(field)
+        for field, data in extra_fields.items():
+            self._set(field, data)
+
+    def add_field(self, field, field_data):
+        self._set(field, field_data)
+
+    def get_field(self, field):
+        return self._get(field)
+
+    def has_field(self, field):
+        return field is not _BBOX and field in self._fields
+
+    def fields(self):
+        return [field for field in self._fields if field is not _BBOX]
+
+    def _copy_extra_fields(self, bbox):
+        for field in bbox.fields():
+            self.add_field(field, bbox.get_field(field))
+
+    def _get(self, field):
+        data = self._fields[field]
+        if data is _Packed:
+            start, stop, dtype, shape = self._layout[field]
+            data = self._storage.view(torch.uint8)[:, start:stop]
+            data = data.view(dtype).view((-1,) + shape)
+            self._fields[field] = data
+        return data
+
+    def _set(self, field, data):
+        if field in self._layout:
+            # the layout may be shared with other lists
+            self._layout = {k: v for k, v in self._layout.items() if k != field}
+        self._fields[field] = data
+
+    def _remove(self, field):
+        if field in self._layout:
+            self._layout = {k: v for k, v in self._layout.items() if k != field}
+        del self._fields[field]
+
+    def _unpacked(self):
+        return [(field, data) for field, data in self._fields.items()
+                if field not in self._layout]
+
+    def _packable(self, data, device):
+        return (isinstance(data, torch.Tensor) and data.dim() > 0
+                and data.size(0) == self._length and data.shape[1:].numel() > 0
+                and data.device == device and not data.requires_grad
+                and data.element_size() <= _WORD)
+
+    def _pack(self):
+        device = self._fields[_BBOX].device if self._storage is None else self._storage.device
+        pending = set(field for field, data in self._unpacked()
+                      if self._packable(data, device))
+        if not pending:
+            return
+
+        columns, layout, width = [], {}, 0
+        for field, data in self._fields.items():
+            if field in self._layout:
+                start, stop, dtype, shape = self._layout[field]
+                data = self._storage.view(torch.uint8)[:, start:stop]
+            elif field in pending:
+                dtype, shape = data.dtype, tuple(data.shape[1:])
+                data = data.contiguous().view(self._length, data.shape[1:].numel())
+                data = data.view(torch.uint8)
+            else:
+                continue
+            num_bytes = data.size(1)
+            layout[field] = (width, width + num_bytes, dtype, shape)
+            columns.append(data)
+            padding = -num_bytes % _WORD
+            if padding:
+                columns.append(data.new_zeros((self._length, padding)))
+            width += num_bytes + padding
+
+        self._storage = torch.cat(columns, dim=1).view(torch.int64)
+        self._layout = layout
+        for field in layout:
+            self._fields[field] = _Packed
+
+    def _new_rows(self, storage, unpacked, length):
+        # a list with other rows of the storage and of the unpacked fields
+        fields = {field: _Packed if field in self._layout else unpacked[field]
+                  for field in self._fields}
+        return self._new(self.size, self.mode, storage, self._layout, fields, length)
+
+    def _with_boxes(self, boxes, transform=None):
+        # boxes is the unpacked list of the transformed boxes, the packed
+        # fields are shared with this list
+        fields = {}
+        for field, data in self._fields.items():
+            if field is _BBOX:
+                data = boxes.bbox
+            elif transform is not None and not isinstance(data, torch.Tensor) \
+                    and field not in self._layout:
+                data = transform(data)
+            fields[field] = data
+        layout = {k: v for k, v in self._layout.items() if k is not _BBOX}
+        return self._new(boxes.size, boxes.mode, self._storage, layout, fields,
+                         self._length)
+
+    def _boxes(self):
+        return self._box_cls(self.bbox, self.size, self.mode)
+
+    def convert(self, mode):
+        if mode == self.mode:
+            return self
+        return self._with_boxes(self._boxes().convert(mode))
+
+    def resize(self, size, *args, **kwargs):
+        """
+        Returns a resized copy of this bounding box
+
+        :param size: The requested size in pixels, as a 2-tuple:
+            (width, height).
+        """
+        return self._with_boxes(self._boxes().resize(size, *args, **kwargs),
+                                lambda v: v.resize(size, *args, **kwargs))
+
+    def transpose(self, method):
+        return self._with_boxes(self._boxes().transpose(method),
+                                lambda v: v.transpose(method))
+
+    def crop(self, box):
+        return self._with_boxes(self._boxes().crop(box), lambda v: v.crop(box))
+
+    # Tensor-like methods
+
+    def to(self, device, **kwargs):
+        self._pack()
+        storage = self._storage
+        if storage is not None:
+            # other arguments, like dtype, only apply to the unpacked fields
+            storage = storage.to(device, non_blocking=kwargs.get("non_blocking", False))
+        unpacked = {}
+        for field, data in self._unpacked():
+            if hasattr(data, "to"):
+                data = data.to(device, **kwargs)
+            unpacked[field] = data
+        return self._new_rows(storage, unpacked, self._length)
+
+    def __getitem__(self, item):
+        self._pack()
+        unpacked = {field: data[item] for field, data in self._unpacked()}
+        if self._storage is None:
+            rows = unpacked[_BBOX]
+        elif isinstance(item, torch.Tensor) and item.dim() == 1:
+            # index_select is faster than advanced indexing
+            if item.dtype in (torch.bool, torch.uint8):
+                item = item.nonzero().squeeze(1)
+            rows = self._storage.index_select(0, item)
+        else:
+            rows = self._storage[item]
+        if rows.dim() != 2:
+            raise ValueError(
+                "bbox should have 2 dimensions, got {}".format(rows.dim() - 1)
+            )
+        storage = None if self._storage is None else rows
+        return self._new_rows(storage, unpacked, rows.size(0))
+
+    def __len__(self):
+        return self._length
+
+    def copy_with_fields(self, fields, skip_missing=False):
+        if not isinstance(fields, (list, tuple)):
+            fields = [fields]
+        kept = {_BBOX: self._fields[_BBOX]}
+        for field in fields:
+            if self.has_field(field):
+                kept[field] = self._fields[field]
+            elif not skip_missing:
+                raise KeyError("Field '{}' not found in {}".format(field, self))
+        layout = {k: v for k, v in self._layout.items() if k in kept}
+        return self._new(self.size, self.mode, self._storage, layout, kept,
+                         self._length)
+
+
+class PackedBoxList(_PackedFields, BoxList):
+    """
+    A BoxList which packs its boxes and fixed-width fields into a single
+    storage, see _PackedFields.
+    """
+
+    _box_cls = BoxList
+
+
+class PackedBoxPairList(_PackedFields, BoxPairList):
+    """
+    A BoxPairList which packs its box pairs and fixed-width fields into a
+    single storage, see _PackedFields.
+    """
+
+    _box_cls = BoxPairList
+
+
+def _cat(tensors, dim=0):
+    if len(tensors) == 1:
+        return tensors[0]
+    return torch.cat(tensors, dim)
+
+
+def cat_packed_boxlist(bboxes):
+    """
+    Concatenates a list of PackedBoxList or PackedBoxPairList (having the same
+    image size and fields) into a single one. Lists whose fields are packed
+    the same way, e.g. slices of the same list, are concatenated with a
+    single copy of their storages.
+
+    Arguments:
+        bboxes (list[PackedBoxList])
+    """
+    assert isinstance(bboxes, (list, tuple))
+    assert all(isinstance(bbox, _PackedFields) for bbox in bboxes)
+
+    size = bboxes[0].size
+    assert all(bbox.size == size for bbox in bboxes)
+
+    mode = bboxes[0].mode
+    assert all(bbox.mode == mode for bbox in bboxes)
+
+    fields = set(bboxes[0].fields())
+    assert all(set(bbox.fields()) == fields for bbox in bboxes)
+
+    packing = []
+    for bbox in bboxes:
+        bbox._pack()
+        width = None if bbox._storage is None else bbox._storage.size(1)
+        packing.append((bbox._layout, width))
+
+    if not all(p == packing[0] for p in packing[1:]):
+        cat_boxes = type(bboxes[0])(torch.cat([bbox.bbox for bbox in bboxes], dim=0),
+                                    size, mode)
+        for field in bboxes[0].fields():
+            data = torch.cat([bbox.get_field(field) for bbox in bboxes], dim=0)
+            cat_boxes.add_field(field, data)
+        return cat_boxes
+
+    storage = None
+    if bboxes[0]._storage is not None:
+        storage = _cat([bbox._storage for bbox in bboxes], dim=0)
+    unpacked = {field: _cat([bbox._fields[field] for bbox in bboxes], dim=0)
+                for field, _ in bboxes[0]._unpacked()}
+    return bboxes[0]._new_rows(storage, unpacked, sum(len(bbox) for bbox in bboxes))
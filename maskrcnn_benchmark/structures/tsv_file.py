@@ -1,21 +1,115 @@
 # Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license. 
 import logging
+import mmap
+import multiprocessing
 import os
 import os.path as op
 
+import numpy as np
 
-def create_lineidx(filein, idxout):
+# binary lineidx: one little-endian int64 offset per row, stored next to the
+# text lineidx as <name>.lineidx.8b so that it can be memory-mapped.
+LINEIDX_8B_SUFFIX = '.8b'
+LINEIDX_8B_DTYPE = np.dtype('<i8')
+
+
+def get_lineidx_8b_file(lineidx):
+    return lineidx + LINEIDX_8B_SUFFIX
+
+
+def write_lineidx_8b(offsets, idxout_8b):
+    idxout_8b_tmp = idxout_8b + '.tmp'
+    np.asarray(offsets, dtype=LINEIDX_8B_DTYPE).tofile(idxout_8b_tmp)
+    os.rename(idxout_8b_tmp, idxout_8b)
+
+
+def remove_stale_lineidx_8b(lineidx):
+    # a binary lineidx left over from a previous version of the tsv file
+    # would shadow the newly written text lineidx.
+    lineidx_8b = get_lineidx_8b_file(lineidx)
+    if op.isfile(lineidx_8b):
+        os.remove(lineidx_8b)
+
+
+def load_lineidx_8b(idxin_8b):
+    """Memory-maps a binary lineidx. The pages are backed by the file, so
+    forked DataLoader workers share them without copying."""
+    if os.stat(idxin_8b).st_size == 0:
+        return np.zeros(0, dtype=LINEIDX_8B_DTYPE)
+    return np.memmap(idxin_8b, dtype=LINEIDX_8B_DTYPE, mode='r')
+
+
+def convert_lineidx_to_8b(idxin, idxout_8b=None):
+    # convert an existing text lineidx without re-scanning the tsv file.
+    if idxout_8b is None:
+        idxout_8b = get_lineidx_8b_file(idxin)
+    with open(idxin, 'r') as fp:
+        offsets = np.array(fp.read().split(), dtype=LINEIDX_8B_DTYPE)
+    write_lineidx_8b(offsets, idxout_8b)
+
+
+def _find_line_starts(args):
+    # offsets of the lines starting inside [start, end) of filein, i.e.
+    # the byte after every newline in the range.
+    filein, start, end, chunk_size = args
+    result = []
+    with open(filein, 'rb') as fp:
+        fp.seek(start)
+        fpos = start
+        while fpos < end:
+            chunk = fp.read(min(chunk_size, end - fpos))
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+            result.append(newlines.astype(LINEIDX_8B_DTYPE) + (fpos + 1))
+            fpos += len(chunk)
+    if len(result) == 0:
+        return np.zeros(0, dtype=LINEIDX_8B_DTYPE)
+    return np.concatenate(result)
+
+
+def find_line_starts(filein, num_workers=1, chunk_size=64 << 20):
+    """Returns the offsets of all lines in filein as an int64 array. The file
+    is split into byte ranges which are scanned for newlines in bulk, in a
+    process pool if num_workers > 1."""
+    fsize = os.stat(filein).st_size
+    if fsize == 0:
+        return np.zeros(0, dtype=LINEIDX_8B_DTYPE)
+    num_ranges = max(1, min(num_workers * 4, -(-fsize // chunk_size)))
+    bounds = np.linspace(0, fsize, num_ranges + 1).astype(np.int64)
+    args = [(filein, int(bounds[i]), int(bounds[i + 1]), chunk_size)
+            for i in range(num_ranges)]
+    if num_workers > 1 and num_ranges > 1:
+        with multiprocessing.Pool(min(num_workers, num_ranges)) as pool:
+            starts = pool.map(_find_line_starts, args)
+    else:
+        starts = [_find_line_starts(a) for a in args]
+    offsets = np.concatenate([np.zeros(1, dtype=LINEIDX_8B_DTYPE)] + starts)
+    # a newline at the very end of the file does not start a new line.
+    if offsets[-1] == fsize:
+        offsets = offsets[:-1]
+    return offsets
+
+
+def write_lineidx(offsets, idxout, batch_size=1 << 20):
     idxout_tmp = idxout + '.tmp'
-    with open(filein, 'r') as tsvin, open(idxout_tmp,'w') as tsvout:
-        fsize = os.fstat(tsvin.fileno()).st_size
-        fpos = 0
-        while fpos!=fsize:
-            tsvout.write(str(fpos)+"\n")
-            tsvin.readline()
-            fpos = tsvin.tell()
+    with open(idxout_tmp, 'w') as fp:
+        for i in range(0, len(offsets), batch_size):
+            batch = offsets[i:i + batch_size].tolist()
+            fp.write('\n'.join(map(str, batch)) + '\n')
     os.rename(idxout_tmp, idxout)
 
 
+def create_lineidx(filein, idxout, binary=False, num_workers=1):
+    """Writes the text lineidx of filein to idxout. If binary is True, the
+    binary lineidx (idxout + '.8b') is written as well. num_workers > 1
+    scans the file with a process pool, see find_line_starts."""
+    offsets = find_line_starts(filein, num_workers=num_workers)
+    write_lineidx(offsets, idxout)
+    if binary:
+        write_lineidx_8b(offsets, get_lineidx_8b_file(idxout))
+    else:
+        remove_stale_lineidx_8b(idxout)
+
+
 def read_to_character(fp, c):
     result = []
     while True:
@@ -33,13 +127,16 @@ class TSVFile(object):
     def __init__(self, tsv_file, generate_lineidx=False):
         self.tsv_file = tsv_file
         self.lineidx = op.splitext(tsv_file)[0] + '.lineidx'
+        self.lineidx_8b = get_lineidx_8b_file(self.lineidx)
         self._fp = None
+        self._mm = None
         self._lineidx = None
         # the process always keeps the process which opens the file. 
         # If the pid is not equal to the currrent pid, we will re-open the file.
         self.pid = None
         # generate lineidx if not exist
-        if not op.isfile(self.lineidx) and generate_lineidx:
+        if not op.isfile(self.lineidx) and not op.isfile(self.lineidx_8b) \
+                and generate_lineidx:
             create_lineidx(self.tsv_file, self.lineidx)
 
     def __del__(self):
@@ -64,16 +161,57 @@ class TSVFile(object):
         except:
             logging.info('{}-{}'.format(self.tsv_file, idx))
             raise
-        self._fp.seek(pos)
+        self._fp.seek(int(pos))
         return [s.strip() for s in self._fp.readline().split('\t')]
 
     def seek_first_column(self, idx):
         self._ensure_tsv_opened()
         self._ensure_lineidx_loaded()
         pos = self._lineidx[idx]
-        self._fp.seek(pos)
+        self._fp.seek(int(pos))
         return read_to_character(self._fp, '\t')
 
+    def seek_bytes(self, idx):
+        """Returns the columns of row idx as memoryviews into the mmap'ed
+        tsv file. Nothing is decoded or copied; unlike seek, only the line
+        terminator is stripped."""
+        start, end = self._get_row_range(idx)
+        view = memoryview(self._mm)
+        result = []
+        while True:
+            tab = self._mm.find(b'\t', start, end)
+            if tab < 0:
+                result.append(view[start:end])
+                return result
+            result.append(view[start:tab])
+            start = tab + 1
+
+    def seek_column(self, idx, col):
+        """Returns column col (negative values count from the end) of row
+        idx as a memoryview, without touching the other columns."""
+        start, end = self._get_row_range(idx)
+        if col >= 0:
+            for _ in range(col):
+                tab = self._mm.find(b'\t', start, end)
+                if tab < 0:
+                    raise IndexError('{} has no column {} in row {}'.format(
+                        self.tsv_file, col, idx))
+                start = tab + 1
+            tab = self._mm.find(b'\t', start, end)
+            if tab >= 0:
+                end = tab
+        else:
+            for _ in range(-col - 1):
+                tab = self._mm.rfind(b'\t', start, end)
+                if tab < 0:
+                    raise IndexError('{} has no column {} in row {}'.format(
+                        self.tsv_file, col, idx))
+                end = tab
+            tab = self._mm.rfind(b'\t', start, end)
+            if tab >= 0:
+                start = tab + 1
+        return memoryview(self._mm)[start:end]
+
     def get_key(self, idx):
         return self.seek_first_column(idx)
 
@@ -85,10 +223,39 @@ class TSVFile(object):
 
     def _ensure_lineidx_loaded(self):
         if self._lineidx is None:
+            if op.isfile(self.lineidx_8b):
+                logging.info('loading lineidx: {}'.format(self.lineidx_8b))
+                self._lineidx = load_lineidx_8b(self.lineidx_8b)
+                return
             logging.info('loading lineidx: {}'.format(self.lineidx))
             with open(self.lineidx, 'r') as fp:
                 self._lineidx = [int(i.strip()) for i in fp.readlines()]
 
+    def _get_row_range(self, idx):
+        # the row ends where the next one starts, so the (possibly multi-MB)
+        # line never has to be scanned for its newline.
+        self._ensure_lineidx_loaded()
+        num_rows = len(self._lineidx)
+        try:
+            start = int(self._lineidx[idx])
+        except:
+            logging.info('{}-{}'.format(self.tsv_file, idx))
+            raise
+        self._ensure_mmap_opened()
+        if idx < 0:
+            idx += num_rows
+        end = int(self._lineidx[idx + 1]) if idx + 1 < num_rows else len(self._mm)
+        while end > start and self._mm[end - 1] in b'\r\n':
+            end -= 1
+        return start, end
+
+    def _ensure_mmap_opened(self):
+        # a read-only shared mapping stays valid in forked workers and has no
+        # file position to share, so unlike _fp it is never re-opened.
+        if self._mm is None:
+            with open(self.tsv_file, 'rb') as fp:
+                self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
     def _ensure_tsv_opened(self):
         if self._fp is None:
             self._fp = open(self.tsv_file, 'r')
@@ -125,6 +292,10 @@ class CompositeTSVFile():
         idx_source, idx_row = self.seq[index]
         return self.tsvs[idx_source].seek(idx_row)
 
+    def seek_column(self, index, col):
+        idx_source, idx_row = self.seq[index]
+        return self.tsvs[idx_source].seek_column(idx_row, col)
+
     def __len__(self):
         return len(self.seq)
 
@@ -4,12 +4,18 @@ import os.path as op
 import json
 import numpy as np
 import base64
+import binascii
 import cv2
 import math
+from array import array
 from tqdm import tqdm
 
 from maskrcnn_benchmark.utils.miscellaneous import mkdir, load_from_yaml_file, write_to_yaml_file
 from maskrcnn_benchmark.structures.tsv_file import TSVFile
+from maskrcnn_benchmark.structures.tsv_file import get_lineidx_8b_file
+from maskrcnn_benchmark.structures.tsv_file import write_lineidx, write_lineidx_8b
+from maskrcnn_benchmark.structures.tsv_file import remove_stale_lineidx_8b
+from maskrcnn_benchmark.structures.image_bin_file import ImageBinWriter
 
 
 def img_from_base64(imagestring):
@@ -22,6 +28,12 @@ def img_from_base64(imagestring):
         return None
 
 
+def img_from_bytes(imagebytes):
+    # raw encoded image bytes, e.g. a memoryview from ImageBinFile.
+    nparr = np.frombuffer(imagebytes, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+
 def load_linelist_file(linelist_file):
     if linelist_file is not None:
         line_list = []
@@ -31,28 +43,74 @@ def load_linelist_file(linelist_file):
         return line_list
 
 
-def tsv_writer(values, tsv_file, sep='\t'):
+def _format_tsv_row(value, sep):
+    # this step makes sure python2 and python3 encoded img string are the same.
+    # for python2 encoded image string, it is a str class starts with "/".
+    # for python3 encoded image string, it is a bytes class starts with "b'/".
+    # v.decode('utf-8') converts bytes to str so the content is the same.
+    # v.decode('utf-8') should only be applied to bytes class type. 
+    value = [v if type(v)!=bytes else v.decode('utf-8') for v in value]
+    return '{0}\n'.format(sep.join(map(str, value)))
+
+
+def tsv_writer(values, tsv_file, sep='\t', binary_lineidx=False, buffer_size=0):
+    # binary_lineidx: also write the memory-mappable <name>.lineidx.8b file.
+    # buffer_size: if > 0, rows are buffered and written in bulk once about
+    # buffer_size bytes are pending, see buffered_tsv_writer.
+    if buffer_size > 0:
+        buffered_tsv_writer(values, tsv_file, sep=sep,
+                            binary_lineidx=binary_lineidx, buffer_size=buffer_size)
+        return
     mkdir(op.dirname(tsv_file))
     lineidx_file = op.splitext(tsv_file)[0] + '.lineidx'
     idx = 0
+    offsets = array('q')
     tsv_file_tmp = tsv_file + '.tmp'
     lineidx_file_tmp = lineidx_file + '.tmp'
-    with open(tsv_file_tmp, 'w') as fp, open(lineidx_file_tmp, 'w') as fpidx:
+    with open(tsv_file_tmp, 'w', encoding='utf-8') as fp, open(lineidx_file_tmp, 'w') as fpidx:
         assert values is not None
         for value in values:
             assert value is not None
-            # this step makes sure python2 and python3 encoded img string are the same.
-            # for python2 encoded image string, it is a str class starts with "/".
-            # for python3 encoded image string, it is a bytes class starts with "b'/".
-            # v.decode('utf-8') converts bytes to str so the content is the same.
-            # v.decode('utf-8') should only be applied to bytes class type. 
-            value = [v if type(v)!=bytes else v.decode('utf-8') for v in value]
-            v = '{0}\n'.format(sep.join(map(str, value)))
+            v = _format_tsv_row(value, sep)
             fp.write(v)
             fpidx.write(str(idx) + '\n')
-            idx = idx + len(v)
+            if binary_lineidx:
+                offsets.append(idx)
+            # byte offsets, as in buffered_tsv_writer
+            idx = idx + (len(v) if v.isascii() else len(v.encode('utf-8')))
     os.rename(tsv_file_tmp, tsv_file)
     os.rename(lineidx_file_tmp, lineidx_file)
+    if binary_lineidx:
+        write_lineidx_8b(offsets, get_lineidx_8b_file(lineidx_file))
+    else:
+        remove_stale_lineidx_8b(lineidx_file)
+
+
+def buffered_tsv_writer(values, tsv_file, sep='\t', binary_lineidx=False,
+                        buffer_size=16 << 20):
+    """Same output as tsv_writer, but the tsv file is written through a
+    buffer of buffer_size bytes and the lineidx is written in one go at the
+    end, which avoids many small writes on network file systems. Offsets
+    are byte offsets, so they also hold for rows with non-ascii characters."""
+    mkdir(op.dirname(tsv_file))
+    lineidx_file = op.splitext(tsv_file)[0] + '.lineidx'
+    idx = 0
+    offsets = array('q')
+    tsv_file_tmp = tsv_file + '.tmp'
+    with open(tsv_file_tmp, 'w', encoding='utf-8', buffering=buffer_size) as fp:
+        assert values is not None
+        for value in values:
+            assert value is not None
+            v = _format_tsv_row(value, sep)
+            fp.write(v)
+            offsets.append(idx)
+            idx = idx + (len(v) if v.isascii() else len(v.encode('utf-8')))
+    os.rename(tsv_file_tmp, tsv_file)
+    write_lineidx(offsets, lineidx_file)
+    if binary_lineidx:
+        write_lineidx_8b(offsets, get_lineidx_8b_file(lineidx_file))
+    else:
+        remove_stale_lineidx_8b(lineidx_file)
 
 
 def tsv_reader(tsv_file, sep='\t'):
@@ -61,6 +119,28 @@ def tsv_reader(tsv_file, sep='\t'):
             yield [x.strip() for x in line.split(sep)]
 
 
+def image_bin_writer(values, bin_file):
+    # values yields (key, raw encoded image bytes).
+    mkdir(op.dirname(bin_file))
+    with ImageBinWriter(bin_file) as writer:
+        for key, data in values:
+            writer.write(key, data)
+
+
+def convert_tsv_to_image_bin(img_file, save_file=None, col=-1):
+    """Converts an image tsv file with base64 encoded images in column col
+    into an image bin file that can replace it as the 'img' entry of a
+    dataset yaml."""
+    tsv = TSVFile(img_file)
+    def gen_rows():
+        for i in tqdm(range(tsv.num_rows())):
+            yield tsv.get_key(i), binascii.a2b_base64(tsv.seek_column(i, col))
+
+    save_file = config_save_file(img_file, save_file, '.bin')
+    image_bin_writer(gen_rows(), save_file)
+    return save_file
+
+
 def config_save_file(tsv_file, save_file=None, append_str='.new.tsv'):
     if save_file is not None:
         return save_file
@@ -1,9 +1,14 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
+import glob
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 
 import torch
 
+from maskrcnn_benchmark.utils.comm import get_rank, get_world_size, synchronize
 from maskrcnn_benchmark.utils.model_serialization import load_state_dict
 from maskrcnn_benchmark.utils.c2_model_loading import load_c2_format
 from maskrcnn_benchmark.utils.imports import import_file
@@ -19,7 +24,18 @@ class Checkpointer(object):
         save_dir="",
         save_to_disk=None,
         logger=None,
+        async_save=False,
+        sharded=False,
     ):
+        """
+        Arguments:
+            async_save (bool): save returns once the checkpoint is copied to
+                (pinned) cpu memory, and it is written by a background thread.
+            sharded (bool): save is called on every rank, and each rank writes
+                its slice of the model and optimizer state. The process with
+                save_to_disk writes the rest, and tags the checkpoint once all
+                the slices are written.
+        """
         self.model = model
         self.optimizer = optimizer
         self.scheduler = scheduler
@@ -28,14 +44,23 @@ class Checkpointer(object):
         if logger is None:
             logger = logging.getLogger(__name__)
         self.logger = logger
+        self.async_save = async_save
+        self.sharded = sharded
+        self._save_thread = None
+        self._save_error = None
+        # cpu copies of the tensors of the last checkpoint, reused by the next
+        self._buffers = {}
 
     def save(self, name, **kwargs):
         if not self.save_dir:
             return
 
-        if not self.save_to_disk:
+        if not self.save_to_disk and not self.sharded:
             return
 
+        # the buffers are only reused once the previous checkpoint is written
+        self.wait()
+
         data = {}
         data["model"] = self.model.state_dict()
         if self.optimizer is not None:
@@ -45,8 +70,98 @@ class Checkpointer(object):
         data.update(kwargs)
 
         save_file = os.path.join(self.save_dir, "{}.pth".format(name))
-        self.logger.info("Saving checkpoint to {}".format(save_file))
-        torch.save(data, save_file)
+        if self.sharded:
+            rank, world_size = get_rank(), get_world_size()
+            if self.save_to_disk:
+                # the slices of a previous checkpoint with this name must not
+                # be mistaken for the new ones
+                for f in glob.glob(_shard_file(save_file, "*", "*")):
+                    os.remove(f)
+            synchronize()
+            shards, index = split_checkpoint(data, world_size)
+            data = shards[rank]
+            shard_file = _shard_file(save_file, rank, world_size)
+            index["shards"] = [os.path.basename(_shard_file(save_file, k, world_size))
+                               for k in range(world_size)]
+        if self.async_save:
+            data = self._snapshot(data)
+            if self.sharded:
+                index = self._snapshot(index, ("index",))
+            if torch.cuda.is_available():
+                # waits for the non blocking copies
+                torch.cuda.synchronize()
+
+        if self.sharded:
+            self.logger.info("Saving checkpoint slice to {}".format(shard_file))
+            if self.save_to_disk:
+                write = lambda: (_save_atomic(data, shard_file),
+                                 self._save_index(index, save_file))
+            else:
+                write = lambda: _save_atomic(data, shard_file)
+        else:
+            self.logger.info("Saving checkpoint to {}".format(save_file))
+            write = lambda: (_save_atomic(data, save_file),
+                             self.tag_last_checkpoint(save_file))
+
+        if self.async_save:
+            self._save_thread = threading.Thread(
+                target=self._write_in_background, args=(write,), name="checkpoint")
+            self._save_thread.start()
+        else:
+            write()
+
+    def wait(self):
+        """
+        Waits for the checkpoint being written in the background, and raises
+        the error it may have failed with.
+        """
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+        if self._save_error is not None:
+            error, self._save_error = self._save_error, None
+            raise error
+
+    def _write_in_background(self, write):
+        try:
+            write()
+        except Exception as e:
+            self.logger.exception("Failed to save checkpoint")
+            self._save_error = e
+
+    def _snapshot(self, obj, key=()):
+        # copies the tensors to cpu, so that training can go on while they
+        # are written. The copies of the previous checkpoint are reused when
+        # they have the same shape, as allocating pinned memory is slow.
+        if isinstance(obj, torch.Tensor):
+            buffer = self._buffers.get(key)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = torch.empty(obj.shape, dtype=obj.dtype,
+                                     pin_memory=torch.cuda.is_available())
+                self._buffers[key] = buffer
+            buffer.copy_(obj.detach(), non_blocking=obj.is_cuda)
+            return buffer
+        if isinstance(obj, dict):
+            copy = OrderedDict() if isinstance(obj, OrderedDict) else {}
+            for k, v in obj.items():
+                copy[k] = self._snapshot(v, key + (k,))
+            return copy
+        if isinstance(obj, (list, tuple)):
+            copy = [self._snapshot(v, key + (i,)) for i, v in enumerate(obj)]
+            return copy if isinstance(obj, list) else tuple(copy)
+        return obj
+
+    def _save_index(self, index, save_file):
+        # the slices are written by the other ranks, without a collective as
+        # this may run in a background thread
+        shard_files = [os.path.join(self.save_dir, f) for f in index["shards"]]
+        deadline = time.time() + _SHARD_TIMEOUT
+        while not all(os.path.exists(f) for f in shard_files):
+            if time.time() > deadline:
+                raise RuntimeError(
+                    "Timed out waiting for the checkpoint slices {}".format(shard_files))
+            time.sleep(0.1)
+        _save_atomic(index, save_file)
         self.tag_last_checkpoint(save_file)
 
     def load(self, f=None, use_latest=True):
@@ -88,16 +203,103 @@ class Checkpointer(object):
 
     def tag_last_checkpoint(self, last_filename):
         save_file = os.path.join(self.save_dir, "last_checkpoint")
-        with open(save_file, "w") as f:
+        # replaced at once, a crash cannot leave it truncated
+        tmp_file = "{}.tmp".format(save_file)
+        with open(tmp_file, "w") as f:
             f.write(last_filename)
+        os.replace(tmp_file, save_file)
 
     def _load_file(self, f):
-        return torch.load(f, map_location=torch.device("cpu"))
+        loaded = torch.load(f, map_location=torch.device("cpu"))
+        if isinstance(loaded, dict) and "shards" in loaded:
+            shards = [torch.load(os.path.join(os.path.dirname(f), shard_file),
+                                 map_location=torch.device("cpu"))
+                      for shard_file in loaded.pop("shards")]
+            loaded = merge_checkpoint(shards, loaded)
+        return loaded
 
     def _load_model(self, checkpoint):
         load_state_dict(self.model, checkpoint.pop("model"))
 
 
+# seconds the slices of a sharded checkpoint are waited for
+_SHARD_TIMEOUT = 1800
+
+
+def _shard_file(save_file, rank, world_size):
+    return "{}.shard{}-of-{}.pth".format(os.path.splitext(save_file)[0], rank, world_size)
+
+
+def _save_atomic(data, save_file):
+    # a partially written file never has the checkpoint name
+    tmp_file = "{}.tmp".format(save_file)
+    torch.save(data, tmp_file)
+    os.replace(tmp_file, save_file)
+
+
+def _num_bytes(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(_num_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_num_bytes(v) for v in obj)
+    return 0
+
+
+def split_checkpoint(data, world_size):
+    """
+    Splits the model parameters and the optimizer state of a checkpoint into
+    world_size slices of about the same size. Every rank computes the same
+    split, as they hold the same shapes.
+
+    Returns the list of slices, and the checkpoint without them.
+    """
+    entries = []
+    for k, v in data["model"].items():
+        entries.append(("model", k, v))
+    optimizer = data.get("optimizer")
+    if isinstance(optimizer, dict) and "state" in optimizer:
+        for k, v in optimizer["state"].items():
+            entries.append(("optimizer", k, v))
+
+    shards = [{"model": OrderedDict(), "optimizer": {}} for _ in range(world_size)]
+    shard_bytes = [0] * world_size
+    # the largest entries first, each to the smallest slice
+    order = sorted(range(len(entries)), key=lambda i: -_num_bytes(entries[i][2]))
+    for i in order:
+        part, k, v = entries[i]
+        rank = min(range(world_size), key=lambda r: shard_bytes[r])
+        shards[rank][part][k] = v
+        shard_bytes[rank] += _num_bytes(v)
+
+    index = dict(data)
+    index["model"] = list(data["model"].keys())
+    if isinstance(optimizer, dict) and "state" in optimizer:
+        index["optimizer"] = dict(optimizer)
+        index["optimizer"]["state"] = list(optimizer["state"].keys())
+    return shards, index
+
+
+def merge_checkpoint(shards, index):
+    """
+    Inverse of split_checkpoint.
+    """
+    model = {}
+    optimizer_state = {}
+    for shard in shards:
+        model.update(shard["model"])
+        optimizer_state.update(shard["optimizer"])
+
+    data = dict(index)
+    data["model"] = OrderedDict((k, model[k]) for k in index["model"])
+    if isinstance(index.get("optimizer"), dict) and "state" in index["optimizer"]:
+        data["optimizer"] = dict(index["optimizer"])
+        data["optimizer"]["state"] = {k: optimizer_state[k]
+                                      for k in index["optimizer"]["state"]}
+    return data
+
+
 class DetectronCheckpointer(Checkpointer):
     def __init__(
         self,
@@ -110,7 +312,9 @@ class DetectronCheckpointer(Checkpointer):
         logger=None,
     ):
         super(DetectronCheckpointer, self).__init__(
-            model, optimizer, scheduler, save_dir, save_to_disk, logger
+            model, optimizer, scheduler, save_dir, save_to_disk, logger,
+            async_save=cfg.SOLVER.CHECKPOINT_ASYNC,
+            sharded=cfg.SOLVER.CHECKPOINT_SHARDED,
         )
         self.cfg = cfg.clone()
 
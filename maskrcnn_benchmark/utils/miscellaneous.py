@@ -93,6 +93,8 @@ def delete_tsv_files(tsvs):
         line = os.path.splitext(t)[0] + '.lineidx'
         if os.path.isfile(line):
             try_delete(line)
+        if os.path.isfile(line + '.8b'):
+            try_delete(line + '.8b')
 
 
 def concat_files(ins, out):
@@ -117,8 +119,11 @@ def concat_tsv_files(tsvs, out_tsv):
                 all_idx.append(idx)
             else:
                 all_idx.append(str(int(idx) + sizes[i - 1]))
-    with open(os.path.splitext(out_tsv)[0] + '.lineidx', 'w') as f:
+    out_lineidx = os.path.splitext(out_tsv)[0] + '.lineidx'
+    with open(out_lineidx, 'w') as f:
         f.write('\n'.join(all_idx))
+    if os.path.isfile(out_lineidx + '.8b'):
+        try_delete(out_lineidx + '.8b')
 
 
 def load_list_file(fname):
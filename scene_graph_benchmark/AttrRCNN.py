@@ -44,9 +44,10 @@ class AttrRCNN(GeneralizedRCNN):
         Arguments:
             images (list[Tensor] or ImageList): images to be processed
             targets (list[BoxList]): ground-truth boxes present in the image (optional)
-            We can assume that gt_boxlist contains two other fields:
+            We can assume that gt_boxlist contains the field:
                 "relation_labels": list of [subj_id, obj_id, predicate_category]
-                "pred_labels": n*n matrix with predicate_category (including BG) as values.
+            and optionally "pred_labels", the n*n matrix with predicate_category
+            (including BG) as values, which boxlist_pred_labels builds otherwise.
 
         Returns:
             result (list[BoxList] or dict[Tensor]): the output from the model.
@@ -53,6 +53,9 @@ _C.MODEL.ROI_RELATION_HEAD.POST_RELPN_PREPOSALS = 512
 _C.MODEL.ROI_RELATION_HEAD.USE_BIAS = False
 _C.MODEL.ROI_RELATION_HEAD.USE_ONLINE_OBJ_LABELS = False
 _C.MODEL.ROI_RELATION_HEAD.FILTER_NON_OVERLAP = True
+# if > 0, only the pairs with the highest subject * object score are passed
+# to the relation predictor at test time
+_C.MODEL.ROI_RELATION_HEAD.MAX_PROPOSAL_PAIRS = 0
 _C.MODEL.ROI_RELATION_HEAD.UPDATE_BOX_REG = False
 _C.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG = 100
 _C.MODEL.ROI_RELATION_HEAD.FEATURE_EXTRACTOR = "ResNet50Conv5ROIRelationFeatureExtractor"
@@ -132,15 +135,29 @@ _C.MODEL.ROI_RELATION_HEAD.CONTRASTIVE_LOSS.USE_NODE_CONTRASTIVE_P_AWARE_LOSS =
 _C.MODEL.ROI_RELATION_HEAD.CONTRASTIVE_LOSS.NODE_CONTRASTIVE_P_AWARE_MARGIN = 0.2
 _C.MODEL.ROI_RELATION_HEAD.CONTRASTIVE_LOSS.NODE_CONTRASTIVE_P_AWARE_WEIGHT = 0.1
 _C.MODEL.ROI_RELATION_HEAD.CONTRASTIVE_LOSS.USE_SPO_AGNOSTIC_COMPENSATION = False
+# store the one-hot sbj/obj/prd gt overlaps of the targets as sparse tensors
+_C.MODEL.ROI_RELATION_HEAD.CONTRASTIVE_LOSS.SPARSE_GT_OVERLAPS = False
 
 _C.MODEL.ROI_RELATION_HEAD.IMP_FEATURE_UPDATE_STEP = 0
 _C.MODEL.ROI_RELATION_HEAD.MSDN_FEATURE_UPDATE_STEP = 0
+# average all the messages an MSDN object receives, instead of using the
+# first one only (the released MSDN models use the first message)
+_C.MODEL.ROI_RELATION_HEAD.MSDN_AVERAGE_MESSAGES = False
 _C.MODEL.ROI_RELATION_HEAD.GRCNN_FEATURE_UPDATE_STEP = 0
 _C.MODEL.ROI_RELATION_HEAD.GRCNN_SCORE_UPDATE_STEP = 0
+# pass the GRCNN messages with index_add over the object / relation pairs
+# instead of dense obj x obj and obj x rel attention matrices
+_C.MODEL.ROI_RELATION_HEAD.GRCNN_SPARSE_MESSAGE_PASSING = True
 
 # -----------------------------------------------------------------------------
 # Test Options
 # -----------------------------------------------------------------------------
 _C.TEST = CN()
 _C.TEST.OUTPUT_RELATION_FEATURE = False
-_C.TEST.OUTPUT_ATTRIBUTE_FEATURE = False
\ No newline at end of file
+_C.TEST.OUTPUT_ATTRIBUTE_FEATURE = False
+# number of processes for the scene graph evaluation, which shard the images.
+# 0 or 1 evaluates in the main process.
+_C.TEST.SG_EVAL_NUM_WORKERS = 0
+# number of threads each of them matches the batches of images with in the
+# motif-style evaluator. 0 or 1 matches them in the calling thread.
+_C.TEST.SG_EVAL_NUM_THREADS = 0
\ No newline at end of file
@@ -306,6 +306,11 @@ def bbox_overlaps_np(anchors, gt_boxes):
     return overlaps
 
 
+def _numpy_dtype(tensor):
+    # the gt overlaps may be sparse tensors, which cannot be converted to numpy
+    return torch.empty(0, dtype=tensor.dtype).numpy().dtype
+
+
 def _merge_paired_boxes_into_roidb(proposals, targets, sbj_box_list, obj_box_list):
     assert len(sbj_box_list) == len(obj_box_list) == len(proposals) == len(targets) == 1
     for i, (proposals_per_image, targets_per_image) in enumerate(zip(proposals, targets)):
@@ -315,15 +320,15 @@ def _merge_paired_boxes_into_roidb(proposals, targets, sbj_box_list, obj_box_lis
         num_pairs = sbj_boxes.shape[0]
         sbj_gt_overlaps = np.zeros(
             (num_pairs, targets_per_image.get_field('sbj_gt_overlaps').shape[1]),
-            dtype=targets_per_image.get_field('sbj_gt_overlaps').cpu().numpy().dtype
+            dtype=_numpy_dtype(targets_per_image.get_field('sbj_gt_overlaps'))
         )
         obj_gt_overlaps = np.zeros(
             (num_pairs, targets_per_image.get_field('obj_gt_overlaps').shape[1]),
-            dtype=targets_per_image.get_field('obj_gt_overlaps').cpu().numpy().dtype
+            dtype=_numpy_dtype(targets_per_image.get_field('obj_gt_overlaps'))
         )
         prd_gt_overlaps = np.zeros(
             (num_pairs, targets_per_image.get_field('prd_gt_overlaps').shape[1]),
-            dtype=targets_per_image.get_field('prd_gt_overlaps').cpu().numpy().dtype
+            dtype=_numpy_dtype(targets_per_image.get_field('prd_gt_overlaps'))
         )
         pair_to_gt_ind_map = -np.ones(
             (num_pairs), dtype=targets_per_image.get_field('pair_to_gt_ind_map').cpu().numpy().dtype
@@ -15,6 +15,42 @@ def normal_init(m, mean, stddev, truncated=False):
         m.weight.data.normal_(mean, stddev)
         m.bias.data.zero_()
 
+class _SparseAttention(object):
+    """ sparse form of a 0/1 attention_base of _Collection_Unit """
+    """ target target_inds[k] collects from source source_inds[k] """
+    def __init__(self, target_inds, source_inds, num_targets, num_sources):
+        self.target_inds = target_inds
+        self.source_inds = source_inds
+        self.num_targets = num_targets
+        self.num_sources = num_sources
+        self.num_neighbors = torch.bincount(target_inds, minlength=num_targets)
+
+    def t(self):
+        return _SparseAttention(self.source_inds, self.target_inds,
+                                self.num_sources, self.num_targets)
+
+    def collect(self, source):
+        collect = source.new_zeros((self.num_targets, source.size(1)))
+        collect.index_add_(0, self.target_inds, source[self.source_inds])
+        return collect / (self.num_neighbors.to(source.dtype).view(-1, 1) + 1e-7)
+
+class _ImageAttention(object):
+    """ attention_base of each object to the other objects of its image """
+    """ i.e. 1 - eye per image, without the N x N matrix """
+    def __init__(self, im_inds, num_images):
+        self.im_inds = im_inds
+        self.num_images = num_images
+        self.num_neighbors = torch.bincount(im_inds, minlength=num_images)[im_inds] - 1
+
+    def t(self):
+        return self
+
+    def collect(self, source):
+        im_sum = source.new_zeros((self.num_images, source.size(1)))
+        im_sum.index_add_(0, self.im_inds, source)
+        collect = im_sum[self.im_inds] - source
+        return collect / (self.num_neighbors.to(source.dtype).view(-1, 1) + 1e-7)
+
 class _Collection_Unit(nn.Module):
     def __init__(self, dim_in, dim_out):
         super(_Collection_Unit, self).__init__()
@@ -24,6 +60,9 @@ class _Collection_Unit(nn.Module):
     def forward(self, target, source, attention_base):
         # assert attention_base.size(0) == source.size(0), "source number must be equal to attention number"
         fc_out = F.relu(self.fc(source))
+        if not isinstance(attention_base, torch.Tensor):
+            # _SparseAttention or _ImageAttention
+            return attention_base.collect(fc_out)
         collect = torch.mm(attention_base, fc_out)  # Nobj x Nrel Nrel x dim
         collect_avg = collect / (attention_base.sum(1).view(collect.size(0), 1) + 1e-7)
         return collect_avg
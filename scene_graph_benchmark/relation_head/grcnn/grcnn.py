@@ -16,7 +16,7 @@ from ..roi_relation_box_feature_extractors import \
 from ..roi_relation_box_predictors import make_roi_relation_box_predictor
 from ..roi_relation_predictors import make_roi_relation_predictor
 from .agcn.agcn import _GraphConvolutionLayer_Collect, \
-    _GraphConvolutionLayer_Update
+    _GraphConvolutionLayer_Update, _ImageAttention, _SparseAttention
 
 
 class GRCNN(nn.Module):
@@ -28,6 +28,7 @@ class GRCNN(nn.Module):
         self.use_online_obj_labels = cfg.MODEL.ROI_RELATION_HEAD.USE_ONLINE_OBJ_LABELS
         self.feat_update_step = cfg.MODEL.ROI_RELATION_HEAD.GRCNN_FEATURE_UPDATE_STEP
         self.score_update_step = cfg.MODEL.ROI_RELATION_HEAD.GRCNN_SCORE_UPDATE_STEP
+        self.sparse_message_passing = cfg.MODEL.ROI_RELATION_HEAD.GRCNN_SPARSE_MESSAGE_PASSING
         num_classes_obj = cfg.MODEL.ROI_BOX_HEAD.NUM_CLASSES
         num_classes_pred = cfg.MODEL.ROI_RELATION_HEAD.NUM_CLASSES
         self.avgpool = nn.AdaptiveAvgPool2d(1)
@@ -69,7 +70,8 @@ class GRCNN(nn.Module):
             rel_ind_i = proposal_pair.get_field("idx_pairs").detach()
             obj_obj_map_i = (1 - torch.eye(len(proposal))).float()
             obj_obj_map[offset:offset + len(proposal), offset:offset + len(proposal)] = obj_obj_map_i
-            rel_ind_i += offset
+            # not in place, idx_pairs is used again by the post processor
+            rel_ind_i = rel_ind_i + offset
             offset += len(proposal)
             rel_inds.append(rel_ind_i)
 
@@ -86,8 +88,36 @@ class GRCNN(nn.Module):
 
         return rel_inds, obj_obj_map, subj_pred_map, obj_pred_map
 
+    def _get_sparse_maps(self, proposals, proposal_pairs):
+        # same maps as _get_map_idxs, as index lists instead of dense matrices
+        rel_inds = []
+        offset = 0
+        for proposal, proposal_pair in zip(proposals, proposal_pairs):
+            rel_inds.append(proposal_pair.get_field("idx_pairs").detach() + offset)
+            offset += len(proposal)
+        rel_inds = torch.cat(rel_inds, 0)
+        obj_num = offset
+        rel_num = rel_inds.shape[0]
+
+        num_objs = torch.as_tensor([len(proposal) for proposal in proposals],
+                                   device=rel_inds.device)
+        im_inds = torch.repeat_interleave(
+            torch.arange(len(proposals), device=rel_inds.device), num_objs,
+            output_size=obj_num)
+        obj_obj_map = _ImageAttention(im_inds, len(proposals))
+
+        pred_inds = torch.arange(rel_num, device=rel_inds.device)
+        subj_pred_map = _SparseAttention(rel_inds[:, 0], pred_inds, obj_num, rel_num)
+        obj_pred_map = _SparseAttention(rel_inds[:, 1], pred_inds, obj_num, rel_num)
+
+        return rel_inds, obj_obj_map, subj_pred_map, obj_pred_map
+
     def forward(self, features, proposals, proposal_pairs):
-        rel_inds, obj_obj_map, subj_pred_map, obj_pred_map = self._get_map_idxs(
+        if self.sparse_message_passing:
+            get_maps = self._get_sparse_maps
+        else:
+            get_maps = self._get_map_idxs
+        rel_inds, obj_obj_map, subj_pred_map, obj_pred_map = get_maps(
             proposals, proposal_pairs)
         x_obj = torch.cat(
             [proposal.get_field("box_features").detach() for proposal in
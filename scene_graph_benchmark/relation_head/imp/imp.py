@@ -14,6 +14,14 @@ from ..roi_relation_box_feature_extractors import make_roi_relation_box_feature_
 from ..roi_relation_box_predictors import make_roi_relation_box_predictor
 from ..roi_relation_predictors import make_roi_relation_predictor
 
+def _segment_mean(messages, target_inds, num_targets):
+    # same as torch.mm(select_mat, messages) / (select_mat.sum(1, keepdim=True) + 1e-5)
+    # for the 0/1 num_targets x len(messages) map with ones at (target_inds[k], k)
+    collect = messages.new_zeros((num_targets, messages.size(1)))
+    collect = collect.index_add(0, target_inds, messages)
+    num_messages = torch.bincount(target_inds, minlength=num_targets)
+    return collect / (num_messages.to(messages.dtype).view(-1, 1) + 1e-5)
+
 class IMP(nn.Module):
 	# def __init__(self, fea_size, dropout=False, gate_width=1, use_kernel_function=False):
     def __init__(self, cfg, in_channels):
@@ -55,23 +63,19 @@ class IMP(nn.Module):
         offset = 0
         for proposal, proposal_pair in zip(proposals, proposal_pairs):
             rel_ind_i = proposal_pair.get_field("idx_pairs").detach()
-            rel_ind_i += offset
+            # not in place, idx_pairs is used again by the post processor
+            rel_ind_i = rel_ind_i + offset
             offset += len(proposal)
             rel_inds.append(rel_ind_i)
 
         rel_inds = torch.cat(rel_inds, 0)
-
-        subj_pred_map = rel_inds.new(sum([len(proposal) for proposal in proposals]), rel_inds.shape[0]).fill_(0).float().detach()
-        obj_pred_map = rel_inds.new(sum([len(proposal) for proposal in proposals]), rel_inds.shape[0]).fill_(0).float().detach()
-
-        subj_pred_map.scatter_(0, (rel_inds[:, 0].contiguous().view(1, -1)), 1)
-        obj_pred_map.scatter_(0, (rel_inds[:, 1].contiguous().view(1, -1)), 1)
-
-        return rel_inds, subj_pred_map, obj_pred_map
+        # the subject / object of each relation, instead of obj_num x rel_num
+        # subject / object maps
+        return rel_inds, offset
 
     def forward(self, features, proposals, proposal_pairs):
         # import pdb; pdb.set_trace()
-        rel_inds, subj_pred_map, obj_pred_map = self._get_map_idxs(proposals, proposal_pairs)
+        rel_inds, obj_num = self._get_map_idxs(proposals, proposal_pairs)
         x_obj = torch.cat([proposal.get_field("box_features") for proposal in proposals], 0)
         # x_obj = self.avgpool(self.obj_feature_extractor(features, proposals))
         x_pred, _ = self.pred_feature_extractor(features, proposals, proposal_pairs)
@@ -96,8 +100,8 @@ class IMP(nn.Module):
             '''update object features'''
             message_pred_to_subj = self.subj_node_gate(torch.cat([sub_vert, hx_edge[t]], 1)) * hx_edge[t]  # nrel x d
             message_pred_to_obj = self.obj_node_gate(torch.cat([obj_vert, hx_edge[t]], 1)) * hx_edge[t]    # nrel x d
-            node_message = (torch.mm(subj_pred_map, message_pred_to_subj) / (subj_pred_map.sum(1, keepdim=True) + 1e-5) \
-                          + torch.mm(obj_pred_map, message_pred_to_obj) / (obj_pred_map.sum(1, keepdim=True) + 1e-5)) / 2.
+            node_message = (_segment_mean(message_pred_to_subj, rel_inds[:, 0], obj_num) \
+                          + _segment_mean(message_pred_to_obj, rel_inds[:, 1], obj_num)) / 2.
             hx_obj.append(self.node_gru(node_message, hx_obj[t]))
             # hx_obj.append(F.relu(node_message + hx_obj[t]))
 
@@ -7,7 +7,7 @@ from torch.nn import functional as F
 from maskrcnn_benchmark.modeling.box_coder import BoxCoder
 from maskrcnn_benchmark.modeling.matcher import Matcher
 from .pair_matcher import PairMatcher
-from maskrcnn_benchmark.structures.boxlist_ops import boxlist_iou
+from maskrcnn_benchmark.structures.boxlist_ops import boxlist_iou, boxlist_pred_labels
 from maskrcnn_benchmark.structures.bounding_box import BoxList
 from maskrcnn_benchmark.structures.bounding_box_pair import BoxPairList
 from .balanced_positive_negative_pair_sampler import BalancedPositiveNegativePairSampler
@@ -67,7 +67,7 @@ class FastRCNNLossComputation(object):
         match_pair_quality_matrix = torch.stack(temp, 0).view(len(temp), -1)
         target_box_pairs = torch.stack(target_box_pairs, 0)
         target_pair = BoxPairList(target_box_pairs, target.size, target.mode)
-        target_pair.add_field("labels", target.get_field("pred_labels").view(-1))
+        target_pair.add_field("labels", boxlist_pred_labels(target).view(-1))
 
         box_subj = proposal.bbox
         box_obj = proposal.bbox
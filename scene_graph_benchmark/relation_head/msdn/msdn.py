@@ -24,7 +24,8 @@ class MSDN(MSDN_BASE):
         self.use_online_obj_labels = cfg.MODEL.ROI_RELATION_HEAD.USE_ONLINE_OBJ_LABELS
         super(MSDN, self).__init__(dim, dropout, gate_width, use_region=True,
                                    use_kernel_function=use_kernel_function,
-                                   update_step=self.update_step)
+                                   update_step=self.update_step,
+                                   average_messages=cfg.MODEL.ROI_RELATION_HEAD.MSDN_AVERAGE_MESSAGES)
         self.avgpool = nn.AdaptiveAvgPool2d(1)
         self.pred_feature_extractor = make_roi_relation_feature_extractor(cfg, in_channels)
 
@@ -47,22 +48,19 @@ class MSDN(MSDN_BASE):
         offset = 0
         for proposal, proposal_pair in zip(proposals, proposal_pairs):
             rel_ind_i = proposal_pair.get_field("idx_pairs").detach()
-            rel_ind_i += offset
+            # not in place, idx_pairs is used again by the post processor
+            rel_ind_i = rel_ind_i + offset
             offset += len(proposal)
             rel_inds.append(rel_ind_i)
 
         rel_inds = torch.cat(rel_inds, 0)
-
-        subj_pred_map = rel_inds.new(sum([len(proposal) for proposal in proposals]), rel_inds.shape[0]).fill_(0).float().detach()
-        obj_pred_map = rel_inds.new(sum([len(proposal) for proposal in proposals]), rel_inds.shape[0]).fill_(0).float().detach()
-
-        subj_pred_map.scatter_(0, (rel_inds[:, 0].contiguous().view(1, -1)), 1)
-        obj_pred_map.scatter_(0, (rel_inds[:, 1].contiguous().view(1, -1)), 1)
-
-        return rel_inds, subj_pred_map, obj_pred_map
+        # the subject / object of each relation, instead of obj_num x rel_num
+        # subject / object maps
+        return rel_inds, offset
 
     def forward(self, features, proposals, proposal_pairs):
-        rel_inds, subj_pred_map, obj_pred_map = self._get_map_idxs(proposals, proposal_pairs)
+        rel_inds, _ = self._get_map_idxs(proposals, proposal_pairs)
+        pred_inds = torch.arange(rel_inds.shape[0], device=rel_inds.device)
         x_obj = torch.cat([proposal.get_field("box_features") for proposal in proposals], 0)
         x_pred, _ = self.pred_feature_extractor(features, proposals, proposal_pairs)
         if x_pred.ndimension() == 4:
@@ -76,8 +74,8 @@ class MSDN(MSDN_BASE):
 
         for t in range(self.update_step):
             '''update object features'''
-            object_sub = self.prepare_message(x_obj[t], x_pred[t], subj_pred_map, self.gate_pred2sub)
-            object_obj = self.prepare_message(x_obj[t], x_pred[t], obj_pred_map, self.gate_pred2obj)
+            object_sub = self.prepare_message_from_inds(x_obj[t], x_pred[t], rel_inds[:, 0], pred_inds, self.gate_pred2sub)
+            object_obj = self.prepare_message_from_inds(x_obj[t], x_pred[t], rel_inds[:, 1], pred_inds, self.gate_pred2obj)
             GRU_input_feature_object = (object_sub + object_obj) / 2.
             x_obj.append(x_obj[t] + self.GRU_object(GRU_input_feature_object, x_obj[t]))
 
@@ -5,7 +5,6 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torch.autograd import Variable
 from torch.nn import Parameter
 import pdb
 
@@ -79,8 +78,9 @@ class Gated_Recurrent_Unit(nn.Module):
 class MSDN_BASE(nn.Module):
     def __init__(self, fea_size, dropout=False, gate_width=128,
                  use_region=False, use_kernel_function=False,
-                 update_step=2):
+                 update_step=2, average_messages=False):
         super(MSDN_BASE, self).__init__()
+        self.average_messages = average_messages
         if update_step > 0:
             if use_kernel_function:
                 Message_Passing_Unit = Message_Passing_Unit_v2
@@ -100,36 +100,48 @@ class MSDN_BASE(nn.Module):
                 mps_phrase, mps_region):
         raise Exception('Please implement the forward function')
 
-    # Here, we do all the operations outof loop, the loop is just to combine the features
-    # Less kernel evoke frequency improve the speed of the model
+    # Here, we do all the operations outof loop, the messages of each target
+    # are combined with a single index operation over the (target, source) pairs
     def prepare_message(self, target_features, source_features, select_mat,
                         gate_module):
-        feature_data = []
-
-        # transfer_list = np.where(select_mat > 0)
-
-        if select_mat.data.sum() == 0:
-            temp = Variable(torch.zeros(target_features.size()[1:]),
-                            requires_grad=True).type_as(target_features)
-            feature_data.append(temp)
-        else:
-            transfer_list = (select_mat.data > 0).nonzero(as_tuple=False)
-            source_indices = Variable(transfer_list[:, 1])
-            target_indices = Variable(transfer_list[:, 0])
-            source_f = torch.index_select(source_features, 0, source_indices)
-            target_f = torch.index_select(target_features, 0, target_indices)
-            transferred_features = gate_module(target_f, source_f)
-
-            for f_id in range(target_features.size()[0]):
-                if select_mat[f_id, :].data.sum() > 0:
-                    feature_indices = (transfer_list[:, 0] == f_id).nonzero(as_tuple=False)[0]
-                    indices = Variable(feature_indices)
-                    features = torch.index_select(transferred_features, 0,
-                                                  indices).mean(0).view(-1)
-                    feature_data.append(features)
-                else:
-                    temp = Variable(torch.zeros(target_features.size()[1:]),
-                                    requires_grad=True).type_as(target_features)
-                    feature_data.append(temp)
-
-        return torch.stack(feature_data, 0)
+        transfer_list = (select_mat.detach() > 0).nonzero(as_tuple=False)
+        return self.prepare_message_from_inds(target_features, source_features,
+                                              transfer_list[:, 0], transfer_list[:, 1],
+                                              gate_module)
+
+    def prepare_message_from_inds(self, target_features, source_features,
+                                  target_indices, source_indices, gate_module):
+        """
+        Combines the messages gate_module(target, source) sent from
+        source_features[source_indices[k]] to target_features[target_indices[k]]:
+        each target gets the message from its lowest source index, or the
+        average of all its messages with average_messages. Targets without
+        message get zeros.
+        """
+        num_targets = target_features.size(0)
+        feature_data = target_features.new_zeros(
+            (num_targets,) + source_features.size()[1:])
+        if target_indices.numel() == 0:
+            return feature_data
+
+        if not self.average_messages:
+            # the first (target, source) pair of each target, in the order of
+            # the nonzero entries of the select matrix
+            pair_keys = target_indices * source_features.size(0) + source_indices
+            pair_keys = pair_keys.sort()[0]
+            target_indices = pair_keys // source_features.size(0)
+            first = torch.ones_like(target_indices, dtype=torch.bool)
+            first[1:] = target_indices[1:] != target_indices[:-1]
+            target_indices = target_indices[first]
+            source_indices = pair_keys[first] % source_features.size(0)
+
+        source_f = torch.index_select(source_features, 0, source_indices)
+        target_f = torch.index_select(target_features, 0, target_indices)
+        transferred_features = gate_module(target_f, source_f)
+
+        if not self.average_messages:
+            return feature_data.index_copy(0, target_indices, transferred_features)
+        feature_data = feature_data.index_add(0, target_indices, transferred_features)
+        num_messages = torch.bincount(target_indices, minlength=num_targets)
+        num_messages = num_messages.clamp(min=1).to(feature_data.dtype)
+        return feature_data / num_messages.view(-1, 1)
@@ -12,7 +12,8 @@ from maskrcnn_benchmark.structures.bounding_box_pair import BoxPairList
 from maskrcnn_benchmark.structures.boxlist_ops import boxlist_iou, cat_boxlist, cat_boxlist_with_fields
 from .inference import make_roi_relation_post_processor
 from .loss import make_roi_relation_loss_evaluator
-from .sparse_targets import FrequencyBias, _get_tensor_from_boxlist, _get_rel_inds
+from .sparse_targets import FrequencyBias, _get_tensor_from_boxlist, _get_rel_inds, \
+    _get_boxlist_offsets
 
 from .relpn.relpn import make_relation_proposal_network
 from .baseline.baseline import build_baseline_model
@@ -23,6 +24,52 @@ from .grcnn.grcnn import build_grcnn_model
 from .reldn.reldn import build_reldn_model
 
 
+def get_proposal_pairs(proposals_per_image, filter_non_overlap=False, max_pairs=0):
+    """
+    Pairs every two different boxes of an image as (subject, object). Only
+    the index pairs are enumerated; box and label pairs are gathered for the
+    pairs that are kept, in the row-major order of the subject/object grid.
+
+    Arguments:
+        proposals_per_image (BoxList)
+        filter_non_overlap (bool): only keep the pairs of overlapping boxes
+        max_pairs (int): if > 0, only keep the max_pairs pairs with the
+            highest product of the subject and object scores
+    """
+    num_boxes = len(proposals_per_image)
+    device = proposals_per_image.bbox.device
+    if filter_non_overlap:
+        overlaps = boxlist_iou(proposals_per_image, proposals_per_image) > 0
+        overlaps.fill_diagonal_(False)
+        proposal_idx_pairs = overlaps.nonzero(as_tuple=False)
+    elif num_boxes > 1:
+        # the k-th object of a subject skips the subject itself
+        pair_inds = torch.arange(num_boxes * (num_boxes - 1), device=device)
+        idx_subj = pair_inds // (num_boxes - 1)
+        idx_obj = pair_inds % (num_boxes - 1)
+        idx_obj += (idx_obj >= idx_subj).long()
+        proposal_idx_pairs = torch.stack((idx_subj, idx_obj), 1)
+    else:
+        proposal_idx_pairs = torch.zeros((0, 2), dtype=torch.int64, device=device)
+
+    if 0 < max_pairs < len(proposal_idx_pairs):
+        scores = proposals_per_image.get_field('scores')
+        pair_scores = scores[proposal_idx_pairs[:, 0]] * scores[proposal_idx_pairs[:, 1]]
+        keep = pair_scores.topk(max_pairs)[1].sort()[0]
+        proposal_idx_pairs = proposal_idx_pairs[keep]
+
+    idx_subj, idx_obj = proposal_idx_pairs[:, 0], proposal_idx_pairs[:, 1]
+    boxes = proposals_per_image.bbox
+    proposal_box_pairs = torch.cat((boxes[idx_subj], boxes[idx_obj]), 1)
+    labels = proposals_per_image.get_field('labels')
+    proposal_label_pairs = torch.stack((labels[idx_subj], labels[idx_obj]), 1)
+
+    proposal_pairs_per_image = BoxPairList(proposal_box_pairs, proposals_per_image.size, proposals_per_image.mode)
+    proposal_pairs_per_image.add_field("idx_pairs", proposal_idx_pairs)
+    proposal_pairs_per_image.add_field("label_pairs", proposal_label_pairs)
+    return proposal_pairs_per_image
+
+
 class ROIRelationHead(torch.nn.Module):
     """
     Generic Box Head class.
@@ -77,44 +124,10 @@ class ROIRelationHead(torch.nn.Module):
         self.rel_predictor.to(device, **kwargs)
 
     def _get_proposal_pairs(self, proposals):
-        proposal_pairs = []
-        for i, proposals_per_image in enumerate(proposals):
-            box_subj = proposals_per_image.bbox
-            box_obj = proposals_per_image.bbox
-
-            box_subj = box_subj.unsqueeze(1).repeat(1, box_subj.shape[0], 1)
-            box_obj = box_obj.unsqueeze(0).repeat(box_obj.shape[0], 1, 1)
-            proposal_box_pairs = torch.cat(
-                (box_subj.view(-1, 4), box_obj.view(-1, 4)), 1)
-
-            idx_subj = torch.arange(box_subj.shape[0]).view(-1, 1, 1).repeat(1, box_obj.shape[0], 1).to(
-                proposals_per_image.bbox.device)
-            idx_obj = torch.arange(box_obj.shape[0]).view(1, -1, 1).repeat(box_subj.shape[0], 1, 1).to(
-                proposals_per_image.bbox.device)
-            proposal_idx_pairs = torch.cat((idx_subj.view(-1, 1), idx_obj.view(-1, 1)), 1)
-
-            label_subj = proposals_per_image.get_field('labels')[idx_subj]
-            label_obj = proposals_per_image.get_field('labels')[idx_obj]
-            proposal_label_pairs = torch.cat(
-                (label_subj.view(-1, 1), label_obj.view(-1, 1)), 1)
-
-            keep_idx = (proposal_idx_pairs[:, 0] != proposal_idx_pairs[:, 1]).nonzero(as_tuple=False).view(-1)
-
-            # if we filter non overlap bounding boxes
-            if self.cfg.MODEL.ROI_RELATION_HEAD.FILTER_NON_OVERLAP:
-                ious = boxlist_iou(proposals_per_image, proposals_per_image).view(-1)
-                ious = ious[keep_idx]
-                keep_idx = keep_idx[(ious > 0).nonzero(as_tuple=False).view(-1)]
-            proposal_idx_pairs = proposal_idx_pairs[keep_idx]
-            proposal_box_pairs = proposal_box_pairs[keep_idx]
-            proposal_label_pairs = proposal_label_pairs[keep_idx]
-            proposal_pairs_per_image = BoxPairList(proposal_box_pairs, proposals_per_image.size, proposals_per_image.mode)
-            proposal_pairs_per_image.add_field("idx_pairs", proposal_idx_pairs)
-            proposal_pairs_per_image.add_field("label_pairs", proposal_label_pairs)
-
-            proposal_pairs.append(proposal_pairs_per_image)
-
-        return proposal_pairs
+        return [get_proposal_pairs(proposals_per_image,
+                                   self.cfg.MODEL.ROI_RELATION_HEAD.FILTER_NON_OVERLAP,
+                                   self.cfg.MODEL.ROI_RELATION_HEAD.MAX_PROPOSAL_PAIRS)
+                for proposals_per_image in proposals]
     
     def _force_relation_pairs(self, targets):
         proposal_pairs = []
@@ -197,7 +210,8 @@ class ROIRelationHead(torch.nn.Module):
                 = _get_tensor_from_boxlist(proposals, 'labels')
             _, proposal_idx_pairs, im_inds_pairs = _get_tensor_from_boxlist(
                 proposal_pairs, 'idx_pairs')
-            rel_inds = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, len(proposals))
+            rel_inds = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, len(proposals),
+                                     offsets=_get_boxlist_offsets(proposals, im_inds.device))
 
             pred_class_logits = self.freq_bias.index_with_labels(
                 torch.stack((
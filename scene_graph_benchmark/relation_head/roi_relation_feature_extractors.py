@@ -9,7 +9,7 @@ from maskrcnn_benchmark.modeling.backbone import resnet
 from maskrcnn_benchmark.modeling.make_layers import group_norm
 from maskrcnn_benchmark.modeling.make_layers import make_fc
 from maskrcnn_benchmark.modeling.poolers import Pooler
-from .sparse_targets import _get_tensor_from_boxlist, _get_rel_inds
+from .sparse_targets import _get_tensor_from_boxlist, _get_rel_inds, _get_boxlist_offsets
 
 
 @registry.ROI_RELATION_FEATURE_EXTRACTORS.register(
@@ -76,7 +76,8 @@ class ResNet50Conv5ROIFeatureExtractor(nn.Module):
         _, proposal_idx_pairs, im_inds_pairs = _get_tensor_from_boxlist(
             proposal_pairs, 'idx_pairs')
 
-        rel_inds = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, len(proposals))
+        rel_inds = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, len(proposals),
+                                 offsets=_get_boxlist_offsets(proposals, im_inds.device))
 
         return self._union_box_feats(x, proposal_pairs, use_relu), rel_inds
 
@@ -132,7 +133,8 @@ class FPN2MLPFeatureExtractor(nn.Module):
         _, proposal_idx_pairs, im_inds_pairs = _get_tensor_from_boxlist(
             proposal_pairs, 'idx_pairs', self.device)
 
-        rel_inds = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, len(proposals))
+        rel_inds = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, len(proposals),
+                                 offsets=_get_boxlist_offsets(proposals, im_inds.device))
 
         return self._union_box_feats(x, proposal_pairs, use_relu), rel_inds
 
@@ -53,69 +53,43 @@ class FrequencyBias(nn.Module):
         return baseline
 
 
-def _get_tensor_from_boxlist(proposals, field='labels', framework_device="cuda"):
+def _get_boxlist_offsets(boxlists, device=None):
+    # offset of the first box of each image in the tensors concatenated
+    # over the batch, e.g. [0, 64, 128, ...]. The box counts are known on
+    # the host, so this needs no device synchronization.
+    num_boxes = torch.as_tensor([len(boxlist) for boxlist in boxlists],
+                                dtype=torch.int64, device=device)
+    return torch.cumsum(num_boxes, dim=0) - num_boxes
+
+
+def _get_tensor_from_boxlist(proposals, field='labels', framework_device=None):
     # helper function for getting
     # tensor data from BoxList structures
 
     # /*need to specify data field name*/
     assert proposals[0].extra_fields[field] is not None
 
-    for im_ind, prop_per_im in enumerate(proposals):
-        if im_ind == 0:
-            num_proposals_im = prop_per_im.bbox.size(0)
-            # get data
-            bbox_batch = prop_per_im.bbox
-            output_batch = prop_per_im.extra_fields[field]
-
-            # im_inds
-            im_inds = im_ind * torch.ones(num_proposals_im, 1)
-        else:
-            num_proposals_im = prop_per_im.bbox.size(0)
-            bbox_batch = torch.cat((bbox_batch, prop_per_im.bbox),
-                                   dim=0)  # N by 4
-            output_batch = torch.cat(
-                (output_batch, prop_per_im.extra_fields[field]), dim=0)
-
-            im_inds = torch.cat(
-                (im_inds, im_ind * torch.ones(num_proposals_im, 1)), dim=0)
+    bbox_batch = torch.cat([prop.bbox for prop in proposals], dim=0)  # N by 4
+    output_batch = torch.cat([prop.extra_fields[field] for prop in proposals], dim=0)
 
-    im_inds_batch = torch.Tensor(im_inds).long()
-    if framework_device == "cuda":
-        im_inds_batch = im_inds_batch.to(torch.device("cuda"))
-        
+    # im_inds: (N,1), img ind for each box, on the device of the boxes
+    # unless another one is asked for explicitly
+    device = bbox_batch.device if framework_device is None else torch.device(framework_device)
+    num_boxes = torch.as_tensor([len(prop) for prop in proposals], device=device)
+    im_inds_batch = torch.repeat_interleave(
+        torch.arange(len(proposals), device=device), num_boxes,
+        output_size=bbox_batch.size(0)).view(-1, 1)
 
     return bbox_batch, output_batch, im_inds_batch
 
 
-def _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, batch_size=1):
-    rel_ind_sub = proposal_idx_pairs[:, 0]
-    rel_ind_obj = proposal_idx_pairs[:, 1]
-
-    def full_count(inds):
-        unique_idx, num_im = torch.unique(inds, return_counts=True)
-        if batch_size > len(unique_idx):
-            num_im_new = torch.zeros(batch_size).to(unique_idx.device)
-            num_im_new[unique_idx] = num_im
-            num_im = num_im_new
-        return num_im
-
-    # idxs in the rel_ind_sub, rel_ind_obj are based on per image index
+def _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs, batch_size=1, offsets=None):
+    # idxs in the proposal_idx_pairs are based on per image index
     # we need to add those inds by a offset [0,0,0... 64, 64, 64...]
-    # per image number objects
-    # unique_im_idx, num_obj_im = torch.unique(im_inds, return_counts=True)
-    num_obj_im = full_count(im_inds)
-    
-    # cum sum torch.cumsum. this is the raw value for offsets
-    num_obj_im = torch.cumsum(num_obj_im, dim=0)
-
-    # im_inds -1 for offset value
-    # then set 0-th image has offset 0
-    rel_ind_offset_im = num_obj_im[im_inds_pairs - 1]
-    # unique_rels_idx, num_rels_im = torch.unique(im_inds_pairs, return_counts=True)
-    num_rels_im = full_count(im_inds_pairs)
-    rel_ind_offset_im[:num_rels_im[0]] = 0  # first image needs no offset
-    rel_ind_offset_im = torch.squeeze(rel_ind_offset_im)
-
-    rel_ind_sub += rel_ind_offset_im
-    rel_ind_obj += rel_ind_offset_im
-    return torch.cat((rel_ind_sub[:, None], rel_ind_obj[:, None]), 1)
\ No newline at end of file
+    # offsets: (batch_size,), from _get_boxlist_offsets on the proposals;
+    # only derived from the per image number of objects in im_inds if not given
+    if offsets is None:
+        num_obj_im = torch.bincount(im_inds.view(-1), minlength=batch_size)
+        offsets = torch.cumsum(num_obj_im, dim=0) - num_obj_im
+    rel_ind_offset_im = offsets.to(proposal_idx_pairs.device)[im_inds_pairs.view(-1)]
+    return proposal_idx_pairs + rel_ind_offset_im[:, None]
@@ -107,30 +107,18 @@ class SceneParser(GeneralizedRCNN):
         Returns:
             sort the object-predicate triplets, and output the top
         """
-        result_obj_new, result_pred_new = [], []
         assert len(result_obj) == len(result_pred), "object list must have equal number to predicate list"
-        for result_obj_i, result_pred_i in zip(result_obj, result_pred):
-            obj_scores = result_obj_i.get_field("scores")
-            rel_inds = result_pred_i.get_field("idx_pairs")
-            pred_scores = result_pred_i.get_field("scores")
-            scores = torch.stack((
-                obj_scores[rel_inds[:,0]],
-                obj_scores[rel_inds[:,1]],
-                pred_scores[:,1:].max(1)[0]
-            ), 1).prod(1)
-            scores_sorted, order = scores.sort(0, descending=True)
-            result_pred_i = result_pred_i[order[:self.cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG]]
-            result_obj_new.append(result_obj_i)
-
-            result_pred_i.add_field('labels', result_pred_i.get_field("scores")[:, 1:].argmax(dim=1)) # not include background
-            result_pred_i.add_field('scores_all', result_pred_i.get_field('scores'))
-            result_pred_i.add_field('scores', scores[order[:self.cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG]])
-            # filter out bad prediction
-            inds = result_pred_i.get_field('scores') > self.cfg.MODEL.ROI_RELATION_HEAD.POSTPROCESS_SCORE_THRESH
-            result_pred_i = result_pred_i[inds]
-
-            result_pred_new.append(result_pred_i)
-        return result_obj_new, result_pred_new
+        # the triplet score of a pair uses its best predicate
+        obj_scores, rel_inds, pred_scores = _cat_pair_scores(result_obj, result_pred)
+        scores = torch.stack((
+            obj_scores[rel_inds[:,0]],
+            obj_scores[rel_inds[:,1]],
+            pred_scores[:,1:].max(1)[0]
+        ), 1).prod(1)
+        pair_inds, keep, scores = self._select_triplets(
+            scores, [len(result_pred_i) for result_pred_i in result_pred])
+        labels = pred_scores[pair_inds, 1:].argmax(dim=1) # not include background
+        return result_obj, _split_triplets(result_pred, pair_inds, keep, labels, scores)
 
     def _post_processing_unconstrained(self, result_obj, result_pred):
         """
@@ -140,43 +128,58 @@ class SceneParser(GeneralizedRCNN):
         Returns:
             sort the object-predicate triplets, and output the top
         """
-        result_obj_new, result_pred_new = [], []
         assert len(result_obj) == len(result_pred), "object list must have equal number to predicate list"
-        for result_obj_i, result_pred_i in zip(result_obj, result_pred):
-            obj_scores = result_obj_i.get_field("scores").cpu().numpy()
-            rel_inds = result_pred_i.get_field("idx_pairs").cpu().numpy()
-            pred_scores = result_pred_i.get_field("scores").cpu().numpy()[:, 1:]
-            
-            det_labels_prd = np.argsort(-pred_scores, axis=1)
-            det_scores_prd = -np.sort(-pred_scores, axis=1)
-
-            det_scores_so = obj_scores[rel_inds[:,0]] * obj_scores[rel_inds[:,1]]
-            det_scores_spo = det_scores_so[:, None] * det_scores_prd[:, :2]
-
-            det_scores_inds = argsort_desc(det_scores_spo)[:self.cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG]
-
-            result_labels = det_labels_prd[det_scores_inds[:, 0], det_scores_inds[:, 1]]
-
-            result_pred_i = result_pred_i[det_scores_inds[:, 0]]
-            result_pred_i.add_field('labels', torch.from_numpy(result_labels))
-            result_pred_i.add_field('scores_all', result_pred_i.get_field('scores'))
-            result_pred_i.add_field('scores', torch.from_numpy(det_scores_spo[det_scores_inds[:, 0], det_scores_inds[:, 1]]))
-            # filter out bad prediction
-            inds = result_pred_i.get_field('scores') > self.cfg.MODEL.ROI_RELATION_HEAD.POSTPROCESS_SCORE_THRESH
-            result_pred_i = result_pred_i[inds]
-            
-            result_obj_new.append(result_obj_i)
-            result_pred_new.append(result_pred_i)
-        return result_obj_new, result_pred_new
+        # every pair is a candidate with each of its top 2 predicates
+        obj_scores, rel_inds, pred_scores = _cat_pair_scores(result_obj, result_pred)
+        num_candidates = min(2, pred_scores.shape[1] - 1)
+        det_scores_prd, det_labels_prd = pred_scores[:, 1:].sort(dim=1, descending=True, stable=True)
+        det_scores_so = obj_scores[rel_inds[:,0]] * obj_scores[rel_inds[:,1]]
+        det_scores_spo = det_scores_so[:, None] * det_scores_prd[:, :num_candidates]
+
+        candidate_inds, keep, scores = self._select_triplets(
+            det_scores_spo.view(-1),
+            [len(result_pred_i) * num_candidates for result_pred_i in result_pred])
+        pair_inds = candidate_inds // num_candidates
+        labels = det_labels_prd[pair_inds, candidate_inds % num_candidates]
+        return result_obj, _split_triplets(result_pred, pair_inds, keep, labels, scores)
+
+    def _select_triplets(self, scores, num_per_image):
+        """
+        Selects the top TRIPLETS_PER_IMG candidates of each image which score
+        above POSTPROCESS_SCORE_THRESH, for the candidates of all images at
+        once. scores are the concatenated candidate scores of the images,
+        which have num_per_image candidates. Returns the indices of the
+        selected candidates into scores, image after image and by descending
+        score within an image, the number of them per image, and their scores.
+        """
+        device = scores.device
+        num_per_image_t = torch.as_tensor(num_per_image, dtype=torch.int64, device=device)
+        image_inds = torch.repeat_interleave(
+            torch.arange(len(num_per_image), device=device), num_per_image_t,
+            output_size=len(scores))
+        # segment-wise sort: by score, then stably by image
+        order = scores.sort(descending=True, stable=True)[1]
+        order = order[image_inds[order].sort(stable=True)[1]]
+        # after the sort, the image of every position is image_inds again
+        starts = num_per_image_t.cumsum(0) - num_per_image_t
+        rank = torch.arange(len(scores), device=device) - starts[image_inds]
+        # filter out bad prediction
+        order = order[(rank < self.cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG) &
+                      (scores[order] > self.cfg.MODEL.ROI_RELATION_HEAD.POSTPROCESS_SCORE_THRESH)]
+        # the host only needs the number of triplets per image, to split them
+        keep = torch.zeros(len(num_per_image), dtype=torch.int64, device=device)
+        keep.index_add_(0, image_inds[order], torch.ones_like(order))
+        return order, keep.tolist(), scores[order]
 
     def forward(self, images, targets=None):
         """
         Arguments:
             images (list[Tensor] or ImageList): images to be processed
             targets (list[BoxList]): ground-truth boxes present in the image (optional)
-            We can assume that gt_boxlist contains two other fields:
+            We can assume that gt_boxlist contains the field:
                 "relation_labels": list of [subj_id, obj_id, predicate_category]
-                "pred_labels": n*n matrix with predicate_category (including BG) as values.
+            and optionally "pred_labels", the n*n matrix with predicate_category
+            (including BG) as values, which boxlist_pred_labels builds otherwise.
 
         Returns:
             result (list[BoxList] or dict[Tensor]): the output from the model.
@@ -342,11 +345,30 @@ class SceneParser(GeneralizedRCNN):
                 for prediction, prediction_pair in zip(predictions, prediction_pairs)]
 
 
-def argsort_desc(scores):
-    """
-    Returns the indices that sort scores descending in a smart way
-    :param scores: Numpy array of arbitrary size
-    :return: an array of size [numel(scores), dim(scores)] where each row is the index you'd
-             need to get the score.
-    """
-    return np.column_stack(np.unravel_index(np.argsort(-scores.ravel()), scores.shape))
\ No newline at end of file
+def _cat_pair_scores(result_obj, result_pred):
+    # object scores, pair indices into them and predicate scores of all
+    # images, concatenated.
+    obj_scores = torch.cat([result_obj_i.get_field("scores") for result_obj_i in result_obj])
+    offsets = np.cumsum([0] + [len(result_obj_i) for result_obj_i in result_obj[:-1]])
+    rel_inds = torch.cat([result_pred_i.get_field("idx_pairs") + int(offset)
+                          for result_pred_i, offset in zip(result_pred, offsets)])
+    pred_scores = torch.cat([result_pred_i.get_field("scores") for result_pred_i in result_pred])
+    return obj_scores, rel_inds, pred_scores
+
+
+def _split_triplets(result_pred, pair_inds, keep, labels, scores):
+    # splits the selected triplets of all images, which index the
+    # concatenated pairs, back into the pairs of each image.
+    result_pred_new = []
+    start = 0
+    pair_inds, labels, scores = pair_inds.split(keep), labels.split(keep), scores.split(keep)
+    for result_pred_i, pair_inds_i, labels_i, scores_i in zip(result_pred, pair_inds, labels, scores):
+        num_pairs = len(result_pred_i)
+        result_pred_i = result_pred_i[pair_inds_i - start]
+        start += num_pairs
+        result_pred_i.add_field('labels', labels_i)
+        result_pred_i.add_field('scores_all', result_pred_i.get_field('scores'))
+        result_pred_i.add_field('scores', scores_i)
+        result_pred_new.append(result_pred_i)
+    return result_pred_new
+
@@ -3,6 +3,7 @@
 
 import glob
 import os
+import sys
 
 import torch
 from setuptools import find_packages
@@ -26,8 +27,15 @@ def get_extensions():
     extension = CppExtension
 
     extra_compile_args = {"cxx": []}
+    extra_link_args = []
     define_macros = []
 
+    if sys.platform.startswith("linux"):
+        # the cpu kernels use at::parallel_for and omp simd, which only run
+        # multithreaded / vectorized when built with OpenMP
+        extra_compile_args["cxx"] += ["-fopenmp"]
+        extra_link_args += ["-fopenmp"]
+
     if (torch.cuda.is_available() and CUDA_HOME is not None) or os.getenv("FORCE_CUDA", "0") == "1":
         extension = CUDAExtension
         sources += source_cuda
@@ -50,6 +58,7 @@ def get_extensions():
             include_dirs=include_dirs,
             define_macros=define_macros,
             extra_compile_args=extra_compile_args,
+            extra_link_args=extra_link_args,
         )
     ]
 
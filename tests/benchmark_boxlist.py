@@ -0,0 +1,82 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Micro-benchmark of the common BoxList operations.
+
+Runs indexing, slicing, resize, to, copy_with_fields and cat_boxlist on box
+lists carrying the fields of the scene graph detections, and compares BoxList
+with PackedBoxList, e.g.
+    python tests/benchmark_boxlist.py --num_boxes 100 --feature_dim 2048
+"""
+import argparse
+import time
+
+import torch
+
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.boxlist_ops import cat_boxlist
+from maskrcnn_benchmark.structures.packed_bounding_box import PackedBoxList
+
+
+def create_boxlist(num_boxes, feature_dim, num_classes, num_attributes):
+    xy = torch.rand(num_boxes, 2) * 500
+    boxlist = BoxList(torch.cat((xy, xy + 50), 1), (800, 600))
+    boxlist.add_field("labels", torch.randint(1, num_classes, (num_boxes,)))
+    boxlist.add_field("scores", torch.rand(num_boxes))
+    boxlist.add_field("scores_all", torch.rand(num_boxes, num_classes))
+    boxlist.add_field("boxes_all", torch.rand(num_boxes, num_classes, 4))
+    boxlist.add_field("attr_labels", torch.randint(0, num_attributes, (num_boxes, 16)))
+    boxlist.add_field("attr_scores", torch.rand(num_boxes, 16))
+    if feature_dim > 0:
+        boxlist.add_field("box_features", torch.rand(num_boxes, feature_dim))
+    return boxlist
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BoxList benchmark")
+    parser.add_argument("--num_boxes", type=int, default=100)
+    parser.add_argument("--feature_dim", type=int, default=2048)
+    parser.add_argument("--num_classes", type=int, default=151)
+    parser.add_argument("--num_attributes", type=int, default=401)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--iters", type=int, default=1000)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    boxlists = [create_boxlist(args.num_boxes, args.feature_dim, args.num_classes,
+                               args.num_attributes).to(args.device)
+                for _ in range(args.batch_size)]
+    packed = [PackedBoxList.from_boxlist(boxlist) for boxlist in boxlists]
+    keep = boxlists[0].get_field("scores") > 0.5
+    fields = ["labels", "scores"]
+    ops = [
+        ("mask", lambda b: b[0][keep]),
+        ("slice", lambda b: b[0][:args.num_boxes // 2]),
+        ("resize", lambda b: b[0].resize((400, 300))),
+        ("to", lambda b: b[0].to("cpu")),
+        ("copy_fields", lambda b: b[0].copy_with_fields(fields)),
+        ("cat", lambda b: cat_boxlist(b)),
+        ("mask+fields", lambda b: [b[0][keep].get_field(f) for f in b[0].fields()]),
+    ]
+
+    for op_name, op in ops:
+        expected, result = op(boxlists), op(packed)
+        if isinstance(expected, BoxList):
+            assert torch.equal(result.bbox, expected.bbox), op_name
+            for field in expected.fields():
+                assert torch.equal(result.get_field(field), expected.get_field(field)), op_name
+
+    for name, b in [("BoxList", boxlists), ("PackedBoxList", packed)]:
+        for op_name, op in ops:
+            op(b)
+            if args.device == "cuda":
+                torch.cuda.synchronize()
+            start = time.time()
+            for _ in range(args.iters):
+                op(b)
+            if args.device == "cuda":
+                torch.cuda.synchronize()
+            print("{:<14s} {:<12s} {:8.1f} us".format(
+                name, op_name, (time.time() - start) / args.iters * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Micro-benchmark of Checkpointer.save.
+
+Measures how long save blocks the training loop, and how long the checkpoint
+takes to be written, for the synchronous and asynchronous modes, e.g.
+    python tests/benchmark_checkpoint.py --num_layers 16 --dim 2048
+"""
+import argparse
+import tempfile
+import time
+
+import torch
+from torch import nn
+
+from maskrcnn_benchmark.utils.checkpoint import Checkpointer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checkpointer benchmark")
+    parser.add_argument("--num_layers", type=int, default=16)
+    parser.add_argument("--dim", type=int, default=2048)
+    parser.add_argument("--iters", type=int, default=3)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    model = nn.Sequential(*[nn.Linear(args.dim, args.dim)
+                            for _ in range(args.num_layers)]).to(args.device)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+    model(torch.rand(2, args.dim, device=args.device)).sum().backward()
+    optimizer.step()
+    num_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+    print("model + momentum: {:.0f} MB".format(2 * num_bytes / 1024 ** 2))
+
+    for async_save in [False, True]:
+        with tempfile.TemporaryDirectory() as save_dir:
+            checkpointer = Checkpointer(model, optimizer, save_dir=save_dir,
+                                        save_to_disk=True, async_save=async_save)
+            # the first asynchronous save allocates the cpu buffers
+            checkpointer.save("warmup")
+            checkpointer.wait()
+            blocked = written = 0
+            for i in range(args.iters):
+                start = time.time()
+                checkpointer.save("model_{:07d}".format(i))
+                blocked += time.time() - start
+                checkpointer.wait()
+                written += time.time() - start
+            print("async_save={:<6} blocked {:8.1f} ms   written {:8.1f} ms".format(
+                str(async_save), blocked / args.iters * 1e3, written / args.iters * 1e3))
+
+
+if __name__ == "__main__":
+    main()
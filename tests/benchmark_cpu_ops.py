@@ -0,0 +1,80 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Micro-benchmark of the cpu NMS and ROIAlign kernels of maskrcnn_benchmark._C.
+
+Compares them with torchvision.ops.nms and torchvision.ops.roi_align for a
+number of threads, in ms per call, e.g.
+    python tests/benchmark_cpu_ops.py --num_threads 1 4 16
+
+torchvision computes box widths as x2 - x1 instead of x2 - x1 + 1, so the two
+NMS may keep slightly different boxes; the ROIAlign outputs are the same.
+"""
+import argparse
+import time
+
+import torch
+import torchvision
+
+from maskrcnn_benchmark import _C
+
+
+def create_boxes(num_boxes, num_clusters, generator):
+    # detections cluster around objects
+    centers = torch.rand(num_clusters, 2, generator=generator) * 1000
+    xy = centers[torch.randint(0, num_clusters, (num_boxes,), generator=generator)]
+    xy = xy + torch.randn(num_boxes, 2, generator=generator) * 20
+    wh = torch.rand(num_boxes, 2, generator=generator) * 150 + 10
+    return torch.cat((xy, xy + wh), 1)
+
+
+def timeit(fn, iters):
+    fn()
+    start = time.time()
+    for _ in range(iters):
+        fn()
+    return (time.time() - start) / iters * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cpu NMS / ROIAlign benchmark")
+    parser.add_argument("--num_threads", type=int, nargs="+", default=[1, torch.get_num_threads()])
+    parser.add_argument("--num_boxes", type=int, nargs="+", default=[1000, 6000, 20000])
+    parser.add_argument("--nms_thresh", type=float, default=0.7)
+    parser.add_argument("--num_rois", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--feature_size", type=int, nargs=2, default=[50, 68],
+                        help="height and width of the feature map")
+    parser.add_argument("--channels", type=int, default=256)
+    parser.add_argument("--iters", type=int, default=10)
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(0)
+    height, width = args.feature_size
+    spatial_scale = 1 / 16.
+    features = torch.randn(1, args.channels, height, width, generator=generator)
+
+    for num_threads in sorted(set(args.num_threads)):
+        torch.set_num_threads(num_threads)
+        for num_boxes in args.num_boxes:
+            boxes = create_boxes(num_boxes, 50, generator)
+            scores = torch.rand(num_boxes, generator=generator)
+            for name, nms in [("_C", _C.nms), ("torchvision", torchvision.ops.nms)]:
+                num_kept = len(nms(boxes, scores, args.nms_thresh))
+                elapsed = timeit(lambda: nms(boxes, scores, args.nms_thresh), args.iters)
+                print("threads={:<3d} nms       {:6d} boxes {:<12s} {:6d} kept {:9.2f} ms".format(
+                    num_threads, num_boxes, name, num_kept, elapsed))
+
+        for num_rois in args.num_rois:
+            boxes = create_boxes(num_rois, 20, generator) / 1000 * width / spatial_scale
+            rois = torch.cat((torch.zeros(num_rois, 1), boxes), 1)
+            expected = torchvision.ops.roi_align(features, rois, (7, 7), spatial_scale, 2, False)
+            output = _C.roi_align_forward(features, rois, spatial_scale, 7, 7, 2)
+            assert torch.allclose(output, expected, atol=1e-5)
+            for name, roi_align in [
+                    ("_C", lambda: _C.roi_align_forward(features, rois, spatial_scale, 7, 7, 2)),
+                    ("torchvision", lambda: torchvision.ops.roi_align(
+                        features, rois, (7, 7), spatial_scale, 2, False))]:
+                print("threads={:<3d} roi_align {:6d} rois  {:<12s} {:9.2f} ms".format(
+                    num_threads, num_rois, name, timeit(roi_align, args.iters)))
+
+
+if __name__ == "__main__":
+    main()
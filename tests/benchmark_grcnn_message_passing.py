@@ -0,0 +1,117 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Micro-benchmark of the GRCNN message passing.
+
+Runs one feature update step of GRCNN (building the attention maps and the
+five collections) with the dense obj x obj / obj x rel maps and with the
+sparse ones, for 32 to 256 boxes per image and all the ordered pairs of
+boxes, in ms/batch and peak memory, e.g.
+    python tests/benchmark_grcnn_message_passing.py --batch_size 2 --dim 256
+"""
+import argparse
+import time
+
+import torch
+
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.bounding_box_pair import BoxPairList
+from scene_graph_benchmark.relation_head.grcnn.agcn.agcn import \
+    _GraphConvolutionLayer_Collect
+from scene_graph_benchmark.relation_head.grcnn.grcnn import GRCNN
+
+
+def create_proposals(num_boxes, batch_size, max_pairs, device):
+    generator = torch.Generator().manual_seed(0)
+    proposals, proposal_pairs = [], []
+    for _ in range(batch_size):
+        xy = torch.rand(num_boxes, 2, generator=generator) * 700
+        boxes = torch.cat((xy, xy + 100), 1)
+        proposals.append(BoxList(boxes, (900, 900)).to(device))
+        idx = torch.arange(num_boxes)
+        idx_pairs = torch.stack(torch.meshgrid(idx, idx, indexing='ij'), 2).view(-1, 2)
+        idx_pairs = idx_pairs[idx_pairs[:, 0] != idx_pairs[:, 1]][:max_pairs]
+        pairs = BoxPairList(torch.cat((boxes[idx_pairs[:, 0]], boxes[idx_pairs[:, 1]]), 1),
+                            (900, 900))
+        pairs.add_field('idx_pairs', idx_pairs)
+        proposal_pairs.append(pairs.to(device))
+    return proposals, proposal_pairs
+
+
+def message_passing(get_maps, collect, obj_feats, pred_feats, proposals, proposal_pairs):
+    _, obj_obj_map, subj_pred_map, obj_pred_map = get_maps(None, proposals, proposal_pairs)
+    source_obj = collect(obj_feats, obj_feats, obj_obj_map, 4)
+    source_rel_sub = collect(obj_feats, pred_feats, subj_pred_map, 0)
+    source_rel_obj = collect(obj_feats, pred_feats, obj_pred_map, 1)
+    source_obj_sub = collect(pred_feats, obj_feats, subj_pred_map.t(), 2)
+    source_obj_obj = collect(pred_feats, obj_feats, obj_pred_map.t(), 3)
+    return ((source_obj + source_rel_sub + source_rel_obj) / 3,
+            (source_obj_sub + source_obj_obj) / 2)
+
+
+def peak_memory(fn, device):
+    # peak bytes allocated while fn runs, on top of what was allocated before
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn()
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                profile_memory=True) as prof:
+        fn()
+    # allocations are attributed to the op which makes them, frees to
+    # '[memory]' events
+    allocated, peak = 0, 0
+    for e in sorted(prof.events(), key=lambda e: e.time_range.start):
+        allocated += e.self_cpu_memory_usage
+        peak = max(peak, allocated)
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GRCNN message passing benchmark")
+    parser.add_argument("--num_boxes", type=int, nargs="+", default=[32, 64, 128, 256])
+    parser.add_argument("--max_pairs", type=int, default=-1,
+                        help="pairs kept per image, all of them by default")
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--iters", type=int, default=5)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    collect = _GraphConvolutionLayer_Collect(args.dim, args.dim).to(device)
+    for num_boxes in args.num_boxes:
+        max_pairs = args.max_pairs if args.max_pairs > 0 else num_boxes * num_boxes
+        proposals, proposal_pairs = create_proposals(num_boxes, args.batch_size,
+                                                     max_pairs, device)
+        num_rels = sum(len(pairs) for pairs in proposal_pairs)
+        obj_feats = torch.rand(num_boxes * args.batch_size, args.dim, device=device)
+        pred_feats = torch.rand(num_rels, args.dim, device=device)
+
+        with torch.no_grad():
+            runs = [(name, lambda get_maps=get_maps: message_passing(
+                        get_maps, collect, obj_feats, pred_feats, proposals, proposal_pairs))
+                    for name, get_maps in [("dense", GRCNN._get_map_idxs),
+                                           ("sparse", GRCNN._get_sparse_maps)]]
+            expected, result = runs[0][1](), runs[1][1]()
+            for e, r in zip(expected, result):
+                assert torch.allclose(e, r, rtol=1e-4, atol=1e-5)
+
+            for name, fn in runs:
+                memory = peak_memory(fn, device)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                start = time.time()
+                for _ in range(args.iters):
+                    fn()
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                elapsed = (time.time() - start) / args.iters
+                print("{:4d} boxes/image {:7d} rels {:<7s} {:9.2f} ms/batch "
+                      "{:10.1f} MB peak".format(num_boxes, num_rels, name,
+                                                elapsed * 1000, memory / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Micro-benchmark of LabelLoader field decoding.
+
+Decodes images with many boxes carrying 2048-d features, per-class scores and
+per-class boxes, and compares LabelLoader with the previous per-object
+implementation, e.g.
+    python tests/benchmark_label_loader.py --num_boxes 100 --feature_dim 2048
+"""
+import argparse
+import base64
+import time
+
+import numpy as np
+import torch
+
+from maskrcnn_benchmark.data.datasets.utils.label_loader import LabelLoader
+
+
+class LegacyLabelLoader(LabelLoader):
+    def add_classes(self, annotations):
+        class_names = [obj["class"] for obj in annotations]
+        classes = [None] * len(class_names)
+        for i in range(len(class_names)):
+            classes[i] = self.labelmap['class_to_ind'][class_names[i]]
+        return torch.tensor(classes)
+
+    def add_confidences(self, annotations):
+        confidences = []
+        for obj in annotations:
+            if "conf" in obj:
+                confidences.append(obj["conf"])
+            else:
+                confidences.append(1.0)
+        return torch.tensor(confidences)
+
+    def add_attributes(self, annotations):
+        attributes = [[0] * 16 for _ in range(len(annotations))]
+        for i, obj in enumerate(annotations):
+            for j, attr in enumerate(obj["attributes"]):
+                attributes[i][j] = self.labelmap['attribute_to_ind'][attr]
+        return torch.tensor(attributes)
+
+    def add_features(self, annotations):
+        features = []
+        for obj in annotations:
+            features.append(np.frombuffer(base64.b64decode(obj['feature']), np.float32))
+        return torch.tensor(features)
+
+    def add_scores_all(self, annotations):
+        scores_all = []
+        for obj in annotations:
+            scores_all.append(np.frombuffer(base64.b64decode(obj['scores_all']), np.float32))
+        return torch.tensor(scores_all)
+
+    def add_boxes_all(self, annotations):
+        boxes_all = []
+        for obj in annotations:
+            boxes_all.append(np.frombuffer(base64.b64decode(obj['boxes_all']), np.float32).reshape(-1, 4))
+        return torch.tensor(boxes_all)
+
+
+def create_annotations(num_boxes, feature_dim, num_classes, num_attributes):
+    rng = np.random.RandomState(0)
+    annotations = []
+    for _ in range(num_boxes):
+        x, y = rng.rand(2) * 100
+        annotations.append({
+            "rect": [float(x), float(y), float(x) + 50, float(y) + 50],
+            "class": "class_{}".format(rng.randint(num_classes)),
+            "conf": float(rng.rand()),
+            "attributes": ["attr_{}".format(a) for a in rng.choice(num_attributes, 3, replace=False)],
+            "feature": base64.b64encode(rng.rand(feature_dim).astype(np.float32)).decode(),
+            "scores_all": base64.b64encode(rng.rand(num_classes).astype(np.float32)).decode(),
+            "boxes_all": base64.b64encode(rng.rand(num_classes * 4).astype(np.float32)).decode(),
+        })
+    return annotations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LabelLoader benchmark")
+    parser.add_argument("--num_boxes", type=int, default=100)
+    parser.add_argument("--feature_dim", type=int, default=2048)
+    parser.add_argument("--num_classes", type=int, default=151)
+    parser.add_argument("--num_attributes", type=int, default=401)
+    parser.add_argument("--iters", type=int, default=50)
+    args = parser.parse_args()
+
+    labelmap = {
+        "class_to_ind": {"class_{}".format(i): i for i in range(args.num_classes)},
+        "attribute_to_ind": {"attr_{}".format(i): i for i in range(args.num_attributes)},
+    }
+    fields = ["class", "conf", "attributes", "scores_all", "boxes_all", "feature"]
+    annotations = create_annotations(args.num_boxes, args.feature_dim,
+                                     args.num_classes, args.num_attributes)
+    img_size = (800, 600)
+
+    legacy = LegacyLabelLoader(labelmap, extra_fields=fields)
+    loader = LabelLoader(labelmap, extra_fields=fields)
+    expected = legacy(annotations, img_size)
+    target = loader(annotations, img_size)
+    for field in expected.fields():
+        assert torch.equal(target.get_field(field), expected.get_field(field)), field
+
+    for name, l in [("legacy", legacy), ("vectorized", loader)]:
+        for field in fields:
+            start = time.time()
+            for _ in range(args.iters):
+                l(annotations, img_size, load_fields=[field])
+            print("{:<12s} {:<12s} {:8.3f} ms/image".format(
+                name, field, (time.time() - start) / args.iters * 1000))
+
+
+if __name__ == "__main__":
+    main()
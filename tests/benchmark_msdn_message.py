@@ -0,0 +1,114 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Micro-benchmark of the MSDN / IMP object message passing.
+
+Compares the segment reductions over the (object, relation) pairs with the
+previous implementations, the loop over the targets of MSDN_BASE.prepare_message
+and the dense obj_num x rel_num maps of IMP, in ms per message, e.g.
+    python tests/benchmark_msdn_message.py --num_boxes 64 --dim 1024
+"""
+import argparse
+import time
+
+import torch
+
+from scene_graph_benchmark.relation_head.imp.imp import _segment_mean
+from scene_graph_benchmark.relation_head.msdn.msdn_base import MSDN_BASE
+
+
+def legacy_prepare_message(target_features, source_features, select_mat, gate_module):
+    feature_data = []
+    if select_mat.data.sum() == 0:
+        temp = torch.zeros(target_features.size()[1:]).type_as(target_features)
+        feature_data.append(temp)
+    else:
+        transfer_list = (select_mat.data > 0).nonzero(as_tuple=False)
+        source_indices = transfer_list[:, 1]
+        target_indices = transfer_list[:, 0]
+        source_f = torch.index_select(source_features, 0, source_indices)
+        target_f = torch.index_select(target_features, 0, target_indices)
+        transferred_features = gate_module(target_f, source_f)
+
+        for f_id in range(target_features.size()[0]):
+            if select_mat[f_id, :].data.sum() > 0:
+                feature_indices = (transfer_list[:, 0] == f_id).nonzero(as_tuple=False)[0]
+                features = torch.index_select(transferred_features, 0,
+                                              feature_indices).mean(0).view(-1)
+                feature_data.append(features)
+            else:
+                temp = torch.zeros(target_features.size()[1:]).type_as(target_features)
+                feature_data.append(temp)
+
+    return torch.stack(feature_data, 0)
+
+
+def legacy_get_maps(rel_inds, obj_num):
+    subj_pred_map = rel_inds.new(obj_num, rel_inds.shape[0]).fill_(0).float()
+    obj_pred_map = rel_inds.new(obj_num, rel_inds.shape[0]).fill_(0).float()
+    subj_pred_map.scatter_(0, (rel_inds[:, 0].contiguous().view(1, -1)), 1)
+    obj_pred_map.scatter_(0, (rel_inds[:, 1].contiguous().view(1, -1)), 1)
+    return subj_pred_map, obj_pred_map
+
+
+def legacy_imp_message(messages, rel_inds, obj_num):
+    subj_pred_map, obj_pred_map = legacy_get_maps(rel_inds, obj_num)
+    return (torch.mm(subj_pred_map, messages) / (subj_pred_map.sum(1, keepdim=True) + 1e-5)
+            + torch.mm(obj_pred_map, messages) / (obj_pred_map.sum(1, keepdim=True) + 1e-5)) / 2.
+
+
+def imp_message(messages, rel_inds, obj_num):
+    return (_segment_mean(messages, rel_inds[:, 0], obj_num)
+            + _segment_mean(messages, rel_inds[:, 1], obj_num)) / 2.
+
+
+def timeit(fn, iters):
+    fn()
+    start = time.time()
+    for _ in range(iters):
+        fn()
+    return (time.time() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MSDN / IMP message passing benchmark")
+    parser.add_argument("--num_boxes", type=int, default=64)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--iters", type=int, default=10)
+    args = parser.parse_args()
+    torch.set_grad_enabled(False)
+
+    idx = torch.arange(args.num_boxes)
+    idx_pairs = torch.stack(torch.meshgrid(idx, idx, indexing='ij'), 2).view(-1, 2)
+    idx_pairs = idx_pairs[idx_pairs[:, 0] != idx_pairs[:, 1]]
+    rel_inds = torch.cat([idx_pairs + i * args.num_boxes for i in range(args.batch_size)], 0)
+    obj_num, rel_num = args.num_boxes * args.batch_size, rel_inds.shape[0]
+    obj_feats = torch.rand(obj_num, args.dim)
+    pred_feats = torch.rand(rel_num, args.dim)
+    pred_inds = torch.arange(rel_num)
+
+    msdn = MSDN_BASE(args.dim)
+    msdn_average = MSDN_BASE(args.dim, average_messages=True)
+    gate = msdn.gate_pred2sub
+    assert torch.allclose(
+        legacy_prepare_message(obj_feats, pred_feats, legacy_get_maps(rel_inds, obj_num)[0], gate),
+        msdn.prepare_message_from_inds(obj_feats, pred_feats, rel_inds[:, 0], pred_inds, gate),
+        rtol=1e-4, atol=1e-5)
+    expected = imp_message(pred_feats, rel_inds, obj_num)
+    assert torch.allclose(legacy_imp_message(pred_feats, rel_inds, obj_num), expected,
+                          rtol=1e-4, atol=1e-5)
+
+    print("{} objects {} relations dim {}".format(obj_num, rel_num, args.dim))
+    for name, fn in [
+            ("msdn loop", lambda: legacy_prepare_message(
+                obj_feats, pred_feats, legacy_get_maps(rel_inds, obj_num)[0], gate)),
+            ("msdn segment", lambda: msdn.prepare_message_from_inds(
+                obj_feats, pred_feats, rel_inds[:, 0], pred_inds, gate)),
+            ("msdn average", lambda: msdn_average.prepare_message_from_inds(
+                obj_feats, pred_feats, rel_inds[:, 0], pred_inds, gate)),
+            ("imp dense", lambda: legacy_imp_message(pred_feats, rel_inds, obj_num)),
+            ("imp segment", lambda: imp_message(pred_feats, rel_inds, obj_num))]:
+        print("{:<14s} {:9.2f} ms".format(name, timeit(fn, args.iters) * 1000))
+
+
+if __name__ == "__main__":
+    main()
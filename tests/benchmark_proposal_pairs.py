@@ -0,0 +1,119 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Micro-benchmark of the relation proposal pair generation.
+
+Compares get_proposal_pairs with the previous implementation, which built
+the boxes of all N x N pairs before dropping self and non-overlapping pairs,
+in pairs/sec and peak memory per image, e.g.
+    python tests/benchmark_proposal_pairs.py --num_boxes 100 --device cuda
+"""
+import argparse
+import time
+
+import torch
+
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.boxlist_ops import boxlist_iou
+from scene_graph_benchmark.relation_head.relation_head import get_proposal_pairs
+
+
+def legacy_get_proposal_pairs(proposals_per_image, filter_non_overlap):
+    box_subj = proposals_per_image.bbox
+    box_obj = proposals_per_image.bbox
+
+    box_subj = box_subj.unsqueeze(1).repeat(1, box_subj.shape[0], 1)
+    box_obj = box_obj.unsqueeze(0).repeat(box_obj.shape[0], 1, 1)
+    proposal_box_pairs = torch.cat(
+        (box_subj.view(-1, 4), box_obj.view(-1, 4)), 1)
+
+    idx_subj = torch.arange(box_subj.shape[0]).view(-1, 1, 1).repeat(1, box_obj.shape[0], 1).to(
+        proposals_per_image.bbox.device)
+    idx_obj = torch.arange(box_obj.shape[0]).view(1, -1, 1).repeat(box_subj.shape[0], 1, 1).to(
+        proposals_per_image.bbox.device)
+    proposal_idx_pairs = torch.cat((idx_subj.view(-1, 1), idx_obj.view(-1, 1)), 1)
+
+    label_subj = proposals_per_image.get_field('labels')[idx_subj]
+    label_obj = proposals_per_image.get_field('labels')[idx_obj]
+    proposal_label_pairs = torch.cat(
+        (label_subj.view(-1, 1), label_obj.view(-1, 1)), 1)
+
+    keep_idx = (proposal_idx_pairs[:, 0] != proposal_idx_pairs[:, 1]).nonzero(as_tuple=False).view(-1)
+
+    if filter_non_overlap:
+        ious = boxlist_iou(proposals_per_image, proposals_per_image).view(-1)
+        ious = ious[keep_idx]
+        keep_idx = keep_idx[(ious > 0).nonzero(as_tuple=False).view(-1)]
+    return proposal_idx_pairs[keep_idx], proposal_box_pairs[keep_idx], proposal_label_pairs[keep_idx]
+
+
+def create_proposals(num_boxes, device):
+    generator = torch.Generator().manual_seed(0)
+    xy = torch.rand(num_boxes, 2, generator=generator) * 700
+    wh = torch.rand(num_boxes, 2, generator=generator) * 200 + 1
+    proposals = BoxList(torch.cat((xy, xy + wh), 1), (900, 900))
+    proposals.add_field('labels', torch.randint(1, 151, (num_boxes,), generator=generator))
+    proposals.add_field('scores', torch.rand(num_boxes, generator=generator))
+    return proposals.to(device)
+
+
+def peak_memory(fn, device):
+    # peak bytes allocated while fn runs, on top of what was allocated before
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn()
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                profile_memory=True) as prof:
+        fn()
+    # allocations are attributed to the op which makes them, frees to
+    # '[memory]' events
+    allocated, peak = 0, 0
+    for e in sorted(prof.events(), key=lambda e: e.time_range.start):
+        allocated += e.self_cpu_memory_usage
+        peak = max(peak, allocated)
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="proposal pair generation benchmark")
+    parser.add_argument("--num_boxes", type=int, default=100)
+    parser.add_argument("--max_pairs", type=int, default=4096)
+    parser.add_argument("--iters", type=int, default=100)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    proposals = create_proposals(args.num_boxes, device)
+    for filter_non_overlap in [False, True]:
+        idx_pairs, box_pairs, label_pairs = legacy_get_proposal_pairs(proposals, filter_non_overlap)
+        pairs = get_proposal_pairs(proposals, filter_non_overlap)
+        assert torch.equal(pairs.get_field('idx_pairs'), idx_pairs)
+        assert torch.equal(pairs.bbox, box_pairs)
+        assert torch.equal(pairs.get_field('label_pairs'), label_pairs)
+
+    for filter_non_overlap in [False, True]:
+        for name, fn in [
+                ("legacy", lambda: legacy_get_proposal_pairs(proposals, filter_non_overlap)[0]),
+                ("pruned", lambda: get_proposal_pairs(proposals, filter_non_overlap)),
+                ("top-{}".format(args.max_pairs),
+                 lambda: get_proposal_pairs(proposals, filter_non_overlap, args.max_pairs))]:
+            num_pairs = len(fn())
+            memory = peak_memory(fn, device)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.time()
+            for _ in range(args.iters):
+                fn()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            elapsed = (time.time() - start) / args.iters
+            print("filter_non_overlap={:<5} {:<10s} {:6d} pairs {:8.3f} ms/image "
+                  "{:10.0f} pairs/s {:8.1f} KB peak".format(
+                      str(filter_non_overlap), name, num_pairs, elapsed * 1000,
+                      num_pairs / elapsed, memory / 1024))
+
+
+if __name__ == "__main__":
+    main()
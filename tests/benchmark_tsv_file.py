@@ -0,0 +1,87 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+"""Benchmark of lineidx generation and tsv writing.
+
+Compares the chunked/parallel create_lineidx and the buffered tsv_writer
+with the previous line-by-line implementations, e.g.
+    python tests/benchmark_tsv_file.py --num_rows 200000 --row_size 2000
+"""
+import argparse
+import os
+import os.path as op
+import time
+from tempfile import TemporaryDirectory
+
+from maskrcnn_benchmark.structures.tsv_file import create_lineidx
+from maskrcnn_benchmark.structures.tsv_file_ops import tsv_writer
+
+
+def legacy_create_lineidx(filein, idxout):
+    idxout_tmp = idxout + '.tmp'
+    with open(filein, 'r') as tsvin, open(idxout_tmp,'w') as tsvout:
+        fsize = os.fstat(tsvin.fileno()).st_size
+        fpos = 0
+        while fpos!=fsize:
+            tsvout.write(str(fpos)+"\n")
+            tsvin.readline()
+            fpos = tsvin.tell()
+    os.rename(idxout_tmp, idxout)
+
+
+def legacy_tsv_writer(values, tsv_file, sep='\t'):
+    lineidx_file = op.splitext(tsv_file)[0] + '.lineidx'
+    idx = 0
+    with open(tsv_file, 'w') as fp, open(lineidx_file, 'w') as fpidx:
+        for value in values:
+            value = [v if type(v)!=bytes else v.decode('utf-8') for v in value]
+            v = '{0}\n'.format(sep.join(map(str, value)))
+            fp.write(v)
+            fpidx.write(str(idx) + '\n')
+            idx = idx + len(v)
+
+
+def gen_rows(num_rows, row_size):
+    payload = 'x' * row_size
+    for i in range(num_rows):
+        yield ['key_{}'.format(i), payload]
+
+
+def timeit(name, func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    duration = time.time() - start
+    print('{:<40s} {:8.3f}s'.format(name, duration))
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TSV lineidx/writer benchmark")
+    parser.add_argument("--num_rows", type=int, default=200000)
+    parser.add_argument("--row_size", type=int, default=2000)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--buffer_size", type=int, default=16 << 20)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as d:
+        timeit('tsv_writer (legacy)', legacy_tsv_writer,
+               gen_rows(args.num_rows, args.row_size), op.join(d, 'legacy.tsv'))
+        timeit('tsv_writer', tsv_writer,
+               gen_rows(args.num_rows, args.row_size), op.join(d, 'default.tsv'))
+        tsv_file = op.join(d, 'bench.tsv')
+        timeit('tsv_writer (buffered)', tsv_writer,
+               gen_rows(args.num_rows, args.row_size), tsv_file,
+               buffer_size=args.buffer_size)
+        print('file size: {:.1f} MB'.format(op.getsize(tsv_file) / 2**20))
+
+        lineidx = op.join(d, 'bench.lineidx')
+        timeit('create_lineidx (legacy)', legacy_create_lineidx, tsv_file, lineidx)
+        with open(lineidx, 'r') as fp:
+            expected = fp.read()
+        timeit('create_lineidx (1 worker)', create_lineidx, tsv_file, lineidx)
+        timeit('create_lineidx ({} workers)'.format(args.num_workers),
+               create_lineidx, tsv_file, lineidx, num_workers=args.num_workers)
+        with open(lineidx, 'r') as fp:
+            assert fp.read() == expected
+
+
+if __name__ == "__main__":
+    main()
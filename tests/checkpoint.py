@@ -9,6 +9,8 @@ from torch import nn
 
 from maskrcnn_benchmark.utils.model_serialization import load_state_dict
 from maskrcnn_benchmark.utils.checkpoint import Checkpointer
+from maskrcnn_benchmark.utils.checkpoint import merge_checkpoint
+from maskrcnn_benchmark.utils.checkpoint import split_checkpoint
 
 
 class TestCheckpointer(unittest.TestCase):
@@ -113,6 +115,65 @@ class TestCheckpointer(unittest.TestCase):
                 # same content
                 self.assertTrue(loaded.equal(stored))
 
+    def test_async_and_sharded_save(self):
+        for async_save, sharded in [(True, False), (False, True), (True, True)]:
+            trained_model, fresh_model = self.create_model(), self.create_model()
+            optimizer = torch.optim.SGD(trained_model.parameters(), lr=0.1, momentum=0.9)
+            trained_model(torch.rand(4, 2)).sum().backward()
+            optimizer.step()
+            with TemporaryDirectory() as f:
+                checkpointer = Checkpointer(
+                    trained_model, optimizer, save_dir=f, save_to_disk=True,
+                    async_save=async_save, sharded=sharded,
+                )
+                expected = [p.detach().clone() for p in trained_model.parameters()]
+                checkpointer.save("checkpoint_file", iteration=10)
+                # training goes on while the checkpoint is written
+                with torch.no_grad():
+                    for p in trained_model.parameters():
+                        p.add_(1)
+                checkpointer.wait()
+
+                self.assertEqual(
+                    sorted(os.listdir(f)),
+                    sorted(["checkpoint_file.pth", "last_checkpoint"]
+                           + (["checkpoint_file.shard0-of-1.pth"] if sharded else [])),
+                )
+                fresh_checkpointer = Checkpointer(fresh_model, save_dir=f)
+                self.assertEqual(
+                    fresh_checkpointer.get_checkpoint_file(),
+                    os.path.join(f, "checkpoint_file.pth"),
+                )
+                checkpoint = fresh_checkpointer.load()
+                self.assertEqual(checkpoint["iteration"], 10)
+                self.assertEqual(len(checkpoint["optimizer"]["state"]), 4)
+
+            for trained_p, loaded_p in zip(expected, fresh_model.parameters()):
+                self.assertTrue(trained_p.equal(loaded_p))
+
+    def test_split_checkpoint(self):
+        model = self.create_complex_model()[0]
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+        for p in model.parameters():
+            p.grad = torch.rand_like(p)
+        optimizer.step()
+        data = {"model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                "iteration": 3}
+        shards, index = split_checkpoint(data, 3)
+        self.assertEqual(len(shards), 3)
+        # the largest entries are spread across the slices
+        self.assertTrue(all(len(shard["model"]) > 0 for shard in shards))
+        self.assertNotIn("momentum_buffer", str(index))
+        merged = merge_checkpoint(shards, index)
+        self.assertEqual(list(merged["model"].keys()), list(data["model"].keys()))
+        for k, v in data["model"].items():
+            self.assertIs(merged["model"][k], v)
+        self.assertEqual(merged["optimizer"]["param_groups"],
+                         data["optimizer"]["param_groups"])
+        for k, v in data["optimizer"]["state"].items():
+            self.assertIs(merged["optimizer"]["state"][k], v)
+        self.assertEqual(merged["iteration"], 3)
+
 
 if __name__ == "__main__":
     unittest.main()
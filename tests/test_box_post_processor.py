@@ -0,0 +1,169 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import torch
+
+from maskrcnn_benchmark.config import cfg
+from maskrcnn_benchmark.modeling.roi_heads.box_head.inference import \
+    make_roi_box_post_processor
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.boxlist_ops import boxlist_nms
+from maskrcnn_benchmark.structures.boxlist_ops import cat_boxlist
+
+
+# the per class loop implementations the post processor must agree with.
+def legacy_filter_results(self, boxlist, num_classes, feature=None):
+    boxes = boxlist.bbox.reshape(-1, num_classes * 4)
+    scores = boxlist.get_field("scores").reshape(-1, num_classes)
+    result = []
+    inds_all = scores > self.score_thresh
+    boxlist_empty = self.prepare_empty_boxlist(boxlist)
+    for j in range(1, num_classes):
+        inds = inds_all[:, j].nonzero(as_tuple=False).squeeze(1)
+        if len(inds) > 0:
+            boxlist_for_class = BoxList(boxes[inds, j * 4: (j + 1) * 4], boxlist.size, mode="xyxy")
+            boxlist_for_class.add_field("scores", scores[inds, j])
+            if self.output_feature:
+                boxlist_for_class.add_field("box_features", feature[inds])
+                boxlist_for_class.add_field("scores_all", scores[inds])
+                boxlist_for_class.add_field("boxes_all", boxes[inds].view(-1, num_classes, 4))
+            boxlist_for_class = boxlist_nms(boxlist_for_class, self.nms)
+            boxlist_for_class.add_field(
+                "labels", torch.full((len(boxlist_for_class),), j, dtype=torch.int64))
+            result.append(boxlist_for_class)
+        else:
+            result.append(boxlist_empty)
+    result = cat_boxlist(result)
+    number_of_detections = len(result)
+    if number_of_detections > self.detections_per_img > 0:
+        cls_scores = result.get_field("scores")
+        image_thresh, _ = torch.kthvalue(
+            cls_scores.cpu(), number_of_detections - self.detections_per_img + 1)
+        keep = torch.nonzero(cls_scores >= image_thresh.item(), as_tuple=False).squeeze(1)
+        result = result[keep]
+    return result
+
+
+def legacy_filter_results_peter(self, boxlist, num_classes, feature=None):
+    boxes = boxlist.bbox.reshape(-1, num_classes * 4)
+    scores = boxlist.get_field("scores").reshape(-1, num_classes)
+    nms_mask = scores.clone()
+    nms_mask.zero_()
+    for j in range(1, num_classes):
+        boxlist_for_class = BoxList(boxes[:, j * 4: (j + 1) * 4], boxlist.size, mode="xyxy")
+        boxlist_for_class.add_field("scores", scores[:, j])
+        boxlist_for_class.add_field("idxs", torch.arange(0, scores.shape[0]).long())
+        boxlist_for_class = boxlist_nms(boxlist_for_class, 0.3)
+        nms_mask[:, j][boxlist_for_class.get_field("idxs")] = 1
+    dists_all = nms_mask * scores
+    scores_pre, labels_pre = dists_all.max(1)
+    inds_pre = scores_pre.nonzero(as_tuple=False).squeeze(1)
+    labels_pre = labels_pre[inds_pre]
+    scores_pre = scores_pre[inds_pre]
+    box_inds_pre = inds_pre * scores.shape[1] + labels_pre
+    result = BoxList(boxlist.bbox.view(-1, 4)[box_inds_pre], boxlist.size, mode="xyxy")
+    result.add_field("labels", labels_pre)
+    result.add_field("scores", scores_pre)
+    if self.output_feature:
+        result.add_field("box_features", feature[inds_pre])
+        result.add_field("scores_all", scores[inds_pre])
+        result.add_field("boxes_all", boxes[inds_pre].view(-1, num_classes, 4))
+    _, idx = torch.sort(scores_pre, dim=0, descending=True)
+    num_dets = len(torch.nonzero(scores_pre >= self.score_thresh, as_tuple=True)[0])
+    if num_dets < self.min_detections_per_img:
+        keep_boxes = idx[:self.min_detections_per_img]
+    elif num_dets > self.detections_per_img:
+        keep_boxes = idx[:self.detections_per_img]
+    else:
+        keep_boxes = idx[:num_dets]
+    return result[keep_boxes]
+
+
+def legacy_filter(self, boxlist, num_classes, feature, filter_method):
+    new_boxlist = filter_method(self, boxlist, num_classes, feature)
+    initial_conf_thresh = self.score_thresh
+    decrease_num = 0
+    while new_boxlist.bbox.shape[0] < self.min_detections_per_img and decrease_num < 10:
+        self.score_thresh /= 2.0
+        new_boxlist = filter_method(self, boxlist, num_classes, feature)
+        decrease_num += 1
+    self.score_thresh = initial_conf_thresh
+    return new_boxlist
+
+
+def _inputs(num_boxes, num_classes, feature_dim=8, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    xy = torch.rand(num_boxes, 2, generator=generator) * 150
+    wh = torch.rand(num_boxes, 2, generator=generator) * 100 + 1
+    proposals = BoxList(torch.cat((xy, xy + wh), 1), (300, 250))
+    class_logits = torch.randn(num_boxes, num_classes, generator=generator) * 3
+    box_regression = torch.randn(num_boxes, num_classes * 4, generator=generator) * 0.1
+    features = torch.rand(num_boxes, feature_dim, generator=generator)
+    return (class_logits, box_regression), [proposals], features
+
+
+class TestBoxPostProcessor(unittest.TestCase):
+    def _post_processor(self, **options):
+        config = cfg.clone()
+        config.MODEL.ROI_BOX_HEAD.NUM_CLASSES = 30
+        for key, value in options.items():
+            node = config
+            for name in key.split('.')[:-1]:
+                node = getattr(node, name)
+            setattr(node, key.split('.')[-1], value)
+        return make_roi_box_post_processor(config)
+
+    def assertSameBoxList(self, result, expected):
+        self.assertEqual(sorted(result.fields()), sorted(expected.fields()))
+        self.assertTrue(torch.equal(result.bbox, expected.bbox))
+        for field in expected.fields():
+            self.assertTrue(torch.equal(result.get_field(field), expected.get_field(field)), field)
+
+    def _boxlist(self, post_processor, x, proposals, num_classes):
+        # the boxes forward filters
+        class_logits, box_regression = x
+        boxes = post_processor.box_coder.decode(box_regression, proposals[0].bbox)
+        boxlist = post_processor.prepare_boxlist(
+            boxes, torch.softmax(class_logits, -1), proposals[0].size)
+        return boxlist.clip_to_image(remove_empty=False)
+
+    def test_filter_results(self):
+        for options in [
+                {},
+                {'TEST.OUTPUT_FEATURE': True},
+                {'MODEL.ROI_HEADS.DETECTIONS_PER_IMG': 10},
+                {'MODEL.ROI_HEADS.NMS': 0.0},
+                # no box above the threshold
+                {'MODEL.ROI_HEADS.SCORE_THRESH': 1.0},
+                # the threshold is lowered a few times
+                {'MODEL.ROI_HEADS.SCORE_THRESH': 0.9, 'MODEL.ROI_HEADS.MIN_DETECTIONS_PER_IMG': 40,
+                 'TEST.OUTPUT_FEATURE': True},
+                # and 10 times
+                {'MODEL.ROI_HEADS.SCORE_THRESH': 0.9, 'MODEL.ROI_HEADS.MIN_DETECTIONS_PER_IMG': 10000}]:
+            post_processor = self._post_processor(**options)
+            for num_boxes in [1, 60]:
+                x, proposals, features = _inputs(num_boxes, 30, seed=num_boxes)
+                boxlist = self._boxlist(post_processor, x, proposals, 30)
+                expected = legacy_filter(post_processor, boxlist, 30, features,
+                                         legacy_filter_results)
+                self.assertSameBoxList(post_processor(x, proposals, features)[0], expected)
+                self.assertEqual(post_processor.score_thresh, options.get(
+                    'MODEL.ROI_HEADS.SCORE_THRESH', cfg.MODEL.ROI_HEADS.SCORE_THRESH))
+                # without the minimum number of detections, e.g. for bbox_aug
+                self.assertSameBoxList(post_processor.filter_results(boxlist, 30, features),
+                                       legacy_filter_results(post_processor, boxlist, 30, features))
+
+    def test_filter_results_peter(self):
+        for min_detections in [0, 5, 10000]:
+            post_processor = self._post_processor(**{
+                'MODEL.ROI_HEADS.NMS_FILTER': 1, 'TEST.OUTPUT_FEATURE': True,
+                'MODEL.ROI_HEADS.MIN_DETECTIONS_PER_IMG': min_detections})
+            x, proposals, features = _inputs(60, 30)
+            boxlist = self._boxlist(post_processor, x, proposals, 30)
+            expected = legacy_filter(post_processor, boxlist, 30, features,
+                                     legacy_filter_results_peter)
+            self.assertSameBoxList(post_processor(x, proposals, features)[0], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import torch
+import torchvision
+
+from maskrcnn_benchmark import _C
+
+
+def nms_reference(boxes, scores, threshold, legacy_plus_one):
+    """ Brute force nms, one box at a time by decreasing score
+    """
+    offset = 1 if legacy_plus_one else 0
+    order = sorted(range(len(scores)), key=lambda i: -float(scores[i]))
+    areas = (boxes[:, 2] - boxes[:, 0] + offset) * (boxes[:, 3] - boxes[:, 1] + offset)
+    suppressed = torch.zeros(len(scores), dtype=torch.bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        w = (torch.min(boxes[i, 2], boxes[:, 2]) -
+             torch.max(boxes[i, 0], boxes[:, 0]) + offset).clamp(min=0)
+        h = (torch.min(boxes[i, 3], boxes[:, 3]) -
+             torch.max(boxes[i, 1], boxes[:, 1]) + offset).clamp(min=0)
+        inter = w * h
+        overlaps = inter / (areas[i] + areas - inter)
+        suppressed |= overlaps >= threshold if legacy_plus_one else overlaps > threshold
+    if legacy_plus_one:
+        keep.sort()
+    return torch.tensor(keep, dtype=torch.int64)
+
+
+def random_boxes(num_boxes, max_size, generator):
+    xy = torch.rand(num_boxes, 2, generator=generator) * 500
+    wh = torch.rand(num_boxes, 2, generator=generator) * max_size
+    # integer coordinates, so that the overlaps are exact in double precision
+    return torch.cat((xy, xy + wh), 1).round().double()
+
+
+class TestCpuOps(unittest.TestCase):
+    def setUp(self):
+        self.num_threads = torch.get_num_threads()
+
+    def tearDown(self):
+        torch.set_num_threads(self.num_threads)
+
+    def test_nms(self):
+        generator = torch.Generator().manual_seed(0)
+        for num_threads in [1, 4]:
+            torch.set_num_threads(num_threads)
+            # 3000 boxes are swept in parallel
+            for num_boxes, max_size in [(1, 50), (100, 50), (3000, 500)]:
+                boxes = random_boxes(num_boxes, max_size, generator)
+                # distinct scores, the reference breaks ties differently
+                scores = torch.randperm(num_boxes, generator=generator).double()
+                for threshold in [0.0, 0.3, 0.7]:
+                    for legacy_plus_one in [True, False]:
+                        keep = _C.nms(boxes, scores, threshold, legacy_plus_one)
+                        expected = nms_reference(boxes, scores, threshold, legacy_plus_one)
+                        self.assertTrue(torch.equal(keep, expected),
+                                        (num_threads, num_boxes, threshold, legacy_plus_one))
+
+    def test_nms_torchvision(self):
+        generator = torch.Generator().manual_seed(0)
+        for num_threads in [1, 4]:
+            torch.set_num_threads(num_threads)
+            for num_boxes in [0, 10, 5000]:
+                boxes = random_boxes(num_boxes, 100, generator).float()
+                scores = torch.rand(num_boxes, generator=generator)
+                # ties keep the index order
+                scores[:num_boxes // 2] = 0.5
+                for threshold in [0.0, 0.5, 1.0]:
+                    keep = _C.nms(boxes, scores, threshold, False)
+                    expected = torchvision.ops.nms(boxes, scores, threshold)
+                    self.assertTrue(torch.equal(keep, expected),
+                                    (num_threads, num_boxes, threshold))
+
+    def test_roi_align_forward(self):
+        generator = torch.Generator().manual_seed(0)
+        spatial_scale = 0.25
+        features = torch.randn(2, 8, 20, 30, generator=generator)
+        # 10 rois use the NCHW kernel, 50 rois have more sampled bins than
+        # feature map positions and use the channels last one
+        for num_rois in [0, 10, 50]:
+            xy = torch.rand(num_rois, 2, generator=generator) * 120 - 5
+            wh = torch.rand(num_rois, 2, generator=generator) * 60
+            batch_idx = torch.randint(0, 2, (num_rois, 1), generator=generator).float()
+            rois = torch.cat((batch_idx, xy, xy + wh), 1)
+            for sampling_ratio in [0, 2]:
+                expected = torchvision.ops.roi_align(
+                    features, rois, (7, 7), spatial_scale, sampling_ratio, False)
+                for input in [features, features.contiguous(memory_format=torch.channels_last)]:
+                    output = _C.roi_align_forward(input, rois, spatial_scale, 7, 7, sampling_ratio)
+                    self.assertEqual(output.shape, expected.shape)
+                    self.assertTrue(torch.allclose(output, expected, atol=1e-5),
+                                    (num_rois, sampling_ratio))
+
+
+if __name__ == "__main__":
+    unittest.main()
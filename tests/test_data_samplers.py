@@ -10,6 +10,7 @@ from torch.utils.data.sampler import RandomSampler
 
 from maskrcnn_benchmark.data.samplers import GroupedBatchSampler
 from maskrcnn_benchmark.data.samplers import IterationBasedBatchSampler
+from maskrcnn_benchmark.data.samplers import DistributedSubsetSampler
 
 
 class SubsetSampler(Sampler):
@@ -149,5 +150,18 @@ class TestIterationBasedBatchSampler(unittest.TestCase):
                         self.assertEqual(batch, expected)
 
 
+class TestDistributedSubsetSampler(unittest.TestCase):
+    def test_split_among_replicas(self):
+        indices = [1, 4, 5, 8, 9, 11, 12]
+        for num_replicas in [1, 2, 3, 10]:
+            result = [
+                list(DistributedSubsetSampler(indices, num_replicas, rank))
+                for rank in range(num_replicas)
+            ]
+            self.assertEqual(list(itertools.chain.from_iterable(result)), indices)
+            lengths = [len(r) for r in result]
+            self.assertLessEqual(max(lengths) - min(lengths), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
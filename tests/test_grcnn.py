@@ -0,0 +1,46 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import torch
+
+from scene_graph_benchmark.relation_head.grcnn.agcn.agcn import \
+    _GraphConvolutionLayer_Collect
+from scene_graph_benchmark.relation_head.grcnn.grcnn import GRCNN
+from utils import random_proposals_and_pairs
+
+
+class TestGRCNN(unittest.TestCase):
+    def test_sparse_message_passing(self):
+        torch.manual_seed(0)
+        # an image with a single box, which has no neighbor
+        proposals, proposal_pairs = random_proposals_and_pairs([5, 1, 7, 4],
+                                                               pair_keep_prob=0.7)
+        idx_pairs = [pairs.get_field('idx_pairs').clone() for pairs in proposal_pairs]
+        # the maps do not depend on the model
+        dense = GRCNN._get_map_idxs(None, proposals, proposal_pairs)
+        sparse = GRCNN._get_sparse_maps(None, proposals, proposal_pairs)
+        self.assertTrue(torch.equal(dense[0], sparse[0]))
+        # the idx_pairs of the proposal pairs are not modified
+        for pairs, expected in zip(proposal_pairs, idx_pairs):
+            self.assertTrue(torch.equal(pairs.get_field('idx_pairs'), expected))
+
+        _, obj_obj_map, subj_pred_map, obj_pred_map = dense
+        _, sparse_obj_obj_map, sparse_subj_pred_map, sparse_obj_pred_map = sparse
+        num_objs, num_rels = subj_pred_map.shape
+        collect = _GraphConvolutionLayer_Collect(6, 3)
+        obj_feats = torch.rand(num_objs, 6)
+        pred_feats = torch.rand(num_rels, 3)
+        for unit_id, target, source, dense_map, sparse_map in [
+                (0, obj_feats, pred_feats, subj_pred_map, sparse_subj_pred_map),
+                (1, obj_feats, pred_feats, obj_pred_map, sparse_obj_pred_map),
+                (2, pred_feats, obj_feats, subj_pred_map.t(), sparse_subj_pred_map.t()),
+                (3, pred_feats, obj_feats, obj_pred_map.t(), sparse_obj_pred_map.t()),
+                (4, obj_feats, obj_feats, obj_obj_map, sparse_obj_obj_map)]:
+            expected = collect(target, source, dense_map, unit_id)
+            result = collect(target, source, sparse_map, unit_id)
+            self.assertEqual(result.shape, expected.shape)
+            self.assertTrue(torch.allclose(result, expected, atol=1e-6), unit_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import os.path as op
+import unittest
+from tempfile import TemporaryDirectory
+
+import torch
+
+from maskrcnn_benchmark.engine.inference import PredictionShardWriter
+from maskrcnn_benchmark.engine.inference import convert_predictions_to_tsv
+from maskrcnn_benchmark.engine.inference import get_prediction_shard_file
+from maskrcnn_benchmark.engine.inference import load_prediction_shard_indices
+from maskrcnn_benchmark.engine.inference import merge_prediction_shards
+from maskrcnn_benchmark.engine.inference import prepare_resume
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.tsv_file import TSVFile
+
+
+class FakeDataset(object):
+    ind_to_class = {i: 'class_{}'.format(i) for i in range(10)}
+
+    def __init__(self, num_images):
+        self.num_images = num_images
+
+    def __len__(self):
+        return self.num_images
+
+    def get_img_key(self, idx):
+        return 'img_{}'.format(idx)
+
+    def get_img_info(self, idx):
+        return {'width': 100 + idx, 'height': 80}
+
+
+def _create_predictions(num_images):
+    predictions = {}
+    for idx in range(num_images):
+        num_boxes = idx % 4
+        boxes = torch.arange(num_boxes * 4, dtype=torch.float32).view(-1, 4)
+        prediction = BoxList(boxes, (100 + idx, 80))
+        prediction.add_field('labels', torch.arange(num_boxes) + 1)
+        prediction.add_field('scores', torch.linspace(0, 1, num_boxes))
+        predictions[idx] = prediction
+    return predictions
+
+
+class TestPredictionShards(unittest.TestCase):
+    def test_same_tsv_as_convert(self):
+        num_images, world_size = 11, 3
+        dataset = FakeDataset(num_images)
+        predictions = _create_predictions(num_images)
+        data_subset = ['rect', 'class', 'conf']
+        with TemporaryDirectory() as d:
+            convert_predictions_to_tsv(predictions, dataset, d, data_subset,
+                                       labelmap_file='', output_tsv_name='expected.tsv')
+            shard_files = []
+            for rank in range(world_size):
+                shard_file = get_prediction_shard_file(d, 'predictions.tsv', rank)
+                shard_files.append(shard_file)
+                writer = PredictionShardWriter(shard_file, dataset, data_subset,
+                                               labelmap_file='', max_pending=2)
+                # like the distributed sampler, which pads the last batch
+                # with images of the first ranks.
+                indices = list(range(rank, num_images, world_size))
+                if len(indices) < -(-num_images // world_size):
+                    indices.append(rank)
+                for idx in reversed(indices):
+                    writer.put(idx, predictions[idx])
+                writer.close()
+            tsv_file = op.join(d, 'predictions.tsv')
+            self.assertEqual(merge_prediction_shards(shard_files, tsv_file), num_images)
+
+            with open(op.join(d, 'expected.tsv'), 'rb') as fp:
+                expected = fp.read()
+            with open(tsv_file, 'rb') as fp:
+                self.assertEqual(fp.read(), expected)
+            tsv = TSVFile(tsv_file)
+            self.assertEqual(len(tsv), num_images)
+            for idx in range(num_images):
+                self.assertEqual(tsv.seek(idx)[0], dataset.get_img_key(idx))
+
+    def test_resume(self):
+        num_images = 9
+        dataset = FakeDataset(num_images)
+        predictions = _create_predictions(num_images)
+        data_subset = ['rect', 'class', 'conf']
+        with TemporaryDirectory() as d:
+            convert_predictions_to_tsv(predictions, dataset, d, data_subset,
+                                       labelmap_file='', output_tsv_name='expected.tsv')
+            # an interrupted run with two processes, one of them in the
+            # middle of writing a row.
+            for rank, indices in [(0, [0, 1, 2]), (1, [5, 6])]:
+                shard_file = get_prediction_shard_file(d, 'predictions.tsv', rank)
+                writer = PredictionShardWriter(shard_file, dataset, data_subset,
+                                               labelmap_file='')
+                for idx in indices:
+                    writer.put(idx, predictions[idx])
+                writer.close()
+            with open(get_prediction_shard_file(d, 'predictions.tsv', 1), 'ab') as fp:
+                fp.write(b'7\timg_7\t{"objects": [')
+
+            data_loader = torch.utils.data.DataLoader(
+                dataset, batch_sampler=torch.utils.data.sampler.BatchSampler(
+                    torch.utils.data.sampler.SequentialSampler(dataset), 2, False))
+            data_loader = prepare_resume(data_loader, d, 'predictions.tsv')
+            remaining = [idx for batch in data_loader.batch_sampler for idx in batch]
+            self.assertEqual(remaining, [3, 4, 7, 8])
+            shard_file = get_prediction_shard_file(d, 'predictions.tsv', 1)
+            self.assertEqual(load_prediction_shard_indices(shard_file), [5, 6])
+
+            # resumed with a single process
+            shard_file = get_prediction_shard_file(d, 'predictions.tsv', 0)
+            writer = PredictionShardWriter(shard_file, dataset, data_subset,
+                                           labelmap_file='', append=True)
+            for idx in remaining:
+                writer.put(idx, predictions[idx])
+            writer.close()
+            self.assertEqual(load_prediction_shard_indices(shard_file), [0, 1, 2, 3, 4, 7, 8])
+
+            tsv_file = op.join(d, 'predictions.tsv')
+            shard_files = [get_prediction_shard_file(d, 'predictions.tsv', rank)
+                           for rank in range(2)]
+            self.assertEqual(merge_prediction_shards(shard_files, tsv_file), num_images)
+            with open(op.join(d, 'expected.tsv'), 'rb') as fp:
+                expected = fp.read()
+            with open(tsv_file, 'rb') as fp:
+                self.assertEqual(fp.read(), expected)
+
+    def test_writer_error(self):
+        dataset = FakeDataset(2)
+        with TemporaryDirectory() as d:
+            writer = PredictionShardWriter(op.join(d, 'shard.tsv'), dataset, ['rect'],
+                                           labelmap_file='')
+            writer.put(0, None)
+            with self.assertRaises(RuntimeError):
+                writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import json
+import os.path as op
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import torch
+
+from maskrcnn_benchmark.structures.boxlist_ops import boxlist_pred_labels
+from maskrcnn_benchmark.structures.boxlist_ops import unique_relation_labels
+from maskrcnn_benchmark.structures.tsv_file_ops import tsv_writer
+from maskrcnn_benchmark.data.datasets.utils.label_loader import LabelLoader
+from maskrcnn_benchmark.data.datasets.utils.label_store import LabelStore
+from maskrcnn_benchmark.data.datasets.utils.label_store import compile_label_store
+
+
+def _create_labels(num_images=20, num_classes=5, num_attributes=4, seed=0):
+    rng = np.random.RandomState(seed)
+    predicates = ['on', 'has', 'to the left of']
+    rows = []
+    for i in range(num_images):
+        num_objects = rng.randint(0, 8)
+        objects = []
+        for _ in range(num_objects):
+            x, y = rng.randint(0, 50, size=2).tolist()
+            w, h = rng.randint(1, 100, size=2).tolist()
+            objects.append({
+                'rect': [x, y, x + w, y + h],
+                'class': 'class_{}'.format(rng.randint(num_classes)),
+                'attributes': ['attr_{}'.format(a) for a in
+                               rng.choice(num_attributes, rng.randint(0, 3), replace=False)],
+            })
+        relations = []
+        if num_objects > 1:
+            for _ in range(rng.randint(0, 6)):
+                subj_id, obj_id = rng.choice(num_objects, 2, replace=False).tolist()
+                relations.append({'subj_id': subj_id, 'obj_id': obj_id,
+                                  'class': predicates[rng.randint(len(predicates))]})
+        rows.append(['img_{}'.format(i), json.dumps({'objects': objects, 'relations': relations})])
+
+    jsondict = {
+        'label_to_idx': {'class_{}'.format(i): i + 1 for i in range(num_classes)},
+        'attribute_to_idx': {'attr_{}'.format(i): i + 1 for i in range(num_attributes)},
+        # 'to the left of' is not in the labelmap, like in VG
+        'predicate_to_idx': {'on': 1, 'has': 2},
+    }
+    return rows, jsondict
+
+
+def _get_labelmap(jsondict):
+    labelmap = {
+        'class_to_ind': dict(jsondict['label_to_idx'], __background__=0),
+        'attribute_to_ind': dict(jsondict['attribute_to_idx'], __no_attribute__=0),
+        'relation_to_ind': dict(jsondict['predicate_to_idx'], __no_relation__=0),
+    }
+    return labelmap
+
+
+class TestLabelStore(unittest.TestCase):
+    def test_same_targets_as_json(self):
+        rows, jsondict = _create_labels()
+        with TemporaryDirectory() as d:
+            label_file = op.join(d, 'train.label.tsv')
+            labelmap_file = op.join(d, 'labelmap.json')
+            tsv_writer(rows, label_file)
+            with open(labelmap_file, 'w') as fp:
+                json.dump(jsondict, fp)
+            store = LabelStore(compile_label_store(label_file, labelmap_file))
+            labelmap = _get_labelmap(jsondict)
+            store.check_labelmap(labelmap)
+            self.assertEqual(len(store), len(rows))
+
+            img_size = (80, 120)
+            for dense_relations in [False, True]:
+                loader = LabelLoader(labelmap, extra_fields=['class', 'conf', 'attributes'],
+                                     ignore_rel=['to the left of'],
+                                     dense_relations=dense_relations)
+                for i, row in enumerate(rows):
+                    annotations = json.loads(row[1])
+                    expected = loader(annotations['objects'], img_size)
+                    expected = loader.relation_loader(annotations['relations'], expected)
+                    target = loader.load_from_store(store[i], img_size)
+                    target = loader.relation_loader_from_store(store[i]['relations'], target, store)
+
+                    self.assertTrue(torch.equal(target.bbox, expected.bbox))
+                    self.assertEqual(target.fields(), expected.fields())
+                    for field in expected.fields():
+                        value, expected_value = target.get_field(field), expected.get_field(field)
+                        if expected_value.numel() == 0:
+                            # the json loader returns untyped empty tensors
+                            self.assertEqual(value.numel(), 0)
+                            continue
+                        self.assertEqual(value.dtype, expected_value.dtype)
+                        self.assertTrue(torch.equal(value, expected_value),
+                                        "{} differs for row {}".format(field, i))
+                    self.assertEqual(target.has_field('pred_labels'), dense_relations)
+
+    def test_pred_labels_from_relation_labels(self):
+        rows, jsondict = _create_labels(num_images=50)
+        dense_loader = LabelLoader(_get_labelmap(jsondict), extra_fields=['class'],
+                                   ignore_rel=['to the left of'], dense_relations=True)
+        loader = LabelLoader(_get_labelmap(jsondict), extra_fields=['class'],
+                             ignore_rel=['to the left of'])
+        for row in rows:
+            annotations = json.loads(row[1])
+            expected = dense_loader(annotations['objects'], (80, 120))
+            expected = dense_loader.relation_loader(annotations['relations'], expected)
+            target = loader(annotations['objects'], (80, 120))
+            target = loader.relation_loader(annotations['relations'], target)
+            pred_labels = expected.get_field('pred_labels')
+            self.assertTrue(torch.equal(boxlist_pred_labels(target), pred_labels))
+            self.assertTrue(torch.equal(boxlist_pred_labels(expected), pred_labels))
+            # the nonzero entries of the matrix, in the same order
+            relation_labels = unique_relation_labels(target.get_field('relation_labels'))
+            pairs = pred_labels.nonzero()
+            self.assertTrue(torch.equal(relation_labels[:, :2], pairs))
+            self.assertTrue(torch.equal(relation_labels[:, 2], pred_labels[pairs[:, 0], pairs[:, 1]]))
+
+    def test_unknown_relation(self):
+        rows, jsondict = _create_labels()
+        with TemporaryDirectory() as d:
+            label_file = op.join(d, 'train.label.tsv')
+            labelmap_file = op.join(d, 'labelmap.json')
+            tsv_writer(rows, label_file)
+            with open(labelmap_file, 'w') as fp:
+                json.dump(jsondict, fp)
+            store = LabelStore(compile_label_store(label_file, labelmap_file))
+            loader = LabelLoader(_get_labelmap(jsondict), extra_fields=['class'])
+            with self.assertRaises(KeyError):
+                for i in range(len(store)):
+                    target = loader.load_from_store(store[i], (80, 120))
+                    loader.relation_loader_from_store(store[i]['relations'], target, store)
+
+
+if __name__ == "__main__":
+    unittest.main()
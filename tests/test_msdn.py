@@ -0,0 +1,98 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import torch
+
+from scene_graph_benchmark.relation_head.imp.imp import _segment_mean
+from scene_graph_benchmark.relation_head.msdn.msdn_base import MSDN_BASE
+
+
+# the loop over the targets prepare_message used to run, it keeps the first
+# message of each target.
+def legacy_prepare_message(target_features, source_features, select_mat, gate_module):
+    feature_data = []
+    if select_mat.data.sum() == 0:
+        return target_features.new_zeros(target_features.size())
+    transfer_list = (select_mat.data > 0).nonzero(as_tuple=False)
+    source_f = torch.index_select(source_features, 0, transfer_list[:, 1])
+    target_f = torch.index_select(target_features, 0, transfer_list[:, 0])
+    transferred_features = gate_module(target_f, source_f)
+    for f_id in range(target_features.size()[0]):
+        if select_mat[f_id, :].data.sum() > 0:
+            feature_indices = (transfer_list[:, 0] == f_id).nonzero(as_tuple=False)[0]
+            features = torch.index_select(transferred_features, 0,
+                                          feature_indices).mean(0).view(-1)
+            feature_data.append(features)
+        else:
+            feature_data.append(target_features.new_zeros(target_features.size()[1:]))
+    return torch.stack(feature_data, 0)
+
+
+def _select_mat(target_inds, num_targets, num_sources):
+    select_mat = torch.zeros(num_targets, num_sources)
+    select_mat[target_inds, torch.arange(num_sources)] = 1
+    return select_mat
+
+
+class TestMessagePassing(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.num_objs, self.num_rels = 7, 20
+        self.obj_feats = torch.rand(self.num_objs, 16)
+        self.pred_feats = torch.rand(self.num_rels, 16)
+        # object 3 is not the subject of any relation
+        self.subj_inds = torch.randint(0, 3, (self.num_rels,))
+        self.subj_inds[:5] = torch.tensor([4, 5, 6, 6, 4])
+
+    def test_prepare_message(self):
+        msdn = MSDN_BASE(16, gate_width=8)
+        msdn_average = MSDN_BASE(16, gate_width=8, average_messages=True)
+        pred_inds = torch.arange(self.num_rels)
+        # the pairs do not need to be sorted
+        perm = torch.randperm(self.num_rels)
+        for gate in [msdn.gate_pred2sub, msdn.gate_pred2obj]:
+            # several messages per target, the loop keeps the first one
+            select_mat = _select_mat(self.subj_inds, self.num_objs, self.num_rels)
+            expected = legacy_prepare_message(self.obj_feats, self.pred_feats, select_mat, gate)
+            for result in [msdn.prepare_message_from_inds(self.obj_feats, self.pred_feats,
+                                                          self.subj_inds, pred_inds, gate),
+                           msdn.prepare_message_from_inds(self.obj_feats, self.pred_feats,
+                                                          self.subj_inds[perm], perm, gate),
+                           msdn.prepare_message(self.obj_feats, self.pred_feats,
+                                                select_mat, gate)]:
+                self.assertTrue(torch.allclose(result, expected, atol=1e-6))
+                self.assertTrue(torch.equal(result[3], torch.zeros(16)))
+
+            # or all of them are averaged
+            messages = gate(self.obj_feats[self.subj_inds], self.pred_feats)
+            expected = torch.mm(select_mat, messages) / select_mat.sum(1, keepdim=True).clamp(min=1)
+            for result in [msdn_average.prepare_message_from_inds(self.obj_feats, self.pred_feats,
+                                                                  self.subj_inds, pred_inds, gate),
+                           msdn_average.prepare_message(self.obj_feats, self.pred_feats,
+                                                        select_mat, gate)]:
+                self.assertTrue(torch.allclose(result, expected, atol=1e-6))
+                self.assertTrue(torch.equal(result[3], torch.zeros(16)))
+
+            # one message per target
+            select_mat = select_mat.t()
+            expected = legacy_prepare_message(self.pred_feats, self.obj_feats, select_mat, gate)
+            for m in [msdn, msdn_average]:
+                result = m.prepare_message_from_inds(self.pred_feats, self.obj_feats,
+                                                     pred_inds, self.subj_inds, gate)
+                self.assertTrue(torch.allclose(result, expected, atol=1e-6))
+
+            empty = torch.zeros(0, dtype=torch.int64)
+            for m in [msdn, msdn_average]:
+                result = m.prepare_message_from_inds(self.obj_feats, self.pred_feats,
+                                                     empty, empty, gate)
+                self.assertTrue(torch.equal(result, torch.zeros(self.num_objs, 16)))
+
+    def test_segment_mean(self):
+        select_mat = _select_mat(self.subj_inds, self.num_objs, self.num_rels)
+        expected = torch.mm(select_mat, self.pred_feats) / (select_mat.sum(1, keepdim=True) + 1e-5)
+        result = _segment_mean(self.pred_feats, self.subj_inds, self.num_objs)
+        self.assertTrue(torch.allclose(result, expected, atol=1e-6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ import unittest
 import numpy as np
 import torch
 from maskrcnn_benchmark.layers import nms as box_nms
+from maskrcnn_benchmark.layers import batched_nms
 
 
 class TestNMS(unittest.TestCase):
@@ -216,6 +217,39 @@ class TestNMS(unittest.TestCase):
 
         np.testing.assert_array_equal(keep_indices, gt_indices)
 
+    def test_batched_nms_cpu(self):
+        generator = torch.Generator().manual_seed(0)
+        # single nms call with offset boxes, and one nms call per group
+        # and group values too large for the offsets to be exact
+        for num_boxes, max_idx in [(0, 1), (300, 1), (3000, 1), (300, 2 ** 50)]:
+            xy = torch.rand(num_boxes, 2, generator=generator) * 400
+            wh = torch.rand(num_boxes, 2, generator=generator) * 100
+            boxes = torch.cat((xy, xy + wh), 1)
+            scores = torch.rand(num_boxes, generator=generator)
+            idxs = torch.randint(0, 20, (num_boxes,), generator=generator) * max_idx
+            keep = batched_nms(boxes, scores, idxs, 0.5)
+            for idx in range(0, 20 * max_idx, max_idx):
+                inds = (idxs == idx).nonzero(as_tuple=False).squeeze(1)
+                expected = inds[box_nms(boxes[inds], scores[inds], 0.5)]
+                keep_idx = keep[idxs[keep] == idx]
+                np.testing.assert_array_equal(np.sort(keep_idx.numpy()),
+                                              np.sort(expected.numpy()))
+
+    @unittest.skipIf(not torch.cuda.is_available(), "CUDA unavailable")
+    def test_batched_nms_cuda(self):
+        generator = torch.Generator().manual_seed(0)
+        # with 100000 groups, the float offset coordinates would round
+        for num_boxes, num_groups in [(300, 20), (300, 100000)]:
+            xy = torch.rand(num_boxes, 2, generator=generator) * 400
+            wh = torch.rand(num_boxes, 2, generator=generator) * 100
+            boxes = torch.cat((xy, xy + wh), 1)
+            scores = torch.rand(num_boxes, generator=generator)
+            idxs = torch.randint(0, num_groups, (num_boxes,), generator=generator)
+            # the float boxes are kept as float on the gpu
+            keep = batched_nms(boxes.cuda(), scores.cuda(), idxs.cuda(), 0.5).cpu()
+            expected = batched_nms(boxes, scores, idxs, 0.5)
+            np.testing.assert_array_equal(np.sort(keep.numpy()), np.sort(expected.numpy()))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,165 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import pickle
+import unittest
+
+import torch
+
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.bounding_box_pair import BoxPairList
+from maskrcnn_benchmark.structures.boxlist_ops import cat_boxlist
+from maskrcnn_benchmark.structures.boxlist_ops import cat_boxlist_with_fields
+from maskrcnn_benchmark.structures.packed_bounding_box import PackedBoxList
+from maskrcnn_benchmark.structures.packed_bounding_box import PackedBoxPairList
+from maskrcnn_benchmark.structures.packed_bounding_box import cat_packed_boxlist
+
+
+class FakeMask(object):
+    # a field which is not a tensor, like SegmentationMask
+    def __init__(self, ops=()):
+        self.ops = tuple(ops)
+
+    def resize(self, size, *args, **kwargs):
+        return FakeMask(self.ops + (('resize', size),))
+
+    def transpose(self, method):
+        return FakeMask(self.ops + (('transpose', method),))
+
+    def crop(self, box):
+        return FakeMask(self.ops + (('crop', tuple(box)),))
+
+    def __getitem__(self, item):
+        return self
+
+
+def _boxlist(num_boxes, box_cls=BoxList, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    box_dim = 4 if box_cls is BoxList else 8
+    xy = torch.rand(num_boxes, box_dim // 2, generator=generator) * 50
+    boxes = torch.cat((xy, xy + 20), 1)
+    if box_dim == 8:
+        boxes = boxes[:, [0, 1, 4, 5, 2, 3, 6, 7]]
+    boxlist = box_cls(boxes, (100, 80))
+    boxlist.add_field('labels', torch.randint(1, 10, (num_boxes,), generator=generator))
+    boxlist.add_field('scores', torch.rand(num_boxes, generator=generator))
+    boxlist.add_field('keep', torch.rand(num_boxes, generator=generator) > 0.5)
+    boxlist.add_field('scores_all', torch.rand(num_boxes, 5, generator=generator))
+    boxlist.add_field('boxes_all', torch.rand(num_boxes, 5, 4, generator=generator))
+    boxlist.add_field('attributes', torch.randint(0, 100, (num_boxes, 3),
+                                                  generator=generator, dtype=torch.int16))
+    boxlist.add_field('masks', FakeMask())
+    return boxlist
+
+
+class TestPackedBoxList(unittest.TestCase):
+    def assertSameBoxList(self, packed, boxlist):
+        self.assertEqual(len(packed), len(boxlist))
+        self.assertEqual(packed.size, boxlist.size)
+        self.assertEqual(packed.mode, boxlist.mode)
+        self.assertEqual(packed.fields(), boxlist.fields())
+        self.assertTrue(torch.equal(packed.bbox, boxlist.bbox))
+        for field in boxlist.fields():
+            expected, result = boxlist.get_field(field), packed.get_field(field)
+            if isinstance(expected, torch.Tensor):
+                self.assertEqual(result.dtype, expected.dtype, field)
+                self.assertTrue(torch.equal(result, expected), field)
+            else:
+                self.assertEqual(result.ops, expected.ops, field)
+
+    def test_same_as_boxlist(self):
+        for box_cls, packed_cls in [(BoxList, PackedBoxList),
+                                    (BoxPairList, PackedBoxPairList)]:
+            boxlist = _boxlist(7, box_cls)
+            packed = packed_cls.from_boxlist(boxlist)
+            self.assertIsInstance(packed, box_cls)
+            self.assertSameBoxList(packed, boxlist)
+            keep = boxlist.get_field('keep')
+            for item in [slice(2, 5), slice(None, None, 2), keep,
+                         keep.nonzero().view(-1), torch.tensor([3, 3, 0])]:
+                self.assertSameBoxList(packed[item], boxlist[item])
+            self.assertSameBoxList(packed.to('cpu'), boxlist.to('cpu'))
+            self.assertSameBoxList(packed.copy_with_fields(['scores', 'labels']),
+                                   boxlist.copy_with_fields(['scores', 'labels']))
+            self.assertSameBoxList(packed.resize((50, 40)), boxlist.resize((50, 40)))
+            self.assertSameBoxList(packed.to_boxlist(), boxlist)
+            self.assertSameBoxList(pickle.loads(pickle.dumps(packed)), boxlist)
+            with self.assertRaises(ValueError):
+                packed[0]
+        boxlist = _boxlist(7)
+        packed = PackedBoxList.from_boxlist(boxlist)
+        self.assertSameBoxList(packed.resize((50, 60)), boxlist.resize((50, 60)))
+        self.assertSameBoxList(packed.convert('xywh'), boxlist.convert('xywh'))
+        self.assertSameBoxList(packed.transpose(0), boxlist.transpose(0))
+        self.assertSameBoxList(packed.crop([10, 10, 60, 50]), boxlist.crop([10, 10, 60, 50]))
+        keep = boxlist.get_field('keep')
+        self.assertSameBoxList(packed[keep].clip_to_image(), boxlist[keep].clip_to_image())
+        self.assertTrue(torch.equal(packed.area(), boxlist.area()))
+
+    def test_views(self):
+        packed = PackedBoxList.from_boxlist(_boxlist(6))
+        view = packed[1:4]
+        view.get_field('scores')[0] = -1
+        self.assertEqual(float(packed.get_field('scores')[1]), -1)
+
+        # a new field is only packed into the list it is added to
+        view.add_field('scores', torch.zeros(3))
+        view.add_field('ids', torch.arange(3))
+        self.assertEqual(float(packed.get_field('scores')[1]), -1)
+        self.assertFalse(packed.has_field('ids'))
+        self.assertTrue(torch.equal(view[1:].get_field('scores'), torch.zeros(2)))
+        self.assertTrue(torch.equal(view[1:].get_field('ids'), torch.tensor([1, 2])))
+
+        # fields which are not packed
+        scores = torch.rand(6, requires_grad=True)
+        relation_labels = torch.tensor([[0, 1, 2]])
+        packed.add_field('logits', scores * 2)
+        packed.add_field('relation_labels', relation_labels)
+        self.assertTrue(packed[:3].get_field('logits').requires_grad)
+        self.assertIs(packed.to('cpu').get_field('relation_labels'), relation_labels)
+
+    def test_extra_fields(self):
+        boxlist = _boxlist(6)
+        packed = PackedBoxList.from_boxlist(boxlist)
+        self.assertEqual(list(packed.extra_fields), boxlist.fields())
+        packed = packed[1:4]
+        self.assertTrue(torch.equal(packed.extra_fields['scores'],
+                                    boxlist.get_field('scores')[1:4]))
+
+        # writes go through the list, packed fields included
+        packed.extra_fields['scores'] = torch.zeros(3)
+        packed.extra_fields['ids'] = torch.arange(3)
+        del packed.extra_fields['labels']
+        self.assertTrue(packed.has_field('ids'))
+        self.assertFalse(packed.has_field('labels'))
+        self.assertNotIn('labels', packed[1:].fields())
+        self.assertTrue(torch.equal(packed[1:].get_field('scores'), torch.zeros(2)))
+        self.assertTrue(torch.equal(packed[1:].get_field('ids'), torch.tensor([1, 2])))
+        with self.assertRaises(KeyError):
+            del packed.extra_fields['labels']
+
+        packed.extra_fields = {'scores': torch.ones(3)}
+        self.assertEqual(packed.fields(), ['scores'])
+        self.assertTrue(torch.equal(packed[:2].get_field('scores'), torch.ones(2)))
+
+    def test_cat(self):
+        fields = ['labels', 'scores', 'scores_all', 'boxes_all', 'attributes']
+        boxlists = [_boxlist(n, seed=n).copy_with_fields(fields) for n in [3, 0, 5]]
+        expected = cat_boxlist(boxlists)
+        packed = [PackedBoxList.from_boxlist(boxlist) for boxlist in boxlists]
+        for boxlist in [cat_boxlist(packed), cat_packed_boxlist(packed),
+                        cat_boxlist([packed[0][:2], packed[0][2:]] + packed[1:])]:
+            self.assertIsInstance(boxlist, PackedBoxList)
+            self.assertTrue(torch.equal(boxlist.bbox, expected.bbox))
+            self.assertEqual(sorted(boxlist.fields()), sorted(fields))
+            for field in fields:
+                self.assertTrue(torch.equal(boxlist.get_field(field),
+                                            expected.get_field(field)), field)
+        # lists packed differently
+        packed[1].add_field('labels', packed[1].get_field('labels').clone())
+        result = cat_boxlist_with_fields(packed, ['labels', 'scores'])
+        self.assertTrue(torch.equal(result.bbox, expected.bbox))
+        self.assertTrue(torch.equal(result.get_field('labels'), expected.get_field('labels')))
+        self.assertEqual(sorted(result.fields()), ['labels', 'scores'])
+
+
+if __name__ == "__main__":
+    unittest.main()
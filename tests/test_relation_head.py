@@ -0,0 +1,84 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import torch
+
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.boxlist_ops import boxlist_iou
+from scene_graph_benchmark.relation_head.relation_head import get_proposal_pairs
+
+
+# the N x N grid implementation the pair generator must agree with.
+def legacy_get_proposal_pairs(proposals_per_image, filter_non_overlap):
+    box_subj = proposals_per_image.bbox
+    box_obj = proposals_per_image.bbox
+
+    box_subj = box_subj.unsqueeze(1).repeat(1, box_subj.shape[0], 1)
+    box_obj = box_obj.unsqueeze(0).repeat(box_obj.shape[0], 1, 1)
+    proposal_box_pairs = torch.cat(
+        (box_subj.view(-1, 4), box_obj.view(-1, 4)), 1)
+
+    idx_subj = torch.arange(box_subj.shape[0]).view(-1, 1, 1).repeat(1, box_obj.shape[0], 1)
+    idx_obj = torch.arange(box_obj.shape[0]).view(1, -1, 1).repeat(box_subj.shape[0], 1, 1)
+    proposal_idx_pairs = torch.cat((idx_subj.view(-1, 1), idx_obj.view(-1, 1)), 1)
+
+    label_subj = proposals_per_image.get_field('labels')[idx_subj]
+    label_obj = proposals_per_image.get_field('labels')[idx_obj]
+    proposal_label_pairs = torch.cat(
+        (label_subj.view(-1, 1), label_obj.view(-1, 1)), 1)
+
+    keep_idx = (proposal_idx_pairs[:, 0] != proposal_idx_pairs[:, 1]).nonzero(as_tuple=False).view(-1)
+
+    if filter_non_overlap:
+        ious = boxlist_iou(proposals_per_image, proposals_per_image).view(-1)
+        ious = ious[keep_idx]
+        keep_idx = keep_idx[(ious > 0).nonzero(as_tuple=False).view(-1)]
+    return (proposal_box_pairs[keep_idx], proposal_idx_pairs[keep_idx],
+            proposal_label_pairs[keep_idx])
+
+
+def _random_proposals(num_boxes, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    xy = torch.randint(0, 200, (num_boxes, 2), generator=generator).float()
+    wh = torch.randint(1, 60, (num_boxes, 2), generator=generator).float()
+    proposals = BoxList(torch.cat((xy, xy + wh), 1), (300, 300))
+    proposals.add_field('labels', torch.randint(1, 151, (num_boxes,), generator=generator))
+    proposals.add_field('scores', torch.rand(num_boxes, generator=generator))
+    return proposals
+
+
+class TestProposalPairs(unittest.TestCase):
+    def test_same_as_legacy(self):
+        for num_boxes in [0, 1, 2, 7, 64]:
+            proposals = _random_proposals(num_boxes, seed=num_boxes)
+            for filter_non_overlap in [False, True]:
+                pairs = get_proposal_pairs(proposals, filter_non_overlap)
+                expected = legacy_get_proposal_pairs(proposals, filter_non_overlap)
+                for result, expected_value in zip(
+                        (pairs.bbox, pairs.get_field('idx_pairs'), pairs.get_field('label_pairs')),
+                        expected):
+                    self.assertEqual(result.shape, expected_value.shape)
+                    self.assertEqual(result.dtype, expected_value.dtype)
+                    self.assertTrue(torch.equal(result, expected_value))
+
+    def test_max_pairs(self):
+        proposals = _random_proposals(30)
+        scores = proposals.get_field('scores')
+        for filter_non_overlap in [False, True]:
+            all_pairs = get_proposal_pairs(proposals, filter_non_overlap).get_field('idx_pairs')
+            for max_pairs in [1, 50, len(all_pairs) + 1]:
+                pairs = get_proposal_pairs(proposals, filter_non_overlap, max_pairs)
+                idx_pairs = pairs.get_field('idx_pairs')
+                self.assertEqual(len(idx_pairs), min(max_pairs, len(all_pairs)))
+                # the kept pairs are the best ones, in the order of all pairs
+                all_scores = scores[all_pairs[:, 0]] * scores[all_pairs[:, 1]]
+                pair_scores = scores[idx_pairs[:, 0]] * scores[idx_pairs[:, 1]]
+                self.assertTrue(torch.equal(pair_scores.sort(descending=True)[0],
+                                            all_scores.sort(descending=True)[0][:len(idx_pairs)]))
+                keys = idx_pairs[:, 0] * len(proposals) + idx_pairs[:, 1]
+                self.assertTrue((keys[1:] > keys[:-1]).all())
+                self.assertTrue(torch.equal(pairs.bbox[:, :4], proposals.bbox[idx_pairs[:, 0]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
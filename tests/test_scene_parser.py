@@ -0,0 +1,128 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import numpy as np
+import torch
+
+from maskrcnn_benchmark.config import cfg
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.bounding_box_pair import BoxPairList
+from scene_graph_benchmark.config import sg_cfg
+from scene_graph_benchmark.scene_parser import SceneParser
+
+
+# the per-image implementations the batched ones must agree with.
+def legacy_post_processing_constrained(cfg, result_obj, result_pred):
+    result_obj_new, result_pred_new = [], []
+    for result_obj_i, result_pred_i in zip(result_obj, result_pred):
+        obj_scores = result_obj_i.get_field("scores")
+        rel_inds = result_pred_i.get_field("idx_pairs")
+        pred_scores = result_pred_i.get_field("scores")
+        scores = torch.stack((
+            obj_scores[rel_inds[:,0]],
+            obj_scores[rel_inds[:,1]],
+            pred_scores[:,1:].max(1)[0]
+        ), 1).prod(1)
+        scores_sorted, order = scores.sort(0, descending=True)
+        result_pred_i = result_pred_i[order[:cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG]]
+        result_obj_new.append(result_obj_i)
+
+        result_pred_i.add_field('labels', result_pred_i.get_field("scores")[:, 1:].argmax(dim=1))
+        result_pred_i.add_field('scores_all', result_pred_i.get_field('scores'))
+        result_pred_i.add_field('scores', scores[order[:cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG]])
+        inds = result_pred_i.get_field('scores') > cfg.MODEL.ROI_RELATION_HEAD.POSTPROCESS_SCORE_THRESH
+        result_pred_i = result_pred_i[inds]
+
+        result_pred_new.append(result_pred_i)
+    return result_obj_new, result_pred_new
+
+
+def argsort_desc(scores):
+    return np.column_stack(np.unravel_index(np.argsort(-scores.ravel()), scores.shape))
+
+
+def legacy_post_processing_unconstrained(cfg, result_obj, result_pred):
+    result_obj_new, result_pred_new = [], []
+    for result_obj_i, result_pred_i in zip(result_obj, result_pred):
+        obj_scores = result_obj_i.get_field("scores").cpu().numpy()
+        rel_inds = result_pred_i.get_field("idx_pairs").cpu().numpy()
+        pred_scores = result_pred_i.get_field("scores").cpu().numpy()[:, 1:]
+
+        det_labels_prd = np.argsort(-pred_scores, axis=1)
+        det_scores_prd = -np.sort(-pred_scores, axis=1)
+
+        det_scores_so = obj_scores[rel_inds[:,0]] * obj_scores[rel_inds[:,1]]
+        det_scores_spo = det_scores_so[:, None] * det_scores_prd[:, :2]
+
+        det_scores_inds = argsort_desc(det_scores_spo)[:cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG]
+
+        result_labels = det_labels_prd[det_scores_inds[:, 0], det_scores_inds[:, 1]]
+
+        result_pred_i = result_pred_i[det_scores_inds[:, 0]]
+        result_pred_i.add_field('labels', torch.from_numpy(result_labels))
+        result_pred_i.add_field('scores_all', result_pred_i.get_field('scores'))
+        result_pred_i.add_field('scores', torch.from_numpy(det_scores_spo[det_scores_inds[:, 0], det_scores_inds[:, 1]]))
+        inds = result_pred_i.get_field('scores') > cfg.MODEL.ROI_RELATION_HEAD.POSTPROCESS_SCORE_THRESH
+        result_pred_i = result_pred_i[inds]
+
+        result_obj_new.append(result_obj_i)
+        result_pred_new.append(result_pred_i)
+    return result_obj_new, result_pred_new
+
+
+def _random_predictions(rng, num_images, num_predicates=51):
+    result_obj, result_pred = [], []
+    for _ in range(num_images):
+        num_boxes = rng.randint(0, 20)
+        boxes = torch.from_numpy(rng.rand(num_boxes, 4).astype(np.float32)).cumsum(1)
+        result_obj_i = BoxList(boxes, (100, 100))
+        # some scores are 0 so that the threshold filters their triplets
+        obj_scores = rng.rand(num_boxes).astype(np.float32) * (rng.rand(num_boxes) > 0.1)
+        result_obj_i.add_field('scores', torch.from_numpy(obj_scores))
+        pairs = np.array([[s, o] for s in range(num_boxes) for o in range(num_boxes) if s != o],
+                         dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[rng.rand(len(pairs)) < 0.5]
+        result_pred_i = BoxPairList(torch.zeros(len(pairs), 8), (100, 100))
+        result_pred_i.add_field('idx_pairs', torch.from_numpy(pairs))
+        result_pred_i.add_field('scores', torch.from_numpy(
+            rng.rand(len(pairs), num_predicates).astype(np.float32)).softmax(1))
+        result_obj.append(result_obj_i)
+        result_pred.append(result_pred_i)
+    return result_obj, result_pred
+
+
+class TestPostProcessing(unittest.TestCase):
+    def setUp(self):
+        self.cfg = cfg.clone()
+        self.cfg.set_new_allowed(True)
+        self.cfg.merge_from_other_cfg(sg_cfg)
+        self.cfg.MODEL.ROI_RELATION_HEAD.TRIPLETS_PER_IMG = 30
+        # the post-processing only depends on cfg
+        self.parser = SceneParser.__new__(SceneParser)
+        self.parser.cfg = self.cfg
+
+    def _check_same(self, post_processing, legacy_post_processing):
+        rng = np.random.RandomState(0)
+        for num_images in [1, 4, 9]:
+            result_obj, result_pred = _random_predictions(rng, num_images)
+            result = post_processing(result_obj, result_pred)
+            expected = legacy_post_processing(self.cfg, result_obj, result_pred)
+            self.assertEqual(result[0], expected[0])
+            for result_pred_i, expected_pred_i in zip(result[1], expected[1]):
+                self.assertEqual(result_pred_i.fields(), expected_pred_i.fields())
+                for field in expected_pred_i.fields():
+                    value, expected_value = result_pred_i.get_field(field), expected_pred_i.get_field(field)
+                    self.assertEqual(value.dtype, expected_value.dtype, field)
+                    self.assertTrue(torch.equal(value, expected_value), field)
+
+    def test_constrained(self):
+        self._check_same(self.parser._post_processing_constrained,
+                         legacy_post_processing_constrained)
+
+    def test_unconstrained(self):
+        self._check_same(self.parser._post_processing_unconstrained,
+                         legacy_post_processing_unconstrained)
+
+
+if __name__ == "__main__":
+    unittest.main()
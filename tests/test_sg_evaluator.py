@@ -0,0 +1,120 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import numpy as np
+import torch
+
+from maskrcnn_benchmark.data.datasets.evaluation.sg import evaluator
+from maskrcnn_benchmark.data.datasets.evaluation.sg.box import bbox_overlaps
+from maskrcnn_benchmark.data.datasets.evaluation.sg.evaluator import BasicSceneGraphEvaluator
+from utils import random_boxes
+
+
+# the per-GT implementation the vectorized one must agree with.
+def legacy_compute_pred_matches(gt_triplets, pred_triplets,
+                                gt_boxes, pred_boxes, iou_thresh, phrdet=False):
+    keeps = evaluator.intersect_2d(gt_triplets, pred_triplets)
+    gt_has_match = keeps.any(1)
+    pred_to_gt = [[] for x in range(pred_boxes.shape[0])]
+    for gt_ind, gt_box, keep_inds in zip(np.where(gt_has_match)[0],
+                                         gt_boxes[gt_has_match],
+                                         keeps[gt_has_match],
+                                         ):
+        boxes = pred_boxes[keep_inds]
+        if phrdet:
+            gt_box_union = gt_box.reshape((2, 4))
+            gt_box_union = np.concatenate((gt_box_union.min(0)[:2], gt_box_union.max(0)[2:]), 0)
+
+            box_union = boxes.reshape((-1, 2, 4))
+            box_union = np.concatenate((box_union.min(1)[:, :2], box_union.max(1)[:, 2:]), 1)
+
+            inds = bbox_overlaps(torch.from_numpy(gt_box_union[None]),
+                                 torch.from_numpy(box_union)).numpy() >= iou_thresh
+
+        else:
+            sub_iou = bbox_overlaps(torch.from_numpy(gt_box[None, :4]).contiguous(),
+                                    torch.from_numpy(boxes[:, :4]).contiguous()).numpy()[0]
+            obj_iou = bbox_overlaps(torch.from_numpy(gt_box[None, 4:]).contiguous(),
+                                    torch.from_numpy(boxes[:, 4:]).contiguous()).numpy()[0]
+
+            inds = (sub_iou >= iou_thresh) & (obj_iou >= iou_thresh)
+
+        for i in np.where(keep_inds)[0][inds.reshape(-1)]:
+            pred_to_gt[i].append(int(gt_ind))
+    return pred_to_gt
+
+
+def _random_entries(rng, num_classes=4, num_predicates=3):
+    num_gt_boxes = rng.randint(2, 8)
+    gt_boxes = random_boxes(rng, num_gt_boxes)
+    gt_classes = rng.randint(1, num_classes, size=num_gt_boxes)
+    gt_pairs = np.array([[s, o] for s in range(num_gt_boxes) for o in range(num_gt_boxes) if s != o])
+    gt_pairs = gt_pairs[rng.choice(len(gt_pairs), rng.randint(1, 6))]
+    gt_rels = np.column_stack((gt_pairs, rng.randint(1, num_predicates + 1, size=len(gt_pairs))))
+
+    # predictions are jittered copies of the gt boxes plus random ones, so
+    # that some of them match.
+    num_boxes = num_gt_boxes + rng.randint(0, 6)
+    boxes = random_boxes(rng, num_boxes)
+    boxes[:num_gt_boxes] = gt_boxes + rng.randint(-3, 4, size=(num_gt_boxes, 4))
+    labels = rng.randint(1, num_classes, size=num_boxes)
+    labels[:num_gt_boxes] = np.where(rng.rand(num_gt_boxes) < 0.7, gt_classes, labels[:num_gt_boxes])
+    # in sgcls and predcls, the predictions refer to the gt boxes
+    num_pred_boxes = num_gt_boxes if rng.rand() < 0.5 else num_boxes
+    pairs = np.array([[s, o] for s in range(num_pred_boxes) for o in range(num_pred_boxes) if s != o])
+    pairs = pairs[rng.rand(len(pairs)) < 0.6].reshape(-1, 2)
+    gt_entry = {
+        'gt_classes': gt_classes,
+        'gt_relations': gt_rels,
+        'gt_boxes': gt_boxes,
+    }
+    pred_entry = {
+        'pred_boxes': boxes[:num_pred_boxes],
+        'pred_classes': labels[:num_pred_boxes],
+        'obj_scores': rng.rand(num_pred_boxes).astype(np.float32),
+        'pred_rel_inds': pairs,
+        'rel_scores': rng.rand(len(pairs), num_predicates + 1).astype(np.float32),
+    }
+    return gt_entry, pred_entry, num_pred_boxes == num_gt_boxes
+
+
+class TestBasicSceneGraphEvaluator(unittest.TestCase):
+    def test_compute_pred_matches(self):
+        rng = np.random.RandomState(0)
+        for phrdet in [False, True]:
+            for _ in range(30):
+                num_gt, num_pred = rng.randint(1, 12), rng.randint(0, 40)
+                gt_triplets = rng.randint(0, 3, size=(num_gt, 3))
+                pred_triplets = rng.randint(0, 3, size=(num_pred, 3))
+                gt_boxes = np.hstack((random_boxes(rng, num_gt), random_boxes(rng, num_gt)))
+                pred_boxes = np.hstack((random_boxes(rng, num_pred), random_boxes(rng, num_pred)))
+                pred_boxes[:min(num_gt, num_pred)] = gt_boxes[:min(num_gt, num_pred)]
+                args = (gt_triplets, pred_triplets, gt_boxes.astype(float),
+                        pred_boxes.astype(float), 0.5)
+                self.assertEqual(evaluator._compute_pred_matches(*args, phrdet=phrdet),
+                                 legacy_compute_pred_matches(*args, phrdet=phrdet))
+
+    def test_batch_same_as_single(self):
+        rng = np.random.RandomState(0)
+        entries = [_random_entries(rng) for _ in range(40)]
+        for mode in ['sgdet', 'phrdet', 'sgcls', 'predcls', 'preddet']:
+            # sgcls and predcls evaluate the predictions on the gt boxes
+            mode_entries = [(gt, pred) for gt, pred, on_gt_boxes in entries
+                            if on_gt_boxes or mode not in ('sgcls', 'predcls')]
+            gt_entries = [gt for gt, _ in mode_entries]
+            pred_entries = [pred for _, pred in mode_entries]
+            for multiple_preds in [False, True]:
+                expected = BasicSceneGraphEvaluator(mode, multiple_preds=multiple_preds)
+                for gt_entry, pred_entry in mode_entries:
+                    expected.evaluate_scene_graph_entry(gt_entry, pred_entry)
+                for batch_size, num_threads in [(1, 0), (7, 0), (64, 0), (5, 3)]:
+                    result = BasicSceneGraphEvaluator(mode, multiple_preds=multiple_preds)
+                    result.evaluate_scene_graph_entries(gt_entries, pred_entries,
+                                                        batch_size=batch_size,
+                                                        num_threads=num_threads)
+                    self.assertEqual(result.result_dict, expected.result_dict,
+                                     (mode, multiple_preds, batch_size, num_threads))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,287 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import logging
+import os.path as op
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import numpy as np
+import torch
+
+from maskrcnn_benchmark.data.datasets.evaluation.sg import sg_tsv_eval
+from maskrcnn_benchmark.engine.inference import convert_predictions_to_tsv
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.tsv_file_ops import tsv_reader, tsv_writer
+from maskrcnn_benchmark.structures.tsv_file import TSVFile
+from maskrcnn_benchmark.data.datasets.evaluation.sg.sg_tsv_eval import iou
+from scene_graph_benchmark.scene_parser import SceneParserOutputs
+from utils import random_boxes
+
+
+# the per-triplet implementations the vectorized ones must agree with.
+def legacy_triplet(predicates, relations, classes, boxes,
+                   predicate_scores, class_scores, is_pred=False):
+    # gt predicates and classes come as (N, 1) arrays, which NumPy >= 2 no
+    # longer assigns to a single element.
+    predicates, classes = np.ravel(predicates), np.ravel(classes)
+    num_relations = relations.shape[0]
+    triplets = np.zeros([num_relations, 3]).astype(np.int32)
+    triplet_boxes = np.zeros([num_relations, 8]).astype(np.int32)
+    triplet_scores = np.zeros([num_relations]).astype(np.float32)
+    for i in range(num_relations):
+        triplets[i, 1] = predicates[i]
+        sub_i, obj_i = relations[i, :2]
+        triplets[i, 0] = classes[sub_i]
+        triplets[i, 2] = classes[obj_i]
+        triplet_boxes[i, :4] = boxes[sub_i, :]
+        triplet_boxes[i, 4:] = boxes[obj_i, :]
+        score = class_scores[sub_i]
+        score *= class_scores[obj_i]
+        score *= predicate_scores[i]
+        triplet_scores[i] = score
+    return triplets, triplet_boxes, triplet_scores
+
+
+def legacy_recall(gt_triplets, pred_triplets, gt_boxes, pred_boxes, iou_thresh,
+                  columns, use_obj_box):
+    num_correct_pred_gt = 0
+    for gt, gt_box in zip(gt_triplets, gt_boxes):
+        keep = np.zeros(pred_triplets.shape[0]).astype(bool)
+        for i, pred in enumerate(pred_triplets):
+            if all(gt[c] == pred[c] for c in columns):
+                keep[i] = True
+        if not np.any(keep):
+            continue
+        boxes = pred_boxes[keep, :]
+        inds = np.where(iou(gt_box[:4], boxes[:, :4]) >= iou_thresh)[0]
+        if use_obj_box:
+            inds = np.intersect1d(inds, np.where(iou(gt_box[4:], boxes[:, 4:]) >= iou_thresh)[0])
+        if inds.size > 0:
+            num_correct_pred_gt += 1
+    return float(num_correct_pred_gt)
+
+
+def legacy_relation_recall(*args):
+    return legacy_recall(*args, columns=[0, 1, 2], use_obj_box=True)
+
+
+def _random_image(rng, num_classes=4, num_predicates=3):
+    num_gt_boxes = rng.randint(2, 8)
+    gt_boxes = torch.from_numpy(random_boxes(rng, num_gt_boxes))
+    gt_classes = torch.from_numpy(rng.randint(1, num_classes, size=num_gt_boxes))
+    gt_rels = torch.zeros(num_gt_boxes, num_gt_boxes, dtype=torch.int64)
+    for _ in range(rng.randint(0, 6)):
+        s, o = rng.choice(num_gt_boxes, 2, replace=False)
+        gt_rels[s, o] = rng.randint(1, num_predicates + 1)
+
+    # predictions are jittered copies of the gt boxes plus random ones, so
+    # that some of them match.
+    num_boxes = num_gt_boxes + rng.randint(0, 6)
+    boxes = random_boxes(rng, num_boxes)
+    boxes[:num_gt_boxes] = gt_boxes.numpy() + rng.randint(-3, 4, size=(num_gt_boxes, 4))
+    labels = rng.randint(1, num_classes, size=num_boxes)
+    labels[:num_gt_boxes] = np.where(rng.rand(num_gt_boxes) < 0.7,
+                                     gt_classes.numpy(), labels[:num_gt_boxes])
+    pairs = np.array([[s, o] for s in range(num_boxes) for o in range(num_boxes) if s != o])
+    pairs = pairs[rng.rand(len(pairs)) < 0.6]
+    return {
+        'gt_classes': gt_classes,
+        'gt_boxes': gt_boxes,
+        'gt_rels': gt_rels,
+        'obj_rois': torch.from_numpy(boxes),
+        'obj_scores': torch.from_numpy(rng.rand(num_boxes).astype(np.float32)),
+        'obj_labels': torch.from_numpy(labels),
+        'rel_inds': torch.from_numpy(pairs).view(-1, 2),
+        'rel_scores': torch.from_numpy(rng.rand(len(pairs), num_predicates + 1).astype(np.float32)),
+    }
+
+
+def _relation_labels(pred_labels):
+    pairs = pred_labels.nonzero()
+    return torch.cat((pairs, pred_labels[pairs[:, 0], pairs[:, 1]].view(-1, 1)), 1)
+
+
+class FakeDataset(object):
+    ind_to_class = {i: 'class_{}'.format(i) for i in range(4)}
+    ind_to_relation = {i: 'predicate_{}'.format(i) for i in range(4)}
+    labelmap = {
+        'class_to_ind': {v: k for k, v in ind_to_class.items()},
+        'relation_to_ind': {v: k for k, v in ind_to_relation.items()},
+    }
+
+    def __init__(self, images):
+        self.images = images
+
+    def __len__(self):
+        return len(self.images)
+
+    def get_img_key(self, idx):
+        return 'img_{}'.format(idx)
+
+    def get_img_info(self, idx):
+        return {'width': 100, 'height': 100}
+
+    def get_groundtruth(self, idx):
+        image = self.images[idx]
+        target = BoxList(image['gt_boxes'], (100, 100))
+        target.add_field('labels', image['gt_classes'])
+        target.add_field('relation_labels', _relation_labels(image['gt_rels']))
+        return target
+
+
+def _scene_parser_outputs(image):
+    prediction = BoxList(image['obj_rois'], (100, 100))
+    prediction.add_field('scores', image['obj_scores'])
+    prediction.add_field('labels', image['obj_labels'])
+    prediction_pairs = BoxList(torch.zeros(len(image['rel_inds']), 4), (100, 100))
+    prediction_pairs.add_field('idx_pairs', image['rel_inds'])
+    prediction_pairs.add_field('scores', image['rel_scores'][:, 1:].max(1)[0])
+    prediction_pairs.add_field('labels', image['rel_scores'][:, 1:].argmax(1))
+    prediction_pairs.add_field('scores_all', image['rel_scores'])
+    return SceneParserOutputs(prediction, prediction_pairs)
+
+
+def _sg_eval_inputs(rng, output_folder, num_images=17):
+    # like the evaluated splits, all images have relations
+    images = [_random_image(rng) for _ in range(2 * num_images)]
+    dataset = FakeDataset([image for image in images if image['gt_rels'].any()][:num_images])
+    # the last image has no prediction
+    predictions = {idx: _scene_parser_outputs(image)
+                   for idx, image in enumerate(dataset.images[:-1])}
+    convert_predictions_to_tsv(
+        predictions, dataset, output_folder, labelmap_file='', relation_on=True,
+        data_subset=['rect', 'class', 'conf', 'relations', 'relation_scores',
+                     'relation_scores_all'])
+    return dataset, predictions
+
+
+class TestSGTSVEval(unittest.TestCase):
+    def test_triplet(self):
+        rng = np.random.RandomState(0)
+        for _ in range(20):
+            num_boxes, num_relations = rng.randint(1, 10), rng.randint(0, 30)
+            boxes = random_boxes(rng, num_boxes) + rng.rand(num_boxes, 4).astype(np.float32)
+            classes = rng.randint(0, 5, size=num_boxes)
+            class_scores = rng.rand(num_boxes).astype(np.float32)
+            relations = rng.randint(0, num_boxes, size=(num_relations, 2))
+            predicates = rng.randint(1, 4, size=num_relations)
+            predicate_scores = rng.rand(num_relations).astype(np.float32)
+            args = (predicates, relations, classes, boxes, predicate_scores, class_scores)
+            for result, expected in zip(sg_tsv_eval._triplet(*args), legacy_triplet(*args)):
+                self.assertEqual(result.dtype, expected.dtype)
+                np.testing.assert_array_equal(result, expected)
+
+    def test_recall(self):
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            num_gt, num_pred = rng.randint(1, 12), rng.randint(0, 40)
+            gt_triplets = rng.randint(0, 3, size=(num_gt, 3))
+            pred_triplets = rng.randint(0, 3, size=(num_pred, 3))
+            gt_boxes = np.hstack((random_boxes(rng, num_gt), random_boxes(rng, num_gt)))
+            pred_boxes = np.hstack((random_boxes(rng, num_pred), random_boxes(rng, num_pred)))
+            pred_boxes[:min(num_gt, num_pred)] = gt_boxes[:min(num_gt, num_pred)]
+            gt_boxes, pred_boxes = gt_boxes.astype(np.int32), pred_boxes.astype(np.int32)
+            args = (gt_triplets, pred_triplets, gt_boxes, pred_boxes, 0.5)
+            self.assertEqual(sg_tsv_eval._relation_recall(*args),
+                             legacy_recall(*args, columns=[0, 1, 2], use_obj_box=True))
+            self.assertEqual(sg_tsv_eval._object_recall(*args),
+                             legacy_recall(*args, columns=[0], use_obj_box=False))
+            self.assertEqual(sg_tsv_eval._predicate_recall(*args),
+                             legacy_recall(*args, columns=[1], use_obj_box=True))
+
+    def test_evaluate(self):
+        rng = np.random.RandomState(0)
+        images = [_random_image(rng) for _ in range(30)]
+
+        def run(get_relation_labels=_relation_labels):
+            result_dict = {'sgdet_recall': {20: [], 50: [], 100: []}}
+            for image in images:
+                image = dict(image, gt_rels=get_relation_labels(image['gt_rels']))
+                sg_tsv_eval.evaluate(top_Ns=[20, 50, 100], result_dict=result_dict,
+                                     mode='sgdet', **image)
+            return result_dict
+
+        def shuffled_with_duplicates(pred_labels):
+            # earlier triplets of a pair are overwritten by later ones
+            relation_labels = _relation_labels(pred_labels)
+            overwritten = relation_labels.clone()
+            overwritten[:, 2] = overwritten[:, 2] % 3 + 1
+            perm = torch.from_numpy(rng.permutation(len(relation_labels)))
+            return torch.cat((overwritten, relation_labels[perm]))
+
+        with mock.patch.object(sg_tsv_eval, '_triplet', legacy_triplet), \
+                mock.patch.object(sg_tsv_eval, '_relation_recall', legacy_relation_recall):
+            expected = run()
+        result = run()
+        self.assertGreater(sum(expected['sgdet_recall'][100]), 0)
+        self.assertEqual(result, expected)
+        self.assertEqual(run(shuffled_with_duplicates), expected)
+
+    def test_do_sg_evaluation_workers(self):
+        logger = logging.getLogger(__name__)
+        with TemporaryDirectory() as d:
+            dataset, predictions = _sg_eval_inputs(np.random.RandomState(0), d)
+            expected = sg_tsv_eval.do_sg_evaluation(dataset, None, d, logger)
+            for num_workers, num_threads in [(2, 0), (3, 0), (0, 2), (2, 2)]:
+                result = sg_tsv_eval.do_sg_evaluation(dataset, None, d, logger,
+                                                      num_workers=num_workers,
+                                                      num_threads=num_threads)
+                self.assertEqual(result, expected)
+        self.assertGreater(expected['rowan_metric']['sgdet100'], 0)
+
+    def test_do_sg_evaluation_in_memory(self):
+        logger = logging.getLogger(__name__)
+        with TemporaryDirectory() as d:
+            dataset, predictions = _sg_eval_inputs(np.random.RandomState(1), d)
+            expected = sg_tsv_eval.do_sg_evaluation(dataset, None, d, logger)
+            for num_workers in [0, 2]:
+                result = sg_tsv_eval.do_sg_evaluation(dataset, predictions, d, logger,
+                                                      num_workers=num_workers)
+                self.assertEqual(result, expected)
+            # predictions.tsv is not read
+            self.assertEqual(sg_tsv_eval.do_sg_evaluation(dataset, predictions, 'missing', logger),
+                             expected)
+        self.assertGreater(expected['rowan_metric']['sgdet100'], 0)
+
+    def test_evaluate_images_chunks(self):
+        with TemporaryDirectory() as d:
+            dataset, _ = _sg_eval_inputs(np.random.RandomState(2), d)
+            args = (dataset, None, op.join(d, 'predictions.tsv'), range(len(dataset)),
+                    'sgdet', [20, 50, 100])
+            self.assertEqual(sg_tsv_eval.evaluate_images(*args, chunk_size=4),
+                             sg_tsv_eval.evaluate_images(*args))
+
+    def test_iter_vrd_predictions(self):
+        with TemporaryDirectory() as d:
+            dataset, _ = _sg_eval_inputs(np.random.RandomState(3), d)
+            tsv_file = op.join(d, 'predictions.tsv')
+            expected = sg_tsv_eval.prepare_vrd_predictions(tsv_file, dataset.labelmap)
+            image_keys = [dataset.get_img_key(idx) for idx in range(len(dataset))]
+            # in order, a subset, and rows which are not in the order of the keys
+            rows = list(tsv_reader(tsv_file))
+            shuffled_file = op.join(d, 'shuffled.tsv')
+            tsv_writer(rows[5:] + rows[:5], shuffled_file)
+            for tsv, keys in [(tsv_file, image_keys), (tsv_file, image_keys[7:]),
+                              (shuffled_file, image_keys), (shuffled_file, image_keys[::-1])]:
+                result = list(sg_tsv_eval.iter_vrd_predictions(tsv, dataset.labelmap, keys))
+                self.assertEqual(len(result), len(keys))
+                for key, prediction in zip(keys, result):
+                    self.assertEqual(prediction.keys(), expected[key].keys())
+                    for name in prediction:
+                        self.assertTrue(torch.equal(prediction[name], expected[key][name]))
+
+            # a shard starting at start_row is read in lockstep, without
+            # indexing the keys of all the rows
+            tsv = TSVFile(tsv_file)
+            with mock.patch.object(sg_tsv_eval, 'TSVFile', return_value=tsv), \
+                    mock.patch.object(tsv, 'seek_first_column',
+                                      wraps=tsv.seek_first_column) as seek_first_column:
+                result = list(sg_tsv_eval.iter_vrd_predictions(
+                    tsv_file, dataset.labelmap, image_keys[7:12], start_row=7))
+            self.assertEqual(seek_first_column.call_count, 5)
+            for key, prediction in zip(image_keys[7:12], result):
+                self.assertTrue(torch.equal(prediction['bboxes'], expected[key]['bboxes']))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import unittest
+
+import torch
+
+from scene_graph_benchmark.relation_head.sparse_targets import _get_boxlist_offsets
+from scene_graph_benchmark.relation_head.sparse_targets import _get_rel_inds
+from scene_graph_benchmark.relation_head.sparse_targets import _get_tensor_from_boxlist
+from utils import random_proposals_and_pairs
+
+
+# the concatenate-in-a-loop implementation the helpers must agree with.
+def legacy_get_tensor_from_boxlist(proposals, field='labels'):
+    for im_ind, prop_per_im in enumerate(proposals):
+        num_proposals_im = prop_per_im.bbox.size(0)
+        if im_ind == 0:
+            bbox_batch = prop_per_im.bbox
+            output_batch = prop_per_im.extra_fields[field]
+            im_inds = im_ind * torch.ones(num_proposals_im, 1)
+        else:
+            bbox_batch = torch.cat((bbox_batch, prop_per_im.bbox), dim=0)
+            output_batch = torch.cat(
+                (output_batch, prop_per_im.extra_fields[field]), dim=0)
+            im_inds = torch.cat(
+                (im_inds, im_ind * torch.ones(num_proposals_im, 1)), dim=0)
+    return bbox_batch, output_batch, torch.Tensor(im_inds).long()
+
+
+def legacy_get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs):
+    proposal_idx_pairs = proposal_idx_pairs.clone()
+    rel_ind_sub = proposal_idx_pairs[:, 0]
+    rel_ind_obj = proposal_idx_pairs[:, 1]
+    _, num_obj_im = torch.unique(im_inds, return_counts=True)
+    num_obj_im = torch.cumsum(num_obj_im, dim=0)
+    rel_ind_offset_im = num_obj_im[im_inds_pairs - 1]
+    _, num_rels_im = torch.unique(im_inds_pairs, return_counts=True)
+    rel_ind_offset_im[:num_rels_im[0]] = 0
+    rel_ind_offset_im = torch.squeeze(rel_ind_offset_im)
+    rel_ind_sub += rel_ind_offset_im
+    rel_ind_obj += rel_ind_offset_im
+    return torch.cat((rel_ind_sub[:, None], rel_ind_obj[:, None]), 1)
+
+
+class TestSparseTargets(unittest.TestCase):
+    def test_tensor_from_boxlist(self):
+        proposals, proposal_pairs = random_proposals_and_pairs([4, 2, 5])
+        for boxlists, field in [(proposals, 'labels'), (proposals, 'scores_all'),
+                                (proposal_pairs, 'idx_pairs'), (proposals[:1], 'labels')]:
+            expected = legacy_get_tensor_from_boxlist(boxlists, field)
+            result = _get_tensor_from_boxlist(boxlists, field)
+            for r, e in zip(result, expected):
+                self.assertEqual(r.dtype, e.dtype)
+                self.assertTrue(torch.equal(r, e))
+        _, _, im_inds = _get_tensor_from_boxlist(proposals, 'labels', 'cpu')
+        self.assertEqual(im_inds.device, torch.device('cpu'))
+
+    def test_rel_inds(self):
+        proposals, proposal_pairs = random_proposals_and_pairs([4, 2, 5, 3])
+        _, _, im_inds = _get_tensor_from_boxlist(proposals, 'labels')
+        _, proposal_idx_pairs, im_inds_pairs = _get_tensor_from_boxlist(
+            proposal_pairs, 'idx_pairs')
+        expected = legacy_get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs)
+        offsets = _get_boxlist_offsets(proposals)
+        self.assertEqual(offsets.tolist(), [0, 4, 6, 11])
+        for kwargs in [{}, {'offsets': offsets}]:
+            result = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs,
+                                   len(proposals), **kwargs)
+            self.assertTrue(torch.equal(result, expected))
+
+    def test_rel_inds_image_without_boxes(self):
+        proposals, proposal_pairs = random_proposals_and_pairs([3, 0, 1, 2])
+        _, _, im_inds = _get_tensor_from_boxlist(proposals, 'labels')
+        _, proposal_idx_pairs, im_inds_pairs = _get_tensor_from_boxlist(
+            proposal_pairs, 'idx_pairs')
+        expected = torch.cat([pairs.get_field('idx_pairs') + offset for pairs, offset
+                              in zip(proposal_pairs, [0, 3, 3, 4])], 0)
+        for offsets in [None, _get_boxlist_offsets(proposals)]:
+            result = _get_rel_inds(im_inds, im_inds_pairs, proposal_idx_pairs,
+                                   len(proposals), offsets=offsets)
+            self.assertTrue(torch.equal(result, expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+# Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license.
+import base64
+import os
+import os.path as op
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from maskrcnn_benchmark.structures.tsv_file import TSVFile, create_lineidx
+from maskrcnn_benchmark.structures.tsv_file import convert_lineidx_to_8b
+from maskrcnn_benchmark.structures.tsv_file import find_line_starts
+from maskrcnn_benchmark.structures.tsv_file_ops import tsv_writer
+from maskrcnn_benchmark.structures.tsv_file_ops import convert_tsv_to_image_bin
+from maskrcnn_benchmark.structures.tsv_file_ops import image_bin_writer
+from maskrcnn_benchmark.structures.image_bin_file import ImageBinFile
+
+
+def _create_rows(num_rows=10):
+    return [['key_{}'.format(i), 'label_{}'.format(i), 'x' * i]
+            for i in range(num_rows)]
+
+
+class TestTSVFile(unittest.TestCase):
+    def _check_rows(self, tsv, rows):
+        self.assertEqual(len(tsv), len(rows))
+        for i, row in enumerate(rows):
+            self.assertEqual(tsv.seek(i), row)
+            self.assertEqual(tsv.get_key(i), row[0])
+
+    def test_text_lineidx(self):
+        rows = _create_rows()
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer(rows, tsv_file)
+            self.assertFalse(op.isfile(op.join(d, 'a.lineidx.8b')))
+            tsv = TSVFile(tsv_file)
+            self._check_rows(tsv, rows)
+            self.assertIsInstance(tsv._lineidx, list)
+
+    def test_binary_lineidx(self):
+        rows = _create_rows()
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer(rows, tsv_file, binary_lineidx=True)
+            tsv = TSVFile(tsv_file)
+            self._check_rows(tsv, rows)
+            self.assertIsInstance(tsv._lineidx, np.memmap)
+
+            with open(op.join(d, 'a.lineidx'), 'r') as fp:
+                text_idx = [int(i) for i in fp.read().split()]
+            np.testing.assert_array_equal(tsv._lineidx, text_idx)
+
+    def test_create_and_convert_lineidx(self):
+        rows = _create_rows()
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer(rows, tsv_file)
+            lineidx = op.join(d, 'a.lineidx')
+            os.remove(lineidx)
+            create_lineidx(tsv_file, lineidx, binary=True)
+            binary_idx = np.fromfile(lineidx + '.8b', dtype='<i8')
+
+            os.remove(lineidx + '.8b')
+            convert_lineidx_to_8b(lineidx)
+            np.testing.assert_array_equal(
+                np.fromfile(lineidx + '.8b', dtype='<i8'), binary_idx)
+            self._check_rows(TSVFile(tsv_file), rows)
+
+    def test_parallel_create_lineidx(self):
+        rows = _create_rows(100)
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer(rows, tsv_file)
+            lineidx = op.join(d, 'a.lineidx')
+            with open(lineidx, 'r') as fp:
+                expected = fp.read()
+            for num_workers in [1, 4]:
+                os.remove(lineidx)
+                create_lineidx(tsv_file, lineidx, num_workers=num_workers)
+                with open(lineidx, 'r') as fp:
+                    self.assertEqual(fp.read(), expected)
+            # byte ranges much smaller than a row
+            np.testing.assert_array_equal(
+                find_line_starts(tsv_file, num_workers=2, chunk_size=7),
+                [int(i) for i in expected.split()])
+
+    def test_buffered_tsv_writer(self):
+        rows = _create_rows(100)
+        # offsets are in bytes for both writers
+        rows[3][1] = 'caf\u00e9 \u2603'
+        with TemporaryDirectory() as d:
+            tsv_writer(rows, op.join(d, 'a.tsv'), binary_lineidx=True)
+            tsv_writer(rows, op.join(d, 'b.tsv'), binary_lineidx=True,
+                       buffer_size=100)
+            for ext in ['.tsv', '.lineidx', '.lineidx.8b']:
+                with open(op.join(d, 'a' + ext), 'rb') as fa, \
+                        open(op.join(d, 'b' + ext), 'rb') as fb:
+                    self.assertEqual(fa.read(), fb.read())
+            tsv = TSVFile(op.join(d, 'a.tsv'))
+            for i, row in enumerate(rows):
+                self.assertEqual(bytes(tsv.seek_column(i, 1)).decode('utf-8'), row[1])
+
+    def test_stale_binary_lineidx_removed(self):
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer(_create_rows(20), tsv_file, binary_lineidx=True)
+            rows = _create_rows(5)
+            tsv_writer(rows, tsv_file)
+            self.assertFalse(op.isfile(op.join(d, 'a.lineidx.8b')))
+            self._check_rows(TSVFile(tsv_file), rows)
+
+    def test_seek_bytes_and_column(self):
+        rows = _create_rows()
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer(rows, tsv_file, binary_lineidx=True)
+            tsv = TSVFile(tsv_file)
+            for i, row in enumerate(rows):
+                self.assertEqual([bytes(c).decode() for c in tsv.seek_bytes(i)], row)
+                for col in range(-len(row), len(row)):
+                    self.assertEqual(bytes(tsv.seek_column(i, col)).decode(), row[col])
+            self.assertEqual(bytes(tsv.seek_column(-1, 0)).decode(), rows[-1][0])
+            self.assertRaises(IndexError, tsv.seek_column, 0, 3)
+            self.assertRaises(IndexError, tsv.seek_column, 0, -4)
+
+    def test_seek_column_crlf(self):
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            with open(tsv_file, 'wb') as fp:
+                fp.write(b'a\tb\r\nc\td')
+            tsv = TSVFile(tsv_file, generate_lineidx=True)
+            self.assertEqual(bytes(tsv.seek_column(0, -1)), b'b')
+            self.assertEqual(bytes(tsv.seek_column(1, 1)), b'd')
+
+    def test_empty_binary_lineidx(self):
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer([], tsv_file, binary_lineidx=True)
+            self.assertEqual(len(TSVFile(tsv_file)), 0)
+
+
+class TestImageBinFile(unittest.TestCase):
+    def test_convert_tsv_to_image_bin(self):
+        images = [os.urandom(i * 7) for i in range(10)]
+        rows = [['key_{}'.format(i), base64.b64encode(img)]
+                for i, img in enumerate(images)]
+        with TemporaryDirectory() as d:
+            tsv_file = op.join(d, 'a.tsv')
+            tsv_writer(rows, tsv_file)
+            bin_file = convert_tsv_to_image_bin(tsv_file)
+            self.assertEqual(bin_file, op.join(d, 'a.bin'))
+
+            binidx = op.join(d, 'a.binidx')
+            offsets = np.fromfile(binidx, dtype='<i8')
+            os.remove(binidx)
+            bin_tsv = ImageBinFile(bin_file, generate_binidx=True)
+            np.testing.assert_array_equal(np.fromfile(binidx, dtype='<i8'), offsets)
+
+            self.assertEqual(len(bin_tsv), len(images))
+            for i, img in enumerate(images):
+                self.assertEqual(bin_tsv.get_key(i), 'key_{}'.format(i))
+                self.assertEqual(bytes(bin_tsv.seek_column(i, -1)), img)
+                self.assertEqual(bin_tsv.seek(i)[0], 'key_{}'.format(i))
+
+    def test_image_bin_writer_error(self):
+        def gen_rows():
+            yield 'key_0', os.urandom(10)
+            raise ValueError('bad row')
+
+        with TemporaryDirectory() as d:
+            bin_file = op.join(d, 'a.bin')
+            with self.assertRaises(ValueError):
+                image_bin_writer(gen_rows(), bin_file)
+            self.assertFalse(op.exists(bin_file))
+            self.assertFalse(op.exists(op.join(d, 'a.binidx')))
+            # the temporary file is removed too
+            self.assertEqual(os.listdir(d), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
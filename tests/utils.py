@@ -8,7 +8,12 @@ import env_tests.env as env_tests
 import os
 import copy
 
+import numpy as np
+import torch
+
 from maskrcnn_benchmark.config import cfg as g_cfg
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+from maskrcnn_benchmark.structures.bounding_box_pair import BoxPairList
 
 
 def get_config_root_path():
@@ -26,3 +31,37 @@ def load_config_from_file(file_path):
     ret = copy.deepcopy(g_cfg)
     ret.merge_from_file(file_path)
     return ret
+
+
+def random_boxes(rng, num_boxes):
+    ''' Random xyxy float32 boxes, with integer coordinates, from a numpy RandomState '''
+    xy = rng.randint(0, 60, size=(num_boxes, 2))
+    wh = rng.randint(1, 60, size=(num_boxes, 2))
+    return np.hstack((xy, xy + wh)).astype(np.float32)
+
+
+def random_proposals_and_pairs(num_boxes_per_image, seed=0, pair_keep_prob=1.0):
+    ''' Random proposals with labels and scores_all fields, and the proposal
+    pairs of the ordered pairs of different boxes, with their idx_pairs field.
+    With pair_keep_prob < 1, each pair is only kept with that probability '''
+    generator = torch.Generator().manual_seed(seed)
+    proposals, proposal_pairs = [], []
+    for num_boxes in num_boxes_per_image:
+        xy = torch.rand(num_boxes, 2, generator=generator) * 50
+        boxes = torch.cat((xy, xy + 10), 1)
+        proposal = BoxList(boxes, (100, 100))
+        proposal.add_field('labels', torch.randint(1, 10, (num_boxes,), generator=generator))
+        proposal.add_field('scores_all', torch.rand(num_boxes, 10, generator=generator))
+        proposals.append(proposal)
+
+        idx_pairs = torch.tensor([[s, o] for s in range(num_boxes)
+                                  for o in range(num_boxes) if s != o], dtype=torch.int64)
+        idx_pairs = idx_pairs.view(-1, 2)
+        if pair_keep_prob < 1:
+            keep = torch.rand(idx_pairs.size(0), generator=generator) < pair_keep_prob
+            idx_pairs = idx_pairs[keep]
+        pairs = BoxPairList(torch.cat((boxes[idx_pairs[:, 0]], boxes[idx_pairs[:, 1]]), 1),
+                            (100, 100))
+        pairs.add_field('idx_pairs', idx_pairs)
+        proposal_pairs.append(pairs)
+    return proposals, proposal_pairs
@@ -5,6 +5,7 @@ from PIL import Image
 
 from scene_graph_benchmark.scene_parser import SceneParser
 from scene_graph_benchmark.AttrRCNN import AttrRCNN
+from maskrcnn_benchmark.structures.image_list import to_image_list
 
 
 def cv2Img_to_Image(input_img):
@@ -27,7 +28,24 @@ def detect_objects_on_single_image(model, transforms, cv2_img):
 
     img_height = cv2_img.shape[0]
     img_width = cv2_img.shape[1]
+    return prediction_to_dets(model, prediction, img_width, img_height)
 
+
+def detect_objects_on_batch(model, img_inputs, img_sizes, size_divisible=0):
+    # img_inputs are the transformed images and img_sizes the
+    # (width, height) of the original ones, to scale the output boxes.
+    images = to_image_list(img_inputs, size_divisible).to(model.device)
+
+    with torch.no_grad():
+        predictions = model(images)
+        predictions = [prediction.to(torch.device("cpu"))
+                       for prediction in predictions]
+
+    return [prediction_to_dets(model, prediction, img_width, img_height)
+            for prediction, (img_width, img_height) in zip(predictions, img_sizes)]
+
+
+def prediction_to_dets(model, prediction, img_width, img_height):
     if isinstance(model, SceneParser):
         prediction_pred = prediction.prediction_pairs
         relations = prediction_pred.get_field("idx_pairs").tolist()
@@ -1,10 +1,14 @@
 # Copyright (c) 2021 Microsoft Corporation. Licensed under the MIT license. 
 
 import cv2
+import glob
+import os
 import os.path as op
 import argparse
 import json
+import time
 import torch
+from concurrent.futures import ThreadPoolExecutor
 
 from scene_graph_benchmark.scene_parser import SceneParser
 from scene_graph_benchmark.AttrRCNN import AttrRCNN
@@ -17,6 +21,8 @@ from maskrcnn_benchmark.data.datasets.utils.load_files import \
 from maskrcnn_benchmark.data.datasets.utils.load_files import load_labelmap_file
 from maskrcnn_benchmark.utils.miscellaneous import mkdir
 
+from tools.demo.detect_utils import cv2Img_to_Image
+from tools.demo.detect_utils import detect_objects_on_batch
 from tools.demo.detect_utils import detect_objects_on_single_image
 #from tools.demo.visual_utils import draw_bb, draw_rel
 
@@ -61,12 +67,191 @@ def restricted_float(x):
         raise argparse.ArgumentTypeError("%r not in range [0.0, 1.0]"%(x,))
     return x
 
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def collect_image_files(args):
+    # the images of a folder, a list file with one path per line or a
+    # glob pattern, in a deterministic order
+    if args.img_folder:
+        return sorted(op.join(args.img_folder, f) for f in os.listdir(args.img_folder)
+                      if op.splitext(f)[1].lower() in IMG_EXTENSIONS)
+    if args.img_list:
+        with open(args.img_list, 'r') as fp:
+            return [line.strip() for line in fp if line.strip()]
+    if glob.has_magic(args.img_file):
+        return sorted(glob.glob(args.img_file))
+    return [args.img_file]
+
+
+def iter_image_batches(img_files, transforms, batch_size, num_workers):
+    # decodes and transforms the images of the next batch on a thread pool
+    # while the model runs on the current one
+    def load(img_file):
+        cv2_img = cv2.imread(img_file)
+        if cv2_img is None:
+            return None
+        img_input, _ = transforms(cv2Img_to_Image(cv2_img), target=None)
+        return img_input, (cv2_img.shape[1], cv2_img.shape[0])
+
+    batches = [img_files[i:i + batch_size] for i in range(0, len(img_files), batch_size)]
+    with ThreadPoolExecutor(max(num_workers, 1)) as executor:
+        pending = [executor.submit(load, f) for f in batches[0]] if batches else []
+        for i, batch_files in enumerate(batches):
+            futures = pending
+            if i + 1 < len(batches):
+                pending = [executor.submit(load, f) for f in batches[i + 1]]
+            batch = []
+            for img_file, future in zip(batch_files, futures):
+                loaded = future.result()
+                if loaded is None:
+                    print("skip unreadable image: {}".format(img_file))
+                    continue
+                batch.append((img_file,) + loaded)
+            yield batch
+
+
+def get_save_file(img_file, output_dir=None):
+    save_file = op.splitext(img_file)[0] + ".causal_tde.json"
+    if output_dir:
+        save_file = op.join(output_dir, op.basename(save_file))
+    return save_file
+
+
+def save_graph(graph, save_file):
+    # save results in json format
+    with open(save_file, 'w') as f:
+        json.dump(graph, f, indent=4)
+
+
+def build_graph(img_file, dets, labelmaps, args):
+    rel_dets = []
+    if isinstance(dets, dict):
+        rel_dets = dets['relations']
+        dets = dets['objects']
+
+    for obj in dets:
+        obj["class"] = labelmaps['dataset'][obj["class"]]
+        obj["class"] = obj["class"].strip()
+    
+    if labelmaps['visual'] is not None:
+        dets = [d for d in dets if d['class'] in labelmaps['visual']]
+    if cfg.MODEL.ATTRIBUTE_ON and args.visualize_attr:
+        for obj in dets:
+            obj["attr"], obj["attr_conf"] = postprocess_attr(labelmaps['attribute'], obj["attr"], obj["attr_conf"])
+
+    if cfg.MODEL.RELATION_ON and args.visualize_relation:
+        for rel in rel_dets:
+            rel['class'] = labelmaps['relation'][rel['class']]
+            subj_rect = dets[rel['subj_id']]['rect']
+            rel['subj_center'] = [(subj_rect[0]+subj_rect[2])/2, (subj_rect[1]+subj_rect[3])/2]
+            obj_rect = dets[rel['obj_id']]['rect']
+            rel['obj_center'] = [(obj_rect[0]+obj_rect[2])/2, (obj_rect[1]+obj_rect[3])/2]
+
+
+    rects = [d["rect"] for d in dets]
+    scores = [d["conf"] for d in dets]
+
+    if cfg.MODEL.ATTRIBUTE_ON and args.visualize_attr:
+        attr_labels = [','.join(d["attr"]) for d in dets]
+        attr_scores = [d["attr_conf"] for d in dets]
+        labels = [attr_label+' '+d["class"]
+                  for d, attr_label in zip(dets, attr_labels)]
+    else:
+        labels = [d["class"] for d in dets]
+
+    #draw_bb(cv2_img, rects, labels, scores)
+    
+    graph = {"frame":img_file,
+             "nodes":[],
+             "edges":[],
+             "lighthouse":[]
+	    }
+
+    accepted_nodes = set()
+
+    for id,rect in enumerate(rects):
+        if scores[id] <= args.min_obj_score:
+            continue
+        accepted_nodes.add(id)
+        node = {"id": id, "bb": rect, "kg_mapping":[], "class": [labels[id].strip()], "confidence":[scores[id]], "expert": ["causal_tde"]}
+        graph["nodes"].append(node)
+
+    # merge(dets[rel['subj_id']]['rect'], dets[rel['obj_id']]['rect'])
+
+    for rel in rel_dets:
+        if rel['conf'] <= args.min_rel_score:
+            continue
+        if rel["subj_id"] in accepted_nodes and rel["obj_id"] in accepted_nodes:
+             edge = {"source": rel["subj_id"], "dest": rel["obj_id"], "bb": [], "class": [rel["class"]], "confidence": [rel["conf"]], "expert": ["causal_tde"]}
+             graph["edges"].append(edge)
+
+    return graph
+
+
+def check_save_files(img_files, output_dir=None):
+    # images with the same base name in different folders would overwrite
+    # each other's graph in output_dir
+    save_files = {}
+    for img_file in img_files:
+        save_file = get_save_file(img_file, output_dir)
+        if save_file in save_files:
+            raise ValueError("{} and {} would both save their graph to {}".format(
+                save_files[save_file], img_file, save_file))
+        save_files[save_file] = img_file
+
+
+def generate_sg_batch(model, transforms, img_files, labelmaps, args):
+    batch_size = cfg.TEST.IMS_PER_BATCH
+    if args.output_dir:
+        mkdir(args.output_dir)
+    # the graphs are written by a background thread, in order
+    writer = ThreadPoolExecutor(1)
+    writes = []
+    num_images, num_batches = 0, 0
+    start = time.time()
+    for batch in iter_image_batches(img_files, transforms, batch_size, args.num_workers):
+        if not batch:
+            continue
+        img_inputs = [img_input for _, img_input, _ in batch]
+        img_sizes = [img_size for _, _, img_size in batch]
+        batch_dets = detect_objects_on_batch(model, img_inputs, img_sizes,
+                                             cfg.DATALOADER.SIZE_DIVISIBILITY)
+        for (img_file, _, _), dets in zip(batch, batch_dets):
+            graph = build_graph(img_file, dets, labelmaps, args)
+            writes.append(writer.submit(save_graph, graph,
+                                        get_save_file(img_file, args.output_dir)))
+        num_images += len(batch)
+        num_batches += 1
+        if num_batches % args.log_period == 0:
+            print("processed {}/{} images, {:.2f} images/sec".format(
+                num_images, len(img_files), num_images / (time.time() - start)))
+    writer.shutdown(wait=True)
+    for write in writes:
+        write.result()
+    total_time = time.time() - start
+    print("generated {} scene graphs in {:.1f}s, {:.2f} images/sec".format(
+        num_images, total_time, num_images / max(total_time, 1e-6)))
+
+
 def main():
 
     parser = argparse.ArgumentParser(description="Object Detection Demo")
     parser.add_argument("--config_file", metavar="FILE",
                         help="path to config file")
-    parser.add_argument("--img_file", metavar="FILE", help="image path")
+    parser.add_argument("--img_file", metavar="FILE",
+                        help="image path, or a glob pattern of images to process in a batch")
+    parser.add_argument("--img_folder", metavar="DIR", default=None,
+                        help="folder of images to process in a batch")
+    parser.add_argument("--img_list", metavar="FILE", default=None,
+                        help="file with one image path per line to process in a batch")
+    parser.add_argument("--output_dir", metavar="DIR", default=None,
+                        help="folder to save the graphs of a batch, next to the images by default")
+    parser.add_argument("--num_workers", type=int, default=4,
+                        help="threads decoding the images of a batch")
+    parser.add_argument("--log_period", type=int, default=10,
+                        help="batches between two throughput logs")
     parser.add_argument("--labelmap_file", metavar="FILE",
                         help="labelmap file to select classes for visualizatioin")
     parser.add_argument("--save_file", required=False, type=str, default=None,
@@ -97,8 +282,15 @@ def main():
     cfg.merge_from_list(args.opts)
     cfg.freeze()
 
-    assert op.isfile(args.img_file), \
-        "Image: {} does not exist".format(args.img_file)
+    batch_mode = bool(args.img_folder or args.img_list
+                      or (args.img_file and glob.has_magic(args.img_file)))
+    if not batch_mode:
+        assert args.img_file and op.isfile(args.img_file), \
+            "Image: {} does not exist".format(args.img_file)
+    else:
+        # fails before loading the model
+        img_files = collect_image_files(args)
+        check_save_files(img_files, args.output_dir)
 
     output_dir = cfg.OUTPUT_DIR
     mkdir(output_dir)
@@ -118,97 +310,41 @@ def main():
                                                 cfg.DATASETS.LABELMAP_FILE)
     assert dataset_labelmap_file
     dataset_allmap = json.load(open(dataset_labelmap_file, 'r'))
-    dataset_labelmap = {int(val): key
-                        for key, val in dataset_allmap['label_to_idx'].items()}
+    labelmaps = {
+        'dataset': {int(val): key
+                    for key, val in dataset_allmap['label_to_idx'].items()},
+    }
     # visual_labelmap is used to select classes for visualization
     try:
-        visual_labelmap = load_labelmap_file(args.labelmap_file)
+        labelmaps['visual'] = load_labelmap_file(args.labelmap_file)
     except:
-        visual_labelmap = None
+        labelmaps['visual'] = None
 
     if cfg.MODEL.ATTRIBUTE_ON and args.visualize_attr:
-        dataset_attr_labelmap = {
+        labelmaps['attribute'] = {
             int(val): key for key, val in
             dataset_allmap['attribute_to_idx'].items()}
 
     if cfg.MODEL.RELATION_ON and args.visualize_relation:
-        dataset_relation_labelmap = {
+        labelmaps['relation'] = {
             int(val): key for key, val in
             dataset_allmap['predicate_to_idx'].items()}
 
     transforms = build_transforms(cfg, is_train=False)
+    if batch_mode:
+        generate_sg_batch(model, transforms, img_files, labelmaps, args)
+        return
+
     cv2_img = cv2.imread(args.img_file)
     dets = detect_objects_on_single_image(model, transforms, cv2_img)
-
-    if isinstance(model, SceneParser):
-        rel_dets = dets['relations']
-        dets = dets['objects']
-
-    for obj in dets:
-        obj["class"] = dataset_labelmap[obj["class"]]
-        obj["class"] = obj["class"].strip()
-    
-    if visual_labelmap is not None:
-        dets = [d for d in dets if d['class'] in visual_labelmap]
-    if cfg.MODEL.ATTRIBUTE_ON and args.visualize_attr:
-        for obj in dets:
-            obj["attr"], obj["attr_conf"] = postprocess_attr(dataset_attr_labelmap, obj["attr"], obj["attr_conf"])
-
-    if cfg.MODEL.RELATION_ON and args.visualize_relation:
-        for rel in rel_dets:
-            rel['class'] = dataset_relation_labelmap[rel['class']]
-            subj_rect = dets[rel['subj_id']]['rect']
-            rel['subj_center'] = [(subj_rect[0]+subj_rect[2])/2, (subj_rect[1]+subj_rect[3])/2]
-            obj_rect = dets[rel['obj_id']]['rect']
-            rel['obj_center'] = [(obj_rect[0]+obj_rect[2])/2, (obj_rect[1]+obj_rect[3])/2]
-
-
-    rects = [d["rect"] for d in dets]
-    scores = [d["conf"] for d in dets]
-
-    if cfg.MODEL.ATTRIBUTE_ON and args.visualize_attr:
-        attr_labels = [','.join(d["attr"]) for d in dets]
-        attr_scores = [d["attr_conf"] for d in dets]
-        labels = [attr_label+' '+d["class"]
-                  for d, attr_label in zip(dets, attr_labels)]
-    else:
-        labels = [d["class"] for d in dets]
-
-    #draw_bb(cv2_img, rects, labels, scores)
-    
-    graph = {"frame":args.img_file,
-             "nodes":[],
-             "edges":[],
-             "lighthouse":[]
-	    }
-
-    accepted_nodes = set()
-
-    for id,rect in enumerate(rects):
-        if scores[id] <= args.min_obj_score:
-            continue
-        accepted_nodes.add(id)
-        node = {"id": id, "bb": rect, "kg_mapping":[], "class": [labels[id].strip()], "confidence":[scores[id]], "expert": ["causal_tde"]}
-        graph["nodes"].append(node)
-
-    # merge(dets[rel['subj_id']]['rect'], dets[rel['obj_id']]['rect'])
-
-    for rel in rel_dets:
-        if rel['conf'] <= args.min_rel_score:
-            continue
-        if rel["subj_id"] in accepted_nodes and rel["obj_id"] in accepted_nodes:
-             edge = {"source": rel["subj_id"], "dest": rel["obj_id"], "bb": [], "class": [rel["class"]], "confidence": [rel["conf"]], "expert": ["causal_tde"]}
-             graph["edges"].append(edge)
+    graph = build_graph(args.img_file, dets, labelmaps, args)
 
     if not args.save_file:
-        save_file = op.splitext(args.img_file)[0] + ".causal_tde.json"
+        save_file = get_save_file(args.img_file)
     else:
         save_file = args.save_file
     print("save results to: {}".format(save_file))
-
-    # save results in json format
-    with open(save_file, 'w') as f:
-        json.dump(graph, f, indent=4)
+    save_graph(graph, save_file)
 
 
 if __name__ == "__main__":